@@ -1,23 +1,180 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort
+from flask import Response, stream_with_context, g, has_request_context
+from flask import before_render_template, template_rendered, get_template_attribute
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
+from flask import Request
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from sqlalchemy import tuple_, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+import click
 import os
-from datetime import datetime
+import base64
+import collections
+import csv
+import io
+import json
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 import mimetypes
+from urllib.parse import quote
+
+import extraction
+import ingest
+from blobstore import BlobStore, BlobWriter, TOUCH_INTERVAL
+import search as search_index
+import database
+import delivery
+import renditions
+import tokens
+import jobs
+import importer
+import synthetic
+import export
+import tiering
+import deltas
+import instrumentation
+import api
+import events
+import cache
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'DocuVault-Secret-Key-2025')
-# SQLite Database Configuration for Railway
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///docuvault.db'
+# Database from DATABASE_URL (PostgreSQL in production); defaults to SQLite in the instance folder
+app.config['SQLALCHEMY_DATABASE_URI'] = database.database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    database.install_sqlite_pragmas(database.sqlite_pragmas())
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+# Users are cached per process for this many seconds (0 disables); User writes invalidate
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+# ...and at most this many of them, least recently used dropped first
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1000))
+# Dashboard pagination
+app.config['DASHBOARD_PAGE_SIZE'] = int(os.environ.get('DASHBOARD_PAGE_SIZE', 50))
+app.config['DASHBOARD_MAX_PAGE_SIZE'] = 200
+# Comments shown per page on the file detail page (newest first, "load older" for the rest)
+app.config['COMMENT_PAGE_SIZE'] = int(os.environ.get('COMMENT_PAGE_SIZE', 20))
+# Text extraction for content search (run by the job worker)
+app.config['EXTRACTION_MAX_CHARS'] = int(os.environ.get('EXTRACTION_MAX_CHARS', extraction.DEFAULT_MAX_CHARS))
+
+# Content-addressed blob store; lives inside the upload folder (uploads/ab/cd/<sha256>)
+app.config['BLOB_FOLDER'] = os.environ.get('BLOB_FOLDER', app.config['UPLOAD_FOLDER'])
+# Unreferenced blobs younger than this are left alone by gc-blobs (uploads in flight)
+app.config['BLOB_GC_GRACE'] = timedelta(hours=1)
+# Resumable uploads: suggested chunk size and how long an idle session is kept
+app.config['UPLOAD_CHUNK_SIZE'] = 5 * 1024 * 1024
+app.config['UPLOAD_SESSION_TTL'] = timedelta(hours=24)
+# Thumbnail / preview renditions, kept next to the blob store and evicted LRU past this size
+app.config['RENDITION_FOLDER'] = os.environ.get('RENDITION_FOLDER', os.path.join(app.config['BLOB_FOLDER'], '.renditions'))
+app.config['RENDITION_CACHE_BYTES'] = int(os.environ.get('RENDITION_CACHE_BYTES', 512 * 1024 * 1024))
+app.config['RENDITION_MAX_AGE'] = 365 * 24 * 3600
+# Cold tier: compressed copies of non-current versions and of content neither uploaded nor read for
+# TIER_COLD_AFTER_DAYS, made by the recurring tier_storage job; read back through a small cache
+app.config['COLD_FOLDER'] = os.environ.get('COLD_FOLDER', os.path.join(app.config['BLOB_FOLDER'], '.cold'))
+app.config['COLD_CACHE_FOLDER'] = os.environ.get('COLD_CACHE_FOLDER', os.path.join(app.config['BLOB_FOLDER'], '.coldcache'))
+app.config['COLD_CACHE_BYTES'] = int(os.environ.get('COLD_CACHE_BYTES', 256 * 1024 * 1024))
+app.config['TIER_COLD_AFTER_DAYS'] = int(os.environ.get('TIER_COLD_AFTER_DAYS', 90))
+app.config['TIER_INTERVAL'] = timedelta(hours=int(os.environ.get('TIER_INTERVAL_HOURS', 24)))
+app.config['TIER_BATCH_SIZE'] = 100
+# Reads are recorded once an hour per blob; the blobs recently recorded are remembered up to this many
+app.config['BLOB_TOUCH_CACHE_SIZE'] = 10000
+# Reverse deltas ('off' or 'reverse'): a superseded version is stored as a diff against the
+# version that replaced it; every DELTA_SNAPSHOT_INTERVAL-th version stays in full
+app.config['DELTA_STORAGE'] = os.environ.get('DELTA_STORAGE', 'off')
+app.config['DELTA_FOLDER'] = os.environ.get('DELTA_FOLDER', os.path.join(app.config['BLOB_FOLDER'], '.delta'))
+app.config['DELTA_SNAPSHOT_INTERVAL'] = int(os.environ.get('DELTA_SNAPSHOT_INTERVAL', 10))
+# Versions are diffed in memory; larger ones (or ones replaced by a larger version) stay in full
+app.config['DELTA_MAX_BYTES'] = int(os.environ.get('DELTA_MAX_BYTES', deltas.MAX_SIZE))
+# Prometheus metrics at /metrics, for a bearer METRICS_TOKEN or an admin session. With several
+# worker processes, METRICS_DIR (shared by them) lets one scrape add up all of them.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')
+# Gauges counted in the database (job queue depth, storage per tier) are recounted at most this often
+app.config['METRICS_STATS_TTL'] = int(os.environ.get('METRICS_STATS_TTL', 300))
+# Requests running more SQL queries than this are logged (usually an N+1 in a template)
+app.config['QUERY_COUNT_WARNING'] = int(os.environ.get('QUERY_COUNT_WARNING', 30))
+# Opt-in sampling profiler: stacks of requests slower than PROFILE_SLOW_MS (0: off) are written
+# to PROFILE_FOLDER as flamegraph input
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PROFILE_SLOW_MS', 0))
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+app.config['PROFILE_FOLDER'] = os.environ.get('PROFILE_FOLDER', os.path.join(app.instance_path, 'profiles'))
+# Live dashboard updates over Server-Sent Events (/events). EVENTS_BACKEND carries events between
+# worker processes: 'local' (a single process), 'database' (a polled table) or 'redis'
+# (EVENTS_REDIS_URL, needs the redis package). An open stream ties up a synchronous worker, so pages
+# open theirs at EVENTS_URL: /events of the gevent process (Procfile 'events'), e.g.
+# https://events.example.com/events, or /events when the proxy routes that path to it. On another
+# origin, list the dashboard origins in EVENTS_ALLOWED_ORIGINS and share the session cookie
+# (SESSION_COOKIE_DOMAIN). Without EVENTS_URL only a gevent process serves live updates; a synchronous
+# one turns streams away unless EVENT_STREAM_SYNC_SECONDS allows them (each closed after that long).
+app.config['EVENTS_BACKEND'] = os.environ.get('EVENTS_BACKEND', 'database')
+app.config['EVENTS_REDIS_URL'] = os.environ.get('EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+app.config['EVENTS_POLL_INTERVAL'] = float(os.environ.get('EVENTS_POLL_INTERVAL', 1))
+app.config['EVENTS_RETENTION'] = 10000  # rows kept in the live_event table
+app.config['EVENTS_URL'] = os.environ.get('EVENTS_URL', '')
+app.config['EVENTS_ALLOWED_ORIGINS'] = [origin.strip() for origin in os.environ.get('EVENTS_ALLOWED_ORIGINS', '').split(',')
+                                        if origin.strip()]
+app.config['EVENT_STREAM_SYNC_SECONDS'] = int(os.environ.get('EVENT_STREAM_SYNC_SECONDS', 0))
+# Query-result and fragment cache (cache.py), invalidated when uploads, revisions, reviews and comments
+# commit. CACHE_BACKEND shares invalidations between worker processes: 'database' (a table, read
+# every CACHE_GENERATION_INTERVAL seconds), 'redis' (CACHE_REDIS_URL, also shares values), 'local'
+# (a single process) or 'none'. Cached dashboard rows carry signed thumbnail URLs, so they are
+# kept for at most half of DOWNLOAD_TOKEN_TTL.
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'database')
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', app.config['EVENTS_REDIS_URL'])
+app.config['CACHE_MAX_MB'] = int(os.environ.get('CACHE_MAX_MB', 64))
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 300))
+app.config['CACHE_GENERATION_INTERVAL'] = float(os.environ.get('CACHE_GENERATION_INTERVAL', 1))
+# Signed download URLs: valid for at least the TTL, identical within one window (cacheable)
+app.config['DOWNLOAD_TOKEN_TTL'] = int(os.environ.get('DOWNLOAD_TOKEN_TTL', 3600))
+app.config['DOWNLOAD_TOKEN_WINDOW'] = int(os.environ.get('DOWNLOAD_TOKEN_WINDOW', 900))
+# File bodies: 'none' (sent by Python), 'nginx' (X-Accel-Redirect) or 'sendfile' (X-Sendfile)
+app.config['FILE_OFFLOAD'] = os.environ.get('FILE_OFFLOAD', 'none')
+app.config['FILE_OFFLOAD_PREFIX'] = os.environ.get('FILE_OFFLOAD_PREFIX', '/_protected')
+# Background jobs, run by `flask docuvault worker` (the Procfile's worker process)
+app.config['JOB_CONCURRENCY'] = int(os.environ.get('JOB_CONCURRENCY', 4))
+app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', jobs.DEFAULT_MAX_ATTEMPTS))
+app.config['JOB_RETRY_BASE'] = int(os.environ.get('JOB_RETRY_BASE', 10))
+app.config['JOB_RETRY_MAX'] = int(os.environ.get('JOB_RETRY_MAX', 3600))
+app.config['JOB_RETENTION'] = timedelta(days=7)
 
 # Create upload directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+blob_store = BlobStore(app.config['BLOB_FOLDER'])
+rendition_cache = renditions.RenditionCache(app.config['RENDITION_FOLDER'], app.config['RENDITION_CACHE_BYTES'])
+cold_store = tiering.ColdStore(app.config['COLD_FOLDER'], app.config['COLD_CACHE_FOLDER'], app.config['COLD_CACHE_BYTES'])
+delta_store = deltas.DeltaStore(app.config['DELTA_FOLDER'], app.config['DELTA_MAX_BYTES'])
+download_tokens = tokens.DownloadTokens(app.config['SECRET_KEY'], ttl=app.config['DOWNLOAD_TOKEN_TTL'],
+                                        window=app.config['DOWNLOAD_TOKEN_WINDOW'])
+offload_locations = {}
+for location, folder in (('uploads', app.config['UPLOAD_FOLDER']), ('blobs', app.config['BLOB_FOLDER']),
+                         ('renditions', app.config['RENDITION_FOLDER']), ('cold', app.config['COLD_CACHE_FOLDER'])):
+    offload_locations.setdefault(os.path.abspath(folder), f"{app.config['FILE_OFFLOAD_PREFIX']}/{location}/")
+file_offload = delivery.Offload(app.config['FILE_OFFLOAD'], offload_locations)
+
+class UploadRequest(Request):
+    """Stream multipart file parts straight into the blob store.
+
+    Werkzeug would spool each part to a temporary file that the view then
+    copies; here the part is written, hashed and measured in one pass into
+    the blob store's temp area, and the view only has to rename it.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return blob_store.writer()
+
+app.request_class = UploadRequest
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
@@ -32,6 +189,140 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def encode_cursor(uploaded_at, file_id):
+    """Encode a (uploaded_at, id) keyset position as an opaque URL-safe token"""
+    raw = f"{uploaded_at.isoformat()}|{file_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor token, returning (uploaded_at, id) or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        uploaded_at, file_id = raw.split('|', 1)
+        return datetime.fromisoformat(uploaded_at), int(file_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def get_page_size():
+    """Read the per_page query parameter, clamped to the configured bounds"""
+    try:
+        per_page = int(request.args.get('per_page', app.config['DASHBOARD_PAGE_SIZE']))
+    except ValueError:
+        per_page = app.config['DASHBOARD_PAGE_SIZE']
+    return max(1, min(per_page, app.config['DASHBOARD_MAX_PAGE_SIZE']))
+
+# Bulk review: ids per UPDATE statement, and files per request
+REVIEW_BATCH_SIZE = 500
+REVIEW_MAX_FILES = 5000
+
+def get_file_filters():
+    """Read the admin dashboard filters from the query string"""
+    return {
+        'search': request.args.get('search', ''),
+        'department': request.args.get('department', ''),
+        'status': request.args.get('status', ''),
+        'type': request.args.get('type', ''),
+        'from': request.args.get('from', ''),
+        'to': request.args.get('to', ''),
+    }
+
+def parse_filter_date(value):
+    """A YYYY-MM-DD filter value as a datetime, or None when empty or malformed"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def upload_date_bounds(filters):
+    """(since, before) datetimes of the from/to date filters; the to date is inclusive, before is not"""
+    uploaded_from = parse_filter_date(filters.get('from'))
+    uploaded_to = parse_filter_date(filters.get('to'))
+    return uploaded_from, uploaded_to + timedelta(days=1) if uploaded_to else None
+
+def apply_file_filters(query, filters):
+    """Apply the admin dashboard filters to a File query"""
+    if filters.get('search'):
+        query = query.filter(search_clause(filters['search']))
+    if filters.get('department'):
+        query = query.filter(File.department_id == filters['department'])
+    if filters.get('status'):
+        query = query.filter(File.status == filters['status'])
+    if filters.get('type'):
+        query = query.filter(File.file_type == filters['type'])
+    uploaded_since, uploaded_before = upload_date_bounds(filters)
+    if uploaded_since:
+        query = query.filter(File.uploaded_at >= uploaded_since)
+    if uploaded_before:
+        query = query.filter(File.uploaded_at < uploaded_before)
+    return query
+
+def search_clause(text):
+    """Restrict File to search hits - through the FTS index when the database has one"""
+    connection = db.session.connection()
+    if search_index.is_available(connection):
+        match = search_index.build_match_query(text)
+        if not match:
+            return File.id.is_(None)
+        hits = db.text(f"SELECT rowid FROM {search_index.SEARCH_TABLE} "
+                       f"WHERE {search_index.SEARCH_TABLE} MATCH :match").bindparams(match=match)
+        return File.id.in_(hits.columns(db.column('rowid', db.Integer)))
+    # Other databases (PostgreSQL) fall back to case-insensitive LIKE
+    return or_(File.title.icontains(text, autoescape=True), File.description.icontains(text, autoescape=True),
+               File.revision_notes.icontains(text, autoescape=True))
+
+def paginate_files(query, cursor, per_page):
+    """Keyset-paginate a File query newest first on (uploaded_at, id).
+
+    Returns the rows of the page and the cursor of the next page (None on the last page).
+    """
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        query = query.filter(tuple_(File.uploaded_at, File.id) < position)
+    rows = query.order_by(File.uploaded_at.desc(), File.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1].uploaded_at, rows[-1].id)
+    return rows, next_cursor
+
+def comment_page(file_id, cursor, per_page):
+    """Comments on a file with their authors (one query), newest first, keyset-paginated on (created_at, id).
+
+    Returns the comments of the page and the cursor of the next, older page (None on the last page).
+    """
+    query = Comment.query.options(joinedload(Comment.user)).filter(Comment.file_id == file_id)
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        query = query.filter(tuple_(Comment.created_at, Comment.id) < position)
+    comments = query.order_by(Comment.created_at.desc(), Comment.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(comments) > per_page:
+        comments = comments[:per_page]
+        next_cursor = encode_cursor(comments[-1].created_at, comments[-1].id)
+    return comments, next_cursor
+
+def file_stats(uploaded_by=None, department_id=None):
+    """Document counts by status, file type and category, from a single GROUP BY.
+
+    Counts are global unless narrowed to one uploader and/or one department.
+    """
+    query = db.session.query(File.status, File.file_type, File.category, db.func.count(File.id))
+    if uploaded_by is not None:
+        query = query.filter(File.uploaded_by == uploaded_by)
+    if department_id is not None:
+        query = query.filter(File.department_id == department_id)
+    stats = {
+        'total': 0,
+        'status': {'pending': 0, 'approved': 0, 'rejected': 0},
+        'file_type': {},
+        'category': {},
+    }
+    for status, file_type, category, count in query.group_by(File.status, File.file_type, File.category):
+        stats['total'] += count
+        for key, value in (('status', status), ('file_type', file_type), ('category', category)):
+            stats[key][value] = stats[key].get(value, 0) + count
+    return stats
+
 # Database Models
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -64,8 +355,14 @@ class File(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     reviewed_at = db.Column(db.DateTime)
     reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Bumped by every review; reviewers send the version they saw (optimistic locking)
+    row_version = db.Column(db.Integer, default=1)
+    
+    # Content-addressed body (see Blob); legacy rows without it live at uploads/<filename>
+    blob_hash = db.Column(db.String(64), db.ForeignKey('blob.hash'), index=True)
     
     # Revision system fields
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'))
     parent_file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=True)
     version_number = db.Column(db.Integer, default=1)
     is_current_version = db.Column(db.Boolean, default=True)
@@ -77,24 +374,41 @@ class File(db.Model):
     
     # Self-referential relationship for revisions
     parent_file = db.relationship('File', remote_side=[id], backref='revisions')
+    document = db.relationship('Document', foreign_keys=[document_id], backref='versions')
     
-    def get_all_versions(self):
-        """Get all versions of this file (including self)"""
-        if self.parent_file_id:
-            # This is a revision, get the original file's all versions
-            return File.query.filter(
-                (File.id == self.parent_file_id) | (File.parent_file_id == self.parent_file_id)
-            ).order_by(File.version_number.desc()).all()
-        else:
-            # This is the original file, get all its revisions
-            return File.query.filter(
-                (File.id == self.id) | (File.parent_file_id == self.id)
-            ).order_by(File.version_number.desc()).all()
+    __table_args__ = (
+        # Keyset pagination of the dashboards (newest first)
+        db.Index('ix_file_uploaded_at_id', 'uploaded_at', 'id'),
+        # Department + status filters, ordered by upload date
+        db.Index('ix_file_department_status_uploaded_at', 'department_id', 'status', 'uploaded_at'),
+        db.Index('ix_file_file_type', 'file_type'),
+        # Per-user status counts and the department dashboard listing
+        db.Index('ix_file_uploaded_by_status', 'uploaded_by', 'status'),
+        db.Index('ix_file_uploaded_by_uploaded_at', 'uploaded_by', 'uploaded_at'),
+        # Version history of a document
+        db.Index('ix_file_document_version', 'document_id', 'version_number'),
+        # Latest review, part of the JSON API's change marker
+        db.Index('ix_file_reviewed_at', 'reviewed_at'),
+        # /uploads/<filename> lookups
+        db.Index('ux_file_filename', 'filename', unique=True),
+    )
+    
+    def get_all_versions(self, *options):
+        """Get all versions of this file (including self); options are loader options such as joinedload()"""
+        if self.document_id is None:
+            # Not backfilled yet (see backfill_documents); NULL would match every such file
+            return [self]
+        return File.query.options(*options).filter_by(document_id=self.document_id) \
+            .order_by(File.version_number.desc()).all()
     
     def get_latest_version(self):
         """Get the latest version of this file"""
-        all_versions = self.get_all_versions()
-        return all_versions[0] if all_versions else self
+        return self.document.current_version if self.document else self
+    
+    @property
+    def version_count(self):
+        """Number of versions of this file's document"""
+        return self.document.version_count if self.document else 1
     
     def get_original_file(self):
         """Get the original file (version 1)"""
@@ -102,6 +416,17 @@ class File(db.Model):
             return File.query.get(self.parent_file_id)
         return self
 
+class Document(db.Model):
+    """Lineage of a document: every version of a file shares one row"""
+    id = db.Column(db.Integer, primary_key=True)
+    current_version_id = db.Column(db.Integer, db.ForeignKey('file.id', use_alter=True,
+                                                             name='fk_document_current_version'))
+    version_count = db.Column(db.Integer, default=1, nullable=False)
+    next_version_number = db.Column(db.Integer, default=2, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    current_version = db.relationship('File', foreign_keys=[current_version_id], post_update=True)
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -110,10 +435,1008 @@ class Comment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='comments')
+    
+    __table_args__ = (
+        # Comments of a file, newest first
+        db.Index('ix_comment_file_created_at_id', 'file_id', 'created_at', 'id'),
+    )
+
+class DepartmentShare(db.Model):
+    """Sharing rule: users of grantee_department get access to department's files.
+
+    access is one of ACCESS_LEVELS; each level includes the ones before it.
+    A department can share with itself to open its files to colleagues.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    grantee_department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
+    access = db.Column(db.String(20), nullable=False, default='view')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('department_id', 'grantee_department_id', name='uq_department_share'),
+    )
+
+class ReviewHistory(db.Model):
+    """One approve/reject decision on a file"""
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False, index=True)
+    reviewer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    previous_status = db.Column(db.String(20))
+    status = db.Column(db.String(20), nullable=False)
+    reviewed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Blob(db.Model):
+    """A stored file body, shared by every File row with identical content"""
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 hex digest
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 'hot' (NULL on older rows): in the blob store; 'cold': compressed in the cold tier;
+    # 'delta': a reverse delta against base_hash (see deltas.py)
+    tier = db.Column(db.String(10), default='hot')
+    # Codec of the cold copy; 'none' once the content was found not worth compressing
+    codec = db.Column(db.String(10))
+    stored_size = db.Column(db.BigInteger)  # size in the cold tier / of the delta
+    archived_at = db.Column(db.DateTime)
+    base_hash = db.Column(db.String(64))
+
+class UploadSession(db.Model):
+    """A resumable chunked upload in progress"""
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class FileContent(db.Model):
+    """Plain text extracted from a stored file, fed into the search index"""
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id'), primary_key=True)
+    status = db.Column(db.String(20), default='pending')  # 'done', 'skipped', 'failed'
+    text = db.Column(db.Text)
+    error = db.Column(db.Text)
+    extracted_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # Latest extraction, part of the JSON API's change marker of searches
+        db.Index('ix_file_content_extracted_at', 'extracted_at'),
+    )
+
+class Job(db.Model):
+    """Background work queued by a request and run by the job worker (see jobs.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)  # JSON keyword arguments of the handler
+    status = db.Column(db.String(20), default='queued', nullable=False)  # 'running', 'done', 'dead'
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=jobs.DEFAULT_MAX_ATTEMPTS, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+class LiveEvent(db.Model):
+    """A dashboard event, kept for a while so every worker process picks it up (EVENTS_BACKEND=database)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    owner_id = db.Column(db.Integer)  # uploader of the file: the user whose dashboard shows it
+    data = db.Column(db.Text, nullable=False)  # JSON sent to the browser
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CacheGeneration(db.Model):
+    """Generation of a cache tag; bumping it orphans what was cached under the tag (CACHE_BACKEND=database)"""
+    tag = db.Column(db.String(100), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+# Every new original file starts a document; revisions join theirs in create_revision()
+@db.event.listens_for(db.session, 'before_flush')
+def start_documents(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, File) and obj.document is None and obj.document_id is None \
+                and obj.parent_file_id is None:
+            version_number = obj.version_number or 1
+            obj.document = Document(version_count=1, next_version_number=version_number + 1,
+                                    current_version=obj)
+
+# Keep the full-text index in step with File and Comment writes
+@db.event.listens_for(File, 'after_insert')
+@db.event.listens_for(File, 'after_update')
+def index_file_for_search(mapper, connection, target):
+    if search_index.is_available(connection):
+        search_index.index_file(connection, target)
+
+@db.event.listens_for(File, 'after_delete')
+def unindex_file_for_search(mapper, connection, target):
+    if search_index.is_available(connection):
+        search_index.remove_file(connection, target.id)
+
+@db.event.listens_for(Comment, 'after_insert')
+@db.event.listens_for(Comment, 'after_update')
+@db.event.listens_for(Comment, 'after_delete')
+def index_comment_for_search(mapper, connection, target):
+    if search_index.is_available(connection):
+        search_index.index_comments(connection, target.file_id)
+
+# Blob reference counts follow the File rows that point at them
+def change_blob_refs(connection, digest, delta):
+    if digest:
+        connection.execute(Blob.__table__.update().where(Blob.hash == digest)
+                           .values(ref_count=Blob.ref_count + delta))
+
+@db.event.listens_for(File, 'after_insert')
+def count_blob_ref(mapper, connection, target):
+    change_blob_refs(connection, target.blob_hash, 1)
+
+@db.event.listens_for(File, 'after_update')
+def move_blob_ref(mapper, connection, target):
+    history = db.inspect(target).attrs.blob_hash.history
+    if history.has_changes():
+        for digest in history.deleted:
+            change_blob_refs(connection, digest, -1)
+        for digest in history.added:
+            change_blob_refs(connection, digest, 1)
+
+@db.event.listens_for(File, 'after_delete')
+def release_blob_ref(mapper, connection, target):
+    change_blob_refs(connection, target.blob_hash, -1)
+
+_user_cache = collections.OrderedDict()  # user id -> (expires, snapshot), least recently used first
+_user_cache_lock = threading.Lock()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """Load the session's user, from the per-process cache when it is fresh"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+        if cached is not None and cached[0] <= now:
+            del _user_cache[user_id]
+            cached = None
+        if cached is not None:
+            _user_cache.move_to_end(user_id)
+    if cached is not None:
+        # A per-request copy, attached to this request's session without a query
+        return db.session.merge(cached[1], load=False)
+    user = db.session.get(User, int(user_id))
+    if user is not None and app.config['USER_CACHE_TTL'] > 0:
+        snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+        make_transient_to_detached(snapshot)
+        with _user_cache_lock:
+            _user_cache[user_id] = (now + app.config['USER_CACHE_TTL'], snapshot)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > app.config['USER_CACHE_SIZE']:
+                _user_cache.popitem(last=False)
+    return user
+
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def forget_cached_user(mapper, connection, target):
+    with _user_cache_lock:
+        _user_cache.pop(str(target.id), None)
+    invalidate_cache('users')
+
+# Access to a file: admins and the uploader always; others through DepartmentShare rules
+ACCESS_LEVELS = ('view', 'comment', 'revise')
+
+def file_with_access(criterion, action='view', options=()):
+    """Load a File and decide whether the current user may perform action on it, in one query.
+
+    options are loader options applied to the File (joinedload() of what the page shows).
+    Returns (file, allowed); file is None when no row matches criterion.
+    """
+    if current_user.role == 'admin':
+        return File.query.options(*options).filter(criterion).first(), True
+    granting = ACCESS_LEVELS[ACCESS_LEVELS.index(action):]
+    shared = db.exists().where(
+        DepartmentShare.department_id == File.department_id,
+        DepartmentShare.grantee_department_id == current_user.department_id,
+        DepartmentShare.access.in_(granting),
+    )
+    row = db.session.query(File, or_(File.uploaded_by == current_user.id, shared).label('allowed')) \
+        .options(*options).filter(criterion).first()
+    if row is None:
+        return None, False
+    return row[0], bool(row[1])
+
+def get_file_or_404(file_id, action='view', options=()):
+    """file_with_access() by id, aborting with 404 for unknown ids"""
+    file, allowed = file_with_access(File.id == file_id, action, options)
+    if file is None:
+        abort(404)
+    return file, allowed
+
+def blob_path(digest):
+    """Location of a blob's bytes: the blob store, or a copy restored from the cold tier or a reverse delta"""
+    path = blob_store.path(digest)
+    if os.path.exists(path):
+        return path
+    restored = cold_store.cached_path(digest)
+    if restored is None and delta_store.exists(digest):
+        restored = cold_store.cached_path(digest, source=lambda: delta_chunks(digest), kind='delta')
+    return restored or path
+
+def delta_chunks(digest):
+    """The bytes of a blob stored as a reverse delta; its base is restored first if it is not stored in full"""
+    yield from delta_store.iter_chunks(digest, blob_path(delta_store.base_of(digest)))
+
+def stored_file_path(file):
+    """Location of a File's bytes on disk"""
+    if file.blob_hash:
+        return blob_path(file.blob_hash)
+    return os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+
+def stored_file_source(file):
+    """What export.zip_stream() needs to read a File: its path, or the cold-tier bytes; None if missing"""
+    if file.blob_hash and not blob_store.exists(file.blob_hash):
+        if cold_store.find(file.blob_hash):
+            return cold_store.iter_chunks(file.blob_hash)
+        return delta_chunks(file.blob_hash) if delta_store.exists(file.blob_hash) else None
+    path = stored_file_path(file)
+    return path if os.path.exists(path) else None
+
+def register_blob(digest, size):
+    """Make sure a Blob row exists for stored content and mark it as recently used"""
+    blob = Blob.query.get(digest)
+    if blob is None:
+        try:
+            # Another request may be registering the same content concurrently
+            with db.session.begin_nested():
+                db.session.add(Blob(hash=digest, size=size, ref_count=0))
+        except IntegrityError:
+            pass
+        blob = Blob.query.get(digest)
+    blob.last_used_at = datetime.utcnow()
+    if blob.tier in ('cold', 'delta'):
+        # The content is back in the blob store; gc-blobs removes the stale cold copy or delta
+        blob.tier = 'hot'
+        blob.codec = blob.stored_size = blob.archived_at = blob.base_hash = None
+    return blob
+
+# Blobs whose last_used_at this process moved forward recently: hash -> time.monotonic()
+_blob_touches = {}
+_blob_touches_lock = threading.Lock()
+
+def touch_blob(digest):
+    """Record a read of a blob in Blob.last_used_at, at most once per TOUCH_INTERVAL.
+
+    Content that is still read stays out of the cold tier (cold_tier_candidates).
+    Written on a connection of its own, so the request's session is left alone.
+    """
+    now = time.monotonic()
+    with _blob_touches_lock:
+        touched = _blob_touches.get(digest)
+        if touched is not None and now - touched < TOUCH_INTERVAL:
+            return
+        if len(_blob_touches) >= app.config['BLOB_TOUCH_CACHE_SIZE']:
+            _blob_touches.clear()
+        _blob_touches[digest] = now
+    used_at = datetime.utcnow()
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(Blob.__table__.update().where(
+                Blob.hash == digest,
+                or_(Blob.last_used_at.is_(None), Blob.last_used_at < used_at - timedelta(seconds=TOUCH_INTERVAL)),
+            ).values(last_used_at=used_at))
+    except Exception:
+        # The read is served anyway; at worst the blob is archived a little early
+        app.logger.exception('Recording the use of blob %s failed', digest)
+
+def upload_head(upload):
+    """First bytes of an uploaded FileStorage, for content sniffing"""
+    if isinstance(upload.stream, BlobWriter):
+        return upload.stream.head
+    head = upload.stream.read(64)
+    upload.stream.seek(0)
+    return head
+
+def store_upload(upload):
+    """Move an uploaded FileStorage into the blob store. Returns (digest, size)."""
+    if isinstance(upload.stream, BlobWriter):
+        # Already written and hashed while the request body was parsed
+        digest, size, _ = upload.stream.commit()
+    else:
+        digest, size, _ = blob_store.ingest(upload.stream)
+    register_blob(digest, size)
+    return digest, size
+
+def new_stored_filename(original_filename):
+    """Unique public name of an upload, keeping its extension"""
+    return str(uuid.uuid4()) + '.' + original_filename.rsplit('.', 1)[1].lower()
+
+def create_file_record(title, description, category, original_filename, blob_hash, file_size):
+    """Add a new document uploaded by the current user to the session"""
+    new_file = File(
+        title=title,
+        description=description,
+        filename=new_stored_filename(original_filename),
+        original_filename=original_filename,
+        file_type=original_filename.rsplit('.', 1)[1].lower(),
+        file_size=file_size,
+        blob_hash=blob_hash,
+        category=category,
+        uploaded_by=current_user.id,
+        department_id=current_user.department_id
+    )
+    db.session.add(new_file)
+    return new_file
+
+def ensure_document(file):
+    """Id of file's document, starting one for its lineage if backfill_documents has not run yet"""
+    if file.document_id is not None:
+        return file.document_id
+    root_id = file.parent_file_id or file.id
+    rows = [(bool(is_current), version_number or 1, version_id)
+            for version_id, version_number, is_current in db.session.query(
+                File.id, File.version_number, File.is_current_version
+            ).filter(File.document_id.is_(None), or_(File.id == root_id, File.parent_file_id == root_id))
+            .with_for_update()]
+    if not rows:
+        # Another request started it while this one waited for the rows
+        db.session.refresh(file)
+        return file.document_id
+    document = lineage_document(rows)
+    db.session.add(document)
+    db.session.flush()
+    db.session.execute(db.update(File).where(File.id.in_([version_id for _, _, version_id in rows]))
+                       .values(document_id=document.id))
+    return document.id
+
+def create_revision(original_file, title, description, category, revision_notes,
+                    original_filename, blob_hash, file_size):
+    """Add a new version of original_file's document to the session"""
+    document_id = ensure_document(original_file)
+    # Claim the next version number first: the UPDATE holds the document row
+    # until commit, so concurrent revisions of one document are serialised
+    db.session.execute(db.update(Document).where(Document.id == document_id).values(
+        version_count=Document.version_count + 1,
+        next_version_number=Document.next_version_number + 1,
+    ))
+    next_version, previous_id = db.session.execute(
+        db.select(Document.next_version_number - 1, Document.current_version_id)
+        .where(Document.id == document_id)
+    ).one()
+    
+    # Only the previous current version needs its flag cleared
+    db.session.execute(db.update(File).where(File.id == previous_id).values(is_current_version=False))
+    
+    new_revision = File(
+        title=title,
+        description=description,
+        filename=new_stored_filename(original_filename),
+        original_filename=original_filename,
+        file_type=original_filename.rsplit('.', 1)[1].lower(),
+        file_size=file_size,
+        blob_hash=blob_hash,
+        category=category,
+        uploaded_by=current_user.id,
+        department_id=original_file.department_id,
+        document_id=document_id,
+        parent_file_id=original_file.parent_file_id or original_file.id,
+        version_number=next_version,
+        is_current_version=True,
+        revision_notes=revision_notes,
+        status='pending'  # New revisions need approval
+    )
+    db.session.add(new_revision)
+    db.session.flush()
+    db.session.execute(db.update(Document).where(Document.id == document_id)
+                       .values(current_version_id=new_revision.id))
+    if app.config['DELTA_STORAGE'] == 'reverse' and previous_id:
+        enqueue_job('encode_delta', file_id=previous_id)
+    return new_revision
+
+def save_file_content(file_id, text, error=None):
+    """Store extracted text (None when the type has no text) and push it into the search index"""
+    content = FileContent.query.get(file_id) or FileContent(file_id=file_id)
+    if error is not None:
+        content.status = 'failed'
+    else:
+        content.status = 'done' if text is not None else 'skipped'
+    content.text = text
+    content.error = error
+    content.extracted_at = datetime.utcnow()
+    db.session.add(content)
+    db.session.flush()
+    connection = db.session.connection()
+    if search_index.is_available(connection):
+        search_index.index_content(connection, file_id, text or '')
+    db.session.commit()
+
+job_handlers = {}
+
+def job_handler(kind):
+    """Register a function as the handler of a job kind; it runs in an app context"""
+    def register(handler):
+        def run(**payload):
+            with app.app_context():
+                return handler(**payload)
+        job_handlers[kind] = run
+        return handler
+    return register
+
+def enqueue_job(kind, delay=0, **payload):
+    """Queue a job in the current transaction; it becomes visible to workers on commit"""
+    job = Job(kind=kind, payload=json.dumps(payload), max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+              run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+def enqueue_upload_jobs(file):
+    """Queue the processing of a newly stored file"""
+    db.session.flush()
+    if file.file_type in extraction.EXTRACTABLE_TYPES:
+        enqueue_job('extract_text', file_id=file.id)
+    if rendition_cache.can_render(file.file_type):
+        enqueue_job('render_thumbnail', file_id=file.id)
+
+@job_handler('extract_text')
+def extract_file_content(file_id):
+    """Pull the text out of one uploaded file"""
+    file = File.query.get(file_id)
+    if file is None:
+        return
+    try:
+        text = extraction.extract_text(stored_file_path(file), file.file_type,
+                                       app.config['EXTRACTION_MAX_CHARS'])
+    except Exception as e:
+        save_file_content(file_id, None, error=str(e)[:500])
+        raise
+    save_file_content(file_id, text)
+
+@job_handler('render_thumbnail')
+def render_file_thumbnail(file_id, size='sm'):
+    """Render a file's dashboard thumbnail ahead of its first view"""
+    file = File.query.get(file_id)
+    if file is None:
+        return
+    source_path = stored_file_path(file)
+    if rendition_cache.get(rendition_key(storage_key(file)), size, source_path, file.file_type) is None:
+        raise RuntimeError(f'{file.original_filename} could not be rendered')
+
+def ensure_job_queued(kind, delay=0):
+    """Queue a job of kind unless one is already waiting; recurring jobs schedule their next run this way"""
+    if Job.query.filter_by(kind=kind, status='queued').first() is None:
+        enqueue_job(kind, delay)
+
+def cold_tier_candidates(cutoff, after, limit):
+    """Blobs due for the cold tier, in hash order after `after`.
+
+    Content referenced only by superseded versions is due at once; content
+    of a current version once it was neither stored nor read since cutoff
+    (last_used_at, see register_blob and touch_blob). Cold blobs are included
+    too, in case a hot copy reappeared next to the archive (an import staging
+    the same bytes again).
+    """
+    referenced_by_current = db.exists().where(File.blob_hash == Blob.hash, File.is_current_version.isnot(False))
+    last_used_at = db.func.coalesce(Blob.last_used_at, Blob.created_at)
+    file_type = db.select(db.func.min(File.file_type)).where(File.blob_hash == Blob.hash).scalar_subquery()
+    return db.session.query(Blob.hash, Blob.tier, Blob.codec, Blob.stored_size, file_type).filter(
+        Blob.hash > after,
+        Blob.ref_count > 0,
+        or_(Blob.tier.is_(None), Blob.tier != 'delta'),
+        or_(Blob.codec.is_(None), Blob.codec != 'none'),
+        or_(~referenced_by_current, last_used_at < cutoff),
+    ).order_by(Blob.hash).limit(limit).all()
+
+def archive_blob(candidate):
+    """Put one blob into the cold tier. Returns (hash, codec, stored size); codec 'none' if not worth it."""
+    digest, tier, codec, stored_size, file_type = candidate
+    if tier == 'cold' and cold_store.find(digest) == codec:
+        return digest, codec, stored_size
+    codec = tiering.codec_for(file_type)
+    if codec is None:
+        return digest, 'none', None
+    stored_size = cold_store.archive(blob_store.path(digest), digest, codec)
+    return (digest, codec, stored_size) if stored_size is not None else (digest, 'none', None)
+
+def tier_storage(workers=2, dry_run=False, log=print):
+    """Move the blobs that are due into the cold tier and remove their uncompressed copies.
+
+    Compression runs on a thread pool (lzma and zstd release the GIL). Rows
+    are updated and committed before any uncompressed copy is removed, so an
+    interruption leaves at worst a blob in both tiers. Returns counters.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=app.config['TIER_COLD_AFTER_DAYS'])
+    counters = dict.fromkeys(('archived', 'not_worth', 'healed', 'failed', 'bytes_in', 'bytes_out'), 0)
+    blob_table = Blob.__table__
+    after = ''
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tier') as pool:
+        while True:
+            batch = cold_tier_candidates(cutoff, after, app.config['TIER_BATCH_SIZE'])
+            if not batch:
+                break
+            after = batch[-1].hash
+            due = []
+            for candidate in batch:
+                if blob_store.exists(candidate.hash):
+                    due.append(candidate)
+                elif candidate.tier != 'cold' and cold_store.find(candidate.hash):
+                    # Archived, but the row was reset by an upload racing the removal of the hot copy
+                    codec = cold_store.find(candidate.hash)
+                    counters['healed'] += 1
+                    db.session.execute(blob_table.update().where(Blob.hash == candidate.hash).values(
+                        tier='cold', codec=codec, archived_at=datetime.utcnow(),
+                        stored_size=os.path.getsize(cold_store.path(candidate.hash, codec))))
+            if dry_run:
+                for candidate in due:
+                    counters['archived' if tiering.codec_for(candidate[-1]) else 'not_worth'] += 1
+                continue
+            
+            def archive(candidate):
+                try:
+                    return archive_blob(candidate)
+                except Exception as e:
+                    log(f"  ⚠️ {candidate.hash}: {e}")
+                    return None
+            results = [result for result in pool.map(archive, due) if result is not None]
+            counters['failed'] += len(due) - len(results)
+            now = datetime.utcnow()
+            archived = [{'b_hash': digest, 'codec': codec, 'stored_size': stored_size, 'archived_at': now}
+                        for digest, codec, stored_size in results if codec != 'none']
+            not_worth = [{'b_hash': digest} for digest, codec, _ in results if codec == 'none']
+            if archived:
+                db.session.execute(
+                    blob_table.update().where(Blob.hash == db.bindparam('b_hash'))
+                    .values(tier='cold', codec=db.bindparam('codec'), stored_size=db.bindparam('stored_size'),
+                            archived_at=db.bindparam('archived_at')),
+                    archived)
+            if not_worth:
+                db.session.execute(
+                    blob_table.update().where(Blob.hash == db.bindparam('b_hash')).values(codec='none'),
+                    not_worth)
+            db.session.commit()
+            for row in archived:
+                counters['bytes_in'] += os.path.getsize(blob_store.path(row['b_hash']))
+                counters['bytes_out'] += row['stored_size']
+                blob_store.delete(row['b_hash'])
+            counters['archived'] += len(archived)
+            counters['not_worth'] += len(not_worth)
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    return counters
+
+@job_handler('tier_storage')
+def tier_storage_job():
+    """Recurring: move due blobs into the cold tier, then schedule the next run"""
+    tier_storage()
+    ensure_job_queued('tier_storage', delay=app.config['TIER_INTERVAL'].total_seconds())
+    db.session.commit()
+
+def encode_delta(file):
+    """Store a superseded version as a reverse delta against the version that replaced it.
+
+    Returns the delta's size, or None when the version stays in full: a
+    snapshot, content still current elsewhere, not stored plainly, larger
+    than DELTA_MAX_BYTES, or a delta that would not save enough.
+    """
+    if file.is_current_version is not False or not file.blob_hash or file.document_id is None:
+        return None
+    if file.version_number % app.config['DELTA_SNAPSHOT_INTERVAL'] == 0:
+        return None
+    blob = db.session.get(Blob, file.blob_hash)
+    if blob is None or blob.tier in ('cold', 'delta') or not blob_store.exists(blob.hash):
+        return None
+    if File.query.filter(File.blob_hash == blob.hash, File.is_current_version.isnot(False)).first():
+        return None
+    newer = File.query.filter(File.document_id == file.document_id, File.version_number > file.version_number,
+                              File.blob_hash.isnot(None)).order_by(File.version_number).first()
+    if newer is None:
+        return None
+    # The base's own chain must not lead back to this content (a document reverted to it)
+    base = db.session.get(Blob, newer.blob_hash)
+    seen = set()
+    while base is not None and base.hash not in seen:
+        if base.hash == blob.hash:
+            return None
+        seen.add(base.hash)
+        base = db.session.get(Blob, base.base_hash) if base.tier == 'delta' else None
+    
+    stored_size = delta_store.store(blob.hash, blob_store.path(blob.hash), newer.blob_hash,
+                                    blob_path(newer.blob_hash))
+    if stored_size is None:
+        return None
+    blob.tier = blob.codec = 'delta'
+    blob.base_hash = newer.blob_hash
+    blob.stored_size = stored_size
+    blob.archived_at = datetime.utcnow()
+    db.session.commit()
+    blob_store.delete(blob.hash)
+    return stored_size
+
+@job_handler('encode_delta')
+def encode_delta_job(file_id):
+    """Delta-encode the version a new revision replaced"""
+    file = db.session.get(File, file_id)
+    if file is not None:
+        encode_delta(file)
+
+def storage_stats():
+    """Blobs, files and bytes per storage tier, and the read side of the cold tier.
+
+    saved_bytes is what the files would take as plain copies minus what the
+    tier stores: deduplication in the hot tier, deduplication and
+    compression in the cold tier, reverse deltas in the delta tier.
+    """
+    tier = db.func.coalesce(Blob.tier, 'hot')
+    tiers = {}
+    for name, blobs, blob_bytes, stored_bytes in db.session.query(
+            tier, db.func.count(), db.func.sum(Blob.size), db.func.sum(Blob.stored_size)).group_by(tier):
+        stored_bytes = (stored_bytes or 0) if name in ('cold', 'delta') else (blob_bytes or 0)
+        tiers[name] = {'blobs': blobs, 'blob_bytes': blob_bytes or 0, 'stored_bytes': stored_bytes,
+                       'files': 0, 'file_bytes': 0}
+    for name, files, file_bytes in db.session.query(tier, db.func.count(), db.func.sum(Blob.size)) \
+            .join(File, File.blob_hash == Blob.hash).group_by(tier):
+        tiers[name].update(files=files, file_bytes=file_bytes or 0)
+    for values in tiers.values():
+        values['saved_bytes'] = values['file_bytes'] - values['stored_bytes']
+    return {
+        'tiers': tiers,
+        'saved_bytes': sum(values['saved_bytes'] for values in tiers.values()),
+        'cold_reads': cold_store.stats(),
+    }
+
+def job_depth():
+    """Number of jobs by kind and status"""
+    depth = {}
+    for kind, status, count in db.session.query(Job.kind, Job.status, db.func.count()) \
+            .group_by(Job.kind, Job.status):
+        depth.setdefault(kind, dict.fromkeys(jobs.STATUSES, 0))[status] = count
+    return depth
+
+def job_stats():
+    """Queue depth by kind and status, and wait/run times of recently finished jobs"""
+    depth = job_depth()
+    now = datetime.utcnow()
+    oldest = db.session.query(db.func.min(Job.run_at)) \
+        .filter(Job.status == 'queued', Job.run_at <= now).scalar()
+    recent = db.session.query(Job.kind, Job.run_at, Job.started_at, Job.finished_at) \
+        .filter(Job.status == 'done', Job.finished_at >= now - timedelta(hours=1)) \
+        .order_by(Job.finished_at.desc()).limit(1000).all()
+    latency = {}
+    for kind, run_at, started_at, finished_at in recent:
+        waits, runs = latency.setdefault(kind, ([], []))
+        waits.append((started_at - run_at).total_seconds())
+        runs.append((finished_at - started_at).total_seconds())
+    
+    def summary(values):
+        values = sorted(values)
+        return {'avg': round(sum(values) / len(values), 3), 'p95': round(values[int(len(values) * 0.95)], 3)}
+    
+    return {
+        'depth': depth,
+        'oldest_due_seconds': round((now - oldest).total_seconds(), 1) if oldest else 0,
+        'latency': {kind: {'jobs': len(waits), 'wait': summary(waits), 'run': summary(runs)}
+                    for kind, (waits, runs) in latency.items()},
+    }
+
+def extraction_backlog_query():
+    """Extractable files that have no extracted content yet"""
+    return File.query.outerjoin(FileContent, FileContent.file_id == File.id) \
+        .filter(FileContent.file_id.is_(None), File.file_type.in_(extraction.EXTRACTABLE_TYPES))
+
+# Live dashboard events: views queue them with publish_event(); they go out once the session commits
+def insert_live_events(pending):
+    table = LiveEvent.__table__
+    with app.app_context(), db.engine.begin() as connection:
+        ids = connection.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), [
+            {'kind': event['type'], 'owner_id': event['owner'], 'data': json.dumps(event['data']),
+             'created_at': datetime.utcnow()} for event in pending]).scalars().all()
+        connection.execute(table.delete().where(table.c.id <= ids[-1] - app.config['EVENTS_RETENTION']))
+
+def fetch_live_events(after_id, limit):
+    table = LiveEvent.__table__
+    with app.app_context(), db.engine.connect() as connection:
+        rows = connection.execute(db.select(table).where(table.c.id > after_id).order_by(table.c.id).limit(limit))
+        return [{'id': row.id, 'type': row.kind, 'owner': row.owner_id, 'data': json.loads(row.data)}
+                for row in rows]
+
+def latest_live_event():
+    with app.app_context(), db.engine.connect() as connection:
+        return connection.execute(db.select(db.func.max(LiveEvent.id))).scalar() or 0
+
+def create_events_backend(name):
+    if name == 'redis':
+        return events.RedisBackend(app.config['EVENTS_REDIS_URL'])
+    if name == 'database':
+        return events.DatabaseBackend(insert_live_events, fetch_live_events, latest_live_event,
+                                      app.config['EVENTS_POLL_INTERVAL'])
+    return events.LocalBackend()
+
+live_events = events.Broker(create_events_backend(app.config['EVENTS_BACKEND']))
+
+def serves_event_streams():
+    """Whether this process holds /events streams without starving other requests"""
+    return events.cooperative() or app.config['EVENT_STREAM_SYNC_SECONDS'] > 0
+
+def live_events_url():
+    """URL a dashboard rendered now streams its live updates from, or None when they are off"""
+    position = live_events.position()
+    if app.config['EVENTS_URL']:
+        separator = '&' if '?' in app.config['EVENTS_URL'] else '?'
+        return f"{app.config['EVENTS_URL']}{separator}last_event_id={position}"
+    if serves_event_streams():
+        return url_for('event_stream', last_event_id=position)
+    return None
+
+def publish_event(kind, file_id, owner_id, **data):
+    """Queue a dashboard event about a file; it is sent when the session commits.
+
+    kind is 'upload', 'revision', 'status' or 'comment'. Admins get every
+    event, other users those about the files they uploaded.
+    """
+    db.session.info.setdefault('live_events', []).append(
+        {'type': kind, 'owner': owner_id, 'data': dict(data, file_id=file_id)})
+
+def publish_new_file(file):
+    """Queue the 'upload' or 'revision' event of a file added to the session (and flushed)"""
+    invalidate_cache(*file_cache_tags(file.uploaded_by, file.department_id))
+    publish_event('revision' if file.parent_file_id else 'upload', file.id, file.uploaded_by,
+                  status=file.status, document_id=file.document_id, version_number=file.version_number)
+
+@db.event.listens_for(db.session, 'after_commit')
+def send_live_events(session):
+    pending = session.info.pop('live_events', None)
+    if pending:
+        try:
+            live_events.publish(pending)
+        except Exception:
+            # The change is committed; open dashboards only miss the live update
+            app.logger.exception('Publishing %d live events failed', len(pending))
+
+@db.event.listens_for(db.session, 'after_rollback')
+def drop_live_events(session):
+    session.info.pop('live_events', None)
+
+# Query-result and fragment cache: views read through query_cache.get(); writers queue the tags
+# they change with invalidate_cache(), which are bumped once the session commits
+def fetch_cache_generations(tags):
+    table = CacheGeneration.__table__
+    with app.app_context(), db.engine.connect() as connection:
+        return dict(connection.execute(db.select(table.c.tag, table.c.generation).where(table.c.tag.in_(tags))).all())
+
+def bump_cache_generations(tags):
+    table = CacheGeneration.__table__
+    for attempt in range(2):
+        try:
+            with app.app_context(), db.engine.begin() as connection:
+                bumped = set(connection.execute(table.update().where(table.c.tag.in_(tags))
+                                                .values(generation=table.c.generation + 1)
+                                                .returning(table.c.tag)).scalars())
+                missing = [tag for tag in tags if tag not in bumped]
+                if missing:
+                    connection.execute(table.insert(), [{'tag': tag, 'generation': 1} for tag in missing])
+            return
+        except IntegrityError:
+            # Another process created one of the rows first; it exists now, so update again
+            if attempt:
+                raise
+
+def create_cache_backend(name):
+    if name == 'none':
+        return None
+    if name == 'redis':
+        return cache.RedisBackend(app.config['CACHE_REDIS_URL'])
+    if name == 'database':
+        return cache.DatabaseBackend(fetch_cache_generations, bump_cache_generations,
+                                     app.config['CACHE_GENERATION_INTERVAL'])
+    return cache.LocalBackend()
+
+query_cache = cache.Cache(create_cache_backend(app.config['CACHE_BACKEND']),
+                          max_bytes=app.config['CACHE_MAX_MB'] * 1024 * 1024, ttl=app.config['CACHE_TTL'])
+
+def invalidate_cache(*tags):
+    """Queue cache tags to invalidate when the session commits"""
+    db.session.info.setdefault('cache_tags', set()).update(tags)
+
+def file_cache_tags(uploaded_by, department_id):
+    """Tags of what a change to a file's row affects: every file list and the stats of its uploader and department"""
+    return 'files', f'files:user:{uploaded_by}', f'files:department:{department_id}'
+
+@db.event.listens_for(db.session, 'after_commit')
+def send_cache_invalidations(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        try:
+            query_cache.invalidate(tags)
+        except Exception:
+            # Entries of these tags are served until they expire (CACHE_TTL)
+            app.logger.exception('Invalidating cache tags %s failed', sorted(tags))
+
+@db.event.listens_for(db.session, 'after_rollback')
+def drop_cache_invalidations(session):
+    session.info.pop('cache_tags', None)
+
+@db.event.listens_for(Department, 'after_insert')
+@db.event.listens_for(Department, 'after_update')
+@db.event.listens_for(Department, 'after_delete')
+def invalidate_departments(mapper, connection, target):
+    invalidate_cache('departments')
+
+def cached_departments():
+    """id, name and description of every department, for filter menus and the API's change markers"""
+    return query_cache.get('departments', None, ['departments'], lambda: [
+        {'id': department.id, 'name': department.name, 'description': department.description}
+        for department in Department.query.all()])
+
+def cached_file_stats(uploaded_by=None, department_id=None):
+    """file_stats() through the cache"""
+    tags = []
+    if uploaded_by is not None:
+        tags.append(f'files:user:{uploaded_by}')
+    if department_id is not None:
+        tags.append(f'files:department:{department_id}')
+    return query_cache.get('file_stats', (uploaded_by, department_id), tags or ['files'],
+                           lambda: file_stats(uploaded_by, department_id))
+
+def dashboard_page(name, key, tags, query, cursor, per_page, card, row):
+    """A page of a dashboard rendered with the card and row macros of _dashboard_rows.html, through the cache.
+
+    Returns a dict with the cards and rows markup, count and next_cursor.
+    """
+    def render():
+        files, next_cursor = paginate_files(query, cursor, per_page)
+        card_macro, row_macro = (get_template_attribute('_dashboard_rows.html', macro) for macro in (card, row))
+        return {'count': len(files), 'next_cursor': next_cursor,
+                'cards': Markup(''.join(card_macro(file) for file in files)),
+                'rows': Markup(''.join(row_macro(file) for file in files))}
+    return query_cache.get(name, (key, cursor, per_page), tags, render,
+                           ttl=min(app.config['CACHE_TTL'], app.config['DOWNLOAD_TOKEN_TTL'] // 2))
+
+# Instrumentation: per-route latency, SQL and template time per request, file bytes sent
+metrics = instrumentation.Registry(app.config['METRICS_DIR'])
+request_seconds = metrics.histogram(
+    'docuvault_request_duration_seconds', 'Time until the response is returned (streamed bodies excluded)',
+    ('endpoint', 'method', 'status'))
+request_queries = metrics.histogram(
+    'docuvault_request_queries', 'SQL queries run by one request', ('endpoint',), instrumentation.COUNT_BUCKETS)
+request_sql_seconds = metrics.histogram(
+    'docuvault_request_sql_seconds', 'Time spent in SQL by one request', ('endpoint',))
+template_seconds = metrics.histogram(
+    'docuvault_template_render_seconds', 'Template render time', ('template',))
+file_bytes_sent = metrics.counter(
+    'docuvault_file_bytes_sent_total', 'File body bytes sent by Python (offloaded bodies count 0)',
+    ('endpoint', 'delivery'))
+file_responses = metrics.counter(
+    'docuvault_file_responses_total', 'Responses of the file routes', ('endpoint', 'delivery', 'status'))
+many_queries = metrics.counter(
+    'docuvault_requests_over_query_limit_total', 'Requests over QUERY_COUNT_WARNING queries', ('endpoint',))
+FILE_ENDPOINTS = {'preview_file', 'uploaded_file', 'signed_download', 'file_thumbnail', 'signed_thumbnail'}
+profiler = instrumentation.SamplingProfiler(app.config['PROFILE_FOLDER'], app.config['PROFILE_INTERVAL_MS'] / 1000) \
+    if app.config['PROFILE_SLOW_MS'] else None
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_seconds = 0.0
+    g.template_started = []
+    if profiler is not None:
+        profiler.start()
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    if 'template_started' in g:
+        g.template_started.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    if g.get('template_started'):
+        template_seconds.observe(time.perf_counter() - g.template_started.pop(),
+                                 template=template.name or '<string>')
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    endpoint = request.endpoint or 'none'
+    elapsed = time.perf_counter() - g.request_started
+    request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    request_queries.observe(g.sql_queries, endpoint=endpoint)
+    request_sql_seconds.observe(g.sql_seconds, endpoint=endpoint)
+    if endpoint in FILE_ENDPOINTS:
+        handoff = 'offload' if 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers \
+            else 'python'
+        file_responses.inc(endpoint=endpoint, delivery=handoff, status=response.status_code)
+        file_bytes_sent.inc(0 if handoff == 'offload' else response.content_length or 0,
+                            endpoint=endpoint, delivery=handoff)
+    if g.sql_queries > app.config['QUERY_COUNT_WARNING']:
+        many_queries.inc(endpoint=endpoint)
+        app.logger.warning('%s %s (%s) ran %d SQL queries, %.1f ms in SQL, %.1f ms in total',
+                           request.method, request.full_path.rstrip('?'), endpoint, g.sql_queries,
+                           g.sql_seconds * 1000, elapsed * 1000)
+    metrics.flush()
+    return response
+
+@app.teardown_request
+def dump_slow_request_profile(exc):
+    if profiler is None or 'request_started' not in g:
+        return
+    samples = profiler.stop()
+    elapsed_ms = (time.perf_counter() - g.request_started) * 1000
+    if elapsed_ms >= app.config['PROFILE_SLOW_MS']:
+        path = profiler.dump(samples, f"{request.endpoint or 'none'}-{elapsed_ms:.0f}ms")
+        if path:
+            app.logger.warning('slow request %s %s (%.0f ms), profile: %s',
+                               request.method, request.full_path.rstrip('?'), elapsed_ms, path)
+
+# Counters the caches and the event broker keep themselves; they go into the snapshots
+# (METRICS_DIR) like the counters above, so a scrape adds up every process
+def stats_counter(read_stats, names):
+    return lambda: {(name,): read_stats()[name] for name in names}
+
+metrics.counter_function('docuvault_rendition_cache_events_total', 'Rendition cache events', ('event',),
+                         stats_counter(rendition_cache.stats,
+                                       ('hits', 'misses', 'waits', 'renders', 'failed', 'evicted')))
+metrics.counter_function('docuvault_restore_cache_events_total', 'Cold/delta restore cache events', ('event',),
+                         stats_counter(cold_store.stats, ('hits', 'misses', 'waits', 'evicted')))
+metrics.counter_function('docuvault_live_events_total', 'Live events published, delivered to and dropped by streams',
+                         ('event',), stats_counter(live_events.stats, ('published', 'delivered', 'dropped')))
+metrics.counter_function('docuvault_cache_events_total', 'Query/fragment cache lookups by cache and result',
+                         ('cache', 'event'), lambda: dict(query_cache.stats()['events']))
+metrics.counter_function('docuvault_cache_invalidations_total', 'Cache tags invalidated', (),
+                         lambda: {(): query_cache.stats()['invalidations']})
+metrics.counter_function('docuvault_cache_evictions_total', 'Cache entries evicted to stay within CACHE_MAX_MB', (),
+                         lambda: {(): query_cache.stats()['evicted']})
+
+_scraped_stats = {'expires': 0.0, 'values': None}
+_scraped_stats_lock = threading.Lock()
+
+def scraped_database_stats():
+    """Job queue depth and storage per tier for /metrics, recomputed at most every METRICS_STATS_TTL seconds"""
+    with _scraped_stats_lock:
+        if _scraped_stats['expires'] <= time.monotonic():
+            _scraped_stats['values'] = {'depth': job_depth(), 'storage': storage_stats()['tiers']}
+            _scraped_stats['expires'] = time.monotonic() + app.config['METRICS_STATS_TTL']
+        return _scraped_stats['values']
+
+@metrics.collector
+def collect_app_metrics():
+    """Queue depth and storage per tier (cached), and this process' cache and stream gauges"""
+    stats = scraped_database_stats()
+    yield ('docuvault_jobs', 'gauge', 'Background jobs by kind and status',
+           [({'kind': kind, 'status': status}, count)
+            for kind, counts in sorted(stats['depth'].items()) for status, count in counts.items()])
+    streams = live_events.stats()
+    yield ('docuvault_live_event_streams', 'gauge', 'Open live event streams (this process)',
+           [({}, streams['streams'])])
+    cached = query_cache.stats()
+    yield ('docuvault_cache_bytes', 'gauge', 'Bytes held by the cache (this process)', [({}, cached['bytes'])])
+    yield ('docuvault_cache_entries', 'gauge', 'Entries held by the cache (this process)', [({}, cached['entries'])])
+    yield ('docuvault_storage_bytes', 'gauge', 'Bytes stored and saved per storage tier',
+           [({'tier': tier, 'kind': kind}, values[f'{kind}_bytes'])
+            for tier, values in sorted(stats['storage'].items()) for kind in ('stored', 'saved')])
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics; needs the METRICS_TOKEN bearer token or an admin session"""
+    token = app.config['METRICS_TOKEN']
+    if not (token and request.headers.get('Authorization') == f'Bearer {token}') and \
+            not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403)
+    return Response(metrics.render(), content_type=instrumentation.CONTENT_TYPE)
 
 # Health Check Route for Railway
 @app.route('/health')
@@ -161,33 +1484,240 @@ def admin_dashboard():
         return redirect(url_for('index'))
     
     # Get filter parameters
-    search = request.args.get('search', '')
-    department_filter = request.args.get('department', '')
-    status_filter = request.args.get('status', '')
-    type_filter = request.args.get('type', '')
+    filters = get_file_filters()
+    cursor = request.args.get('cursor', '')
+    per_page = get_page_size()
     
-    # Build query
-    query = File.query
+    # Build query - uploader and department are joined in so the table renders without extra queries
+    query = File.query.options(joinedload(File.uploader), joinedload(File.department))
+    query = apply_file_filters(query, filters)
     
-    if search:
-        query = query.filter(File.title.contains(search))
-    if department_filter:
-        query = query.filter(File.department_id == department_filter)
-    if status_filter:
-        query = query.filter(File.status == status_filter)
-    if type_filter:
-        query = query.filter(File.file_type == type_filter)
-    
-    files = query.order_by(File.uploaded_at.desc()).all()
-    departments = Department.query.all()
+    # Rows show department and uploader names; searches also match comments
+    tags = ['files', 'departments', 'users'] + (['comments'] if filters['search'] else [])
+    page = dashboard_page('admin_dashboard', sorted(filters.items()), tags, query, cursor, per_page,
+                          'admin_card', 'admin_row')
+    departments = cached_departments()
+    stats = cached_file_stats(department_id=filters['department'] or None)
     
     return render_template('admin_dashboard.html', 
-                         files=files, 
+                         page=page, 
+                         stats=stats,
                          departments=departments,
-                         search=search,
-                         department_filter=department_filter,
-                         status_filter=status_filter,
-                         type_filter=type_filter)
+                         search=filters['search'],
+                         department_filter=filters['department'],
+                         status_filter=filters['status'],
+                         type_filter=filters['type'],
+                         filters=filters,
+                         cursor=cursor,
+                         next_cursor=page['next_cursor'],
+                         per_page=per_page,
+                         live_events_url=live_events_url())
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_MANIFEST_COLUMNS = ('archive_path', 'file_id', 'document_id', 'version', 'version_count', 'current_version',
+                           'title', 'original_filename', 'file_type', 'size', 'sha256', 'department', 'category',
+                           'status', 'uploaded_by', 'uploaded_at', 'reviewed_at')
+
+def export_rows(filters):
+    """Metadata of the files matching the filters in id order, read in keyset batches.
+
+    Plain column rows keep the session's identity map from growing with the export.
+    """
+    last_id = 0
+    while True:
+        query = db.session.query(
+            File.id, File.document_id, File.version_number, File.is_current_version, File.title,
+            File.original_filename, File.file_type, File.file_size, File.blob_hash, File.filename,
+            File.category, File.status, File.uploaded_at, File.reviewed_at, Document.version_count,
+            Department.name.label('department'), User.username.label('uploaded_by'),
+        ).join(Department, File.department_id == Department.id).join(User, File.uploaded_by == User.id) \
+            .outerjoin(Document, File.document_id == Document.id)
+        rows = apply_file_filters(query, filters).filter(File.id > last_id) \
+            .order_by(File.id).limit(EXPORT_BATCH_SIZE).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+def export_member_name(row):
+    """Path of a file inside the export: <department>/<document>-v<version>-<original name>"""
+    def part(text):
+        return (text or '').replace('/', '_').replace('\\', '_').strip() or '_'
+    return f'{part(row.department)}/{row.document_id or row.id}-v{row.version_number or 1}-{part(row.original_filename)}'
+
+def export_manifest(filters):
+    """CSV manifest of an export, one line per file, generated row by row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, so that Excel reads the Turkish characters as UTF-8
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_MANIFEST_COLUMNS)
+    for row in export_rows(filters):
+        writer.writerow((
+            export_member_name(row) if stored_file_source(row) is not None else '',
+            row.id, row.document_id, row.version_number, row.version_count or 1,
+            'yes' if row.is_current_version else 'no', row.title, row.original_filename, row.file_type,
+            row.file_size, row.blob_hash or '', row.department, row.category or '', row.status, row.uploaded_by,
+            row.uploaded_at.isoformat(sep=' ', timespec='seconds') if row.uploaded_at else '',
+            row.reviewed_at.isoformat(sep=' ', timespec='seconds') if row.reviewed_at else '',
+        ))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+def export_entries(filters):
+    """ZIP entries of an export: the stored files, then the manifest"""
+    for row in export_rows(filters):
+        source = stored_file_source(row)
+        if source is not None:
+            if row.blob_hash:
+                touch_blob(row.blob_hash)
+            # Cold-tier and delta sources are streams; the recorded size still sizes their entry
+            yield export_member_name(row), row.uploaded_at, source, row.file_size
+    yield 'manifest.csv', datetime.utcnow(), export_manifest(filters), None
+
+@app.route('/admin/export')
+@login_required
+def export_files():
+    """Download the files matching the admin dashboard filters as one ZIP, built while it is sent"""
+    if current_user.role != 'admin':
+        flash('Bu sayfaya erişim yetkiniz yok!', 'error')
+        return redirect(url_for('index'))
+    
+    filters = get_file_filters()
+    response = Response(stream_with_context(export.zip_stream(export_entries(filters))), mimetype='application/zip')
+    response.headers['Content-Disposition'] = delivery.content_disposition(
+        'attachment', f'docuvault-export-{datetime.now():%Y%m%d-%H%M}.zip')
+    response.headers['Cache-Control'] = 'private, no-store'
+    # Keep nginx from buffering the whole archive before passing it on
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def run_search():
+    """Ranked full-text search shared by the search page and the JSON endpoint"""
+    filters = get_file_filters()
+    query_text = request.args.get('q', filters['search'])
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = get_page_size()
+    
+    # Department users only ever see their own files
+    uploaded_by = None if current_user.role == 'admin' else current_user.id
+    if search_index.is_available(db.session.connection()):
+        uploaded_since, uploaded_before = upload_date_bounds(filters)
+        total, hits = search_index.search(db.session.connection(), query_text, filters,
+                                          uploaded_by=uploaded_by, uploaded_since=uploaded_since,
+                                          uploaded_before=uploaded_before,
+                                          limit=per_page, offset=(page - 1) * per_page)
+    else:
+        query = apply_file_filters(File.query, dict(filters, search=query_text))
+        if uploaded_by is not None:
+            query = query.filter(File.uploaded_by == uploaded_by)
+        total = query.count()
+        rows = query.order_by(File.uploaded_at.desc(), File.id.desc()) \
+            .limit(per_page).offset((page - 1) * per_page).all()
+        hits = [(row.id, None, '') for row in rows]
+    
+    files = File.query.options(joinedload(File.uploader), joinedload(File.department)) \
+        .filter(File.id.in_([file_id for file_id, _, _ in hits])).all() if hits else []
+    by_id = {file.id: file for file in files}
+    results = [(by_id[file_id], score, snippet) for file_id, score, snippet in hits if file_id in by_id]
+    return query_text, filters, page, per_page, total, results
+
+@app.route('/search')
+@login_required
+def search_files():
+    query_text, filters, page, per_page, total, results = run_search()
+    departments = Department.query.all() if current_user.role == 'admin' else []
+    return render_template('search.html',
+                         q=query_text,
+                         results=results,
+                         total=total,
+                         page=page,
+                         per_page=per_page,
+                         departments=departments,
+                         department_filter=filters['department'],
+                         status_filter=filters['status'],
+                         type_filter=filters['type'])
+
+@app.route('/api/search')
+@login_required
+def search_files_api():
+    query_text, filters, page, per_page, total, results = run_search()
+    return jsonify({
+        'query': query_text,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'results': [{
+            'id': file.id,
+            'title': file.title,
+            'original_filename': file.original_filename,
+            'file_type': file.file_type,
+            'status': file.status,
+            'category': file.category,
+            'department': file.department.name if file.department else None,
+            'uploader': file.uploader.username if file.uploader else None,
+            'uploaded_at': file.uploaded_at.isoformat() if file.uploaded_at else None,
+            'score': score,
+            'snippet': snippet,
+            'url': url_for('view_file', file_id=file.id),
+        } for file, score, snippet in results],
+    })
+
+@app.route('/admin/indexing/status')
+@login_required
+def indexing_status():
+    """Queue depth and progress of the text extraction pipeline"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'forbidden'}), 403
+    
+    by_status = dict(db.session.query(FileContent.status, db.func.count()).group_by(FileContent.status).all())
+    return jsonify({
+        'jobs': job_stats()['depth'].get('extract_text', {}),
+        'content': by_status,
+        'backlog': extraction_backlog_query().count(),
+    })
+
+@app.route('/admin/storage/status')
+@login_required
+def storage_status():
+    """Bytes stored and saved per storage tier, and cold-tier read latency"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(storage_stats())
+
+@app.route('/admin/jobs')
+@login_required
+def admin_jobs():
+    """Background job queue: depth, latency and dead-lettered jobs"""
+    if current_user.role != 'admin':
+        flash('Bu sayfaya erişim yetkiniz yok!', 'error')
+        return redirect(url_for('index'))
+    
+    stats = job_stats()
+    if request.args.get('format') == 'json':
+        return jsonify(stats)
+    dead = Job.query.filter_by(status='dead').order_by(Job.finished_at.desc()).limit(50).all()
+    running = Job.query.filter_by(status='running').order_by(Job.started_at).limit(50).all()
+    return render_template('admin_jobs.html', stats=stats, dead=dead, running=running,
+                           statuses=jobs.STATUSES, now=datetime.utcnow())
+
+@app.route('/admin/jobs/retry', methods=['POST'])
+@login_required
+def retry_jobs():
+    """Put dead-lettered jobs (one, or all of them) back in the queue"""
+    if current_user.role != 'admin':
+        flash('Bu işlem için yetkiniz yok!', 'error')
+        return redirect(url_for('index'))
+    
+    query = Job.query.filter_by(status='dead')
+    if request.form.get('job_id'):
+        query = query.filter_by(id=request.form.get('job_id', type=int))
+    count = query.update({'status': 'queued', 'attempts': 0, 'run_at': datetime.utcnow(), 'finished_at': None},
+                         synchronize_session=False)
+    db.session.commit()
+    flash(f'{count} iş yeniden kuyruğa alındı.', 'success')
+    return redirect(url_for('admin_jobs'))
 
 @app.route('/department/dashboard')
 @login_required
@@ -196,8 +1726,70 @@ def department_dashboard():
         flash('Bu sayfaya erişim yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
-    files = File.query.filter_by(uploaded_by=current_user.id).order_by(File.uploaded_at.desc()).all()
-    return render_template('department_dashboard.html', files=files)
+    cursor = request.args.get('cursor', '')
+    per_page = get_page_size()
+    page = dashboard_page('department_dashboard', current_user.id, [f'files:user:{current_user.id}'],
+                          File.query.filter_by(uploaded_by=current_user.id), cursor, per_page,
+                          'department_card', 'department_row')
+    return render_template('department_dashboard.html',
+                         page=page,
+                         stats=cached_file_stats(uploaded_by=current_user.id),
+                         cursor=cursor,
+                         next_cursor=page['next_cursor'],
+                         per_page=per_page,
+                         live_events_url=live_events_url())
+
+@app.route('/events')
+@login_required
+def event_stream():
+    """Live dashboard events of the current user, as Server-Sent Events"""
+    user_id = current_user.id
+    if current_user.role == 'admin':
+        accepts = lambda event: True
+    else:
+        accepts = lambda event: event['owner'] == user_id
+    # EventSource sends Last-Event-ID when it reconnects; pages pass the position they were rendered at
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    if not serves_event_streams():
+        # EventSource gives up on a 204 instead of reconnecting every few seconds
+        response = Response(status=204)
+    else:
+        max_seconds = None if events.cooperative() else app.config['EVENT_STREAM_SYNC_SECONDS']
+        response = Response(live_events.stream(accepts, last_event_id, max_seconds), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+    origin = request.headers.get('Origin')
+    if origin in app.config['EVENTS_ALLOWED_ORIGINS']:
+        # Dashboards served from another origin than EVENTS_URL
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Vary'] = 'Origin'
+    return response
+
+@app.route('/dashboard/rows')
+@login_required
+def dashboard_rows():
+    """Dashboard rows of some files (?id=), rendered for patching a page after live events.
+
+    Takes the admin dashboard filters; files that no longer match them (or
+    that the user does not see on their dashboard) are left out, and the
+    page removes their rows.
+    """
+    ids = request.args.getlist('id', type=int)[:app.config['DASHBOARD_MAX_PAGE_SIZE']]
+    if current_user.role == 'admin':
+        query = File.query.options(joinedload(File.uploader), joinedload(File.department))
+        query = apply_file_filters(query, get_file_filters())
+        row, card = (get_template_attribute('_dashboard_rows.html', name) for name in ('admin_row', 'admin_card'))
+    else:
+        query = File.query.filter(File.uploaded_by == current_user.id)
+        row, card = (get_template_attribute('_dashboard_rows.html', name)
+                     for name in ('department_row', 'department_card'))
+    files = query.filter(File.id.in_(ids)).all() if ids else []
+    return jsonify({'items': [{'id': file.id, 'row': str(row(file)), 'card': str(card(file))} for file in files]})
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -221,29 +1813,17 @@ def upload_file():
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            # Generate unique filename
-            filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            if not ingest.content_matches(file.filename.rsplit('.', 1)[1], upload_head(file)):
+                flash('Dosya içeriği uzantısıyla uyuşmuyor!', 'error')
+                return redirect(request.url)
             
-            # Get file info
-            file_size = os.path.getsize(file_path)
-            file_type = file.filename.rsplit('.', 1)[1].lower()
+            # Identical content is stored only once
+            blob_hash, file_size = store_upload(file)
             
             # Save to database
-            new_file = File(
-                title=title,
-                description=description,
-                filename=filename,
-                original_filename=file.filename,
-                file_type=file_type,
-                file_size=file_size,
-                category=category,
-                uploaded_by=current_user.id,
-                department_id=current_user.department_id
-            )
-            
-            db.session.add(new_file)
+            new_file = create_file_record(title, description, category, file.filename, blob_hash, file_size)
+            enqueue_upload_jobs(new_file)
+            publish_new_file(new_file)
             db.session.commit()
             
             flash('Dosya başarıyla yüklendi!', 'success')
@@ -253,57 +1833,400 @@ def upload_file():
     
     return render_template('upload.html')
 
+# Everything file_detail.html shows about the file, loaded with it
+FILE_DETAIL_OPTIONS = (joinedload(File.uploader), joinedload(File.department), joinedload(File.reviewer),
+                       joinedload(File.document))
+
 @app.route('/file/<int:file_id>')
 @login_required
 def view_file(file_id):
-    file = File.query.get_or_404(file_id)
+    file, allowed = get_file_or_404(file_id, options=FILE_DETAIL_OPTIONS)
     
     # Check permissions
-    if current_user.role != 'admin' and file.uploaded_by != current_user.id:
+    if not allowed:
         flash('Bu dosyaya erişim yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
-    return render_template('file_detail.html', file=file)
+    comments_cursor = request.args.get('comments', '')
+    comments, next_comments_cursor = comment_page(file.id, comments_cursor, app.config['COMMENT_PAGE_SIZE'])
+    return render_template('file_detail.html', file=file, comments=comments,
+                           comments_cursor=comments_cursor, next_comments_cursor=next_comments_cursor)
 
-@app.route('/file/<int:file_id>/approve', methods=['POST'])
+@app.route('/file/<int:file_id>/comments')
 @login_required
-def approve_file(file_id):
+def file_comments(file_id):
+    """An older page of a file's comments, as the HTML the detail page appends"""
+    file, allowed = get_file_or_404(file_id)
+    if not allowed:
+        abort(403)
+    comments, next_cursor = comment_page(file.id, request.args.get('cursor', ''), app.config['COMMENT_PAGE_SIZE'])
+    return get_template_attribute('_comments.html', 'comment_page')(file, comments, next_cursor)
+
+REVIEW_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+def review_files(status, targets, reviewer_id):
+    """Set the status of many files with one UPDATE and record the decisions.
+
+    targets maps file id -> the row_version the reviewer saw, or None to
+    accept whatever is current. A file whose version moved on (another
+    reviewer got there first) is left alone and reported as 'conflict'.
+    Returns {file id: (result, row_version)} where result is 'updated',
+    'unchanged', 'conflict' or 'not_found'. The caller commits, which sends
+    a 'status' event per updated file.
+    """
+    results = {}
+    now = datetime.utcnow()
+    ids = list(targets)
+    for start in range(0, len(ids), REVIEW_BATCH_SIZE):
+        batch = ids[start:start + REVIEW_BATCH_SIZE]
+        current = {row.id: row for row in db.session.query(File.id, File.status, File.row_version, File.uploaded_by,
+                                                            File.department_id).filter(File.id.in_(batch))}
+        candidates = []
+        for file_id in batch:
+            row = current.get(file_id)
+            if row is None:
+                results[file_id] = ('not_found', None)
+            elif targets[file_id] is not None and targets[file_id] != row.row_version:
+                results[file_id] = ('conflict', row.row_version)
+            elif row.status == status:
+                results[file_id] = ('unchanged', row.row_version)
+            else:
+                candidates.append((file_id, row.row_version))
+        if not candidates:
+            continue
+        
+        # The version in the WHERE clause makes this a compare-and-set per row
+        updated = set(db.session.execute(
+            db.update(File)
+            .where(tuple_(File.id, File.row_version).in_(candidates))
+            .values(status=status, reviewed_by=reviewer_id, reviewed_at=now,
+                    row_version=File.row_version + 1)
+            .returning(File.id)
+            .execution_options(synchronize_session=False)
+        ).scalars())
+        history = []
+        for file_id, version in candidates:
+            if file_id in updated:
+                results[file_id] = ('updated', version + 1)
+                invalidate_cache(*file_cache_tags(current[file_id].uploaded_by, current[file_id].department_id))
+                publish_event('status', file_id, current[file_id].uploaded_by, status=status, version=version + 1)
+                history.append({'file_id': file_id, 'reviewer_id': reviewer_id, 'reviewed_at': now,
+                                'previous_status': current[file_id].status, 'status': status})
+            else:
+                results[file_id] = ('conflict', None)
+        if history:
+            db.session.execute(db.insert(ReviewHistory), history)
+    return results
+
+def review_single_file(file_id, action):
+    """Approve/reject one file from the detail page form"""
     if current_user.role != 'admin':
         flash('Bu işlem için yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
-    file = File.query.get_or_404(file_id)
-    file.status = 'approved'
-    file.reviewed_by = current_user.id
-    file.reviewed_at = datetime.utcnow()
-    
+    expected = request.form.get('version', type=int)
+    result, _ = review_files(REVIEW_ACTIONS[action], {file_id: expected}, current_user.id)[file_id]
+    if result == 'not_found':
+        abort(404)
     db.session.commit()
-    flash('Dosya onaylandı!', 'success')
+    if result == 'conflict':
+        flash('Dosya bu arada başka bir yönetici tarafından güncellendi, lütfen tekrar kontrol edin.', 'error')
+        return redirect(url_for('view_file', file_id=file_id))
+    flash('Dosya onaylandı!' if action == 'approve' else 'Dosya reddedildi!', 'success')
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/file/<int:file_id>/approve', methods=['POST'])
+@login_required
+def approve_file(file_id):
+    return review_single_file(file_id, 'approve')
+
 @app.route('/file/<int:file_id>/reject', methods=['POST'])
 @login_required
 def reject_file(file_id):
+    return review_single_file(file_id, 'reject')
+
+@app.route('/api/files/review', methods=['POST'])
+@login_required
+def bulk_review_api():
+    """Approve or reject many files at once.
+
+    JSON body: {"action": "approve"|"reject", and one of
+      "items": [{"id": 1, "version": 3}, ...]   (optimistic: versions as seen),
+      "ids": [1, 2, ...],
+      "filters": {"search": ..., "department": ..., "status": ..., "type": ..., "from": ..., "to": ...}}
+    """
     if current_user.role != 'admin':
-        flash('Bu işlem için yetkiniz yok!', 'error')
-        return redirect(url_for('index'))
+        return jsonify({'error': 'forbidden'}), 403
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or payload.get('action') not in REVIEW_ACTIONS:
+        return jsonify({'error': 'action must be "approve" or "reject"'}), 400
     
-    file = File.query.get_or_404(file_id)
-    file.status = 'rejected'
-    file.reviewed_by = current_user.id
-    file.reviewed_at = datetime.utcnow()
+    try:
+        if 'items' in payload:
+            targets = {int(item['id']): int(item['version']) if item.get('version') is not None else None
+                       for item in payload['items']}
+        elif 'ids' in payload:
+            targets = {int(file_id): None for file_id in payload['ids']}
+        elif isinstance(payload.get('filters'), dict):
+            # Same filters as the admin dashboard
+            query = apply_file_filters(db.session.query(File.id), payload['filters'])
+            targets = {file_id: None for file_id, in query.order_by(File.id).limit(REVIEW_MAX_FILES + 1)}
+        else:
+            return jsonify({'error': 'items, ids or filters is required'}), 400
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'invalid ids'}), 400
+    if len(targets) > REVIEW_MAX_FILES:
+        return jsonify({'error': f'at most {REVIEW_MAX_FILES} files per request'}), 400
     
+    results = review_files(REVIEW_ACTIONS[payload['action']], targets, current_user.id)
     db.session.commit()
-    flash('Dosya reddedildi!', 'success')
-    return redirect(url_for('admin_dashboard'))
+    counts = {}
+    for result, _ in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    return jsonify({
+        'action': payload['action'],
+        'counts': counts,
+        'results': [{'id': file_id, 'result': result, 'version': version}
+                    for file_id, (result, version) in results.items()],
+    })
+
+# JSON API v1 (see api.py): ?fields= picks the fields of each item, lists are keyset-paginated
+# (?cursor=, ?per_page=) and answer If-None-Match from a change marker without running the list query
+API_FILE_FIELDS = {
+    'id': lambda file: file.id,
+    'title': lambda file: file.title,
+    'description': lambda file: file.description,
+    'original_filename': lambda file: file.original_filename,
+    'file_type': lambda file: file.file_type,
+    'file_size': lambda file: file.file_size,
+    'status': lambda file: file.status,
+    'category': lambda file: file.category,
+    'department_id': lambda file: file.department_id,
+    'department': lambda file: file.department.name if file.department else None,
+    'uploaded_by': lambda file: file.uploaded_by,
+    'uploader': lambda file: file.uploader.username if file.uploader else None,
+    'uploaded_at': lambda file: file.uploaded_at,
+    'reviewed_at': lambda file: file.reviewed_at,
+    'row_version': lambda file: file.row_version,
+    'document_id': lambda file: file.document_id,
+    'version_number': lambda file: file.version_number,
+    'version_count': lambda file: file.version_count,
+    'is_current_version': lambda file: file.is_current_version,
+    'revision_notes': lambda file: file.revision_notes,
+    'url': lambda file: url_for('view_file', file_id=file.id),
+    'download_url': lambda file: signed_file_url(file),
+    'thumbnail_url': lambda file: thumbnail_url(file),
+}
+API_FILE_DEFAULT_FIELDS = ('id', 'title', 'original_filename', 'file_type', 'file_size', 'status', 'category',
+                           'department', 'uploader', 'uploaded_at', 'version_number', 'url')
+# Fields read through a relationship of File, joined in only when requested
+API_FILE_RELATIONSHIPS = {'department': 'department', 'uploader': 'uploader', 'version_count': 'document'}
+# Fields holding download tokens, which change every DOWNLOAD_TOKEN_WINDOW
+API_TOKEN_FIELDS = {'download_url', 'thumbnail_url'}
+API_COMMENT_FIELDS = {
+    'id': lambda comment: comment.id,
+    'file_id': lambda comment: comment.file_id,
+    'content': lambda comment: comment.content,
+    'user_id': lambda comment: comment.user_id,
+    'user': lambda comment: comment.user.username if comment.user else None,
+    'created_at': lambda comment: comment.created_at,
+}
+API_DEPARTMENT_FIELDS = {
+    'id': lambda department: department.id,
+    'name': lambda department: department.name,
+    'description': lambda department: department.description,
+}
+
+def api_error(message, status):
+    return api.json_response({'error': message}, status=status)
+
+def api_fields(available, default):
+    """The fields requested with ?fields=; aborts with 400 on unknown names"""
+    try:
+        return api.parse_fields(request.args.get('fields', ''), available, default)
+    except ValueError as e:
+        abort(api_error(str(e), 400))
+
+def api_file_scope():
+    """(criterion, key) restricting File to the current user's files and those shared with them.
+
+    key identifies the scope in entity tags.
+    """
+    if current_user.role == 'admin':
+        return db.true(), 'admin'
+    # Every sharing rule grants at least 'view'
+    shared = [department_id for department_id, in db.session.query(DepartmentShare.department_id)
+              .filter(DepartmentShare.grantee_department_id == current_user.department_id)
+              .order_by(DepartmentShare.department_id)]
+    criterion = File.uploaded_by == current_user.id
+    if shared:
+        criterion = or_(criterion, File.department_id.in_(shared))
+    return criterion, (current_user.id, tuple(shared))
+
+def file_change_marker(fields=(), search=False):
+    """What moves whenever the requested fields of a listed file may have changed.
+
+    Newest file id and latest review: any upload, revision or review moves
+    one of them (files are never deleted). Each max() is its own subquery so
+    that both are read from the end of an index (the primary key,
+    ix_file_reviewed_at) rather than by one scan. Fields read from elsewhere
+    add their source: 'department' the department names (cached), the
+    download-token fields the number of legacy rows, which migrate-blobs
+    counts down as it gives their bytes a new storage key. Usernames are
+    never edited. A full-text search also matches comments and extracted
+    text, so with search the newest comment and extraction are added.
+    """
+    columns = [db.select(db.func.max(File.id)).scalar_subquery(),
+               db.select(db.func.max(File.reviewed_at)).scalar_subquery()]
+    if search:
+        columns += [db.select(db.func.max(Comment.id)).scalar_subquery(),
+                    db.select(db.func.max(FileContent.extracted_at)).scalar_subquery()]
+    if API_TOKEN_FIELDS.intersection(fields):
+        columns.append(db.select(db.func.count()).select_from(File).where(File.blob_hash.is_(None))
+                       .scalar_subquery())
+    marker = tuple(db.session.query(*columns).one())
+    if 'department' in fields:
+        marker += (sorted((department['id'], department['name']) for department in cached_departments()),)
+    return marker
+
+def api_file_tag(*parts, fields=()):
+    """Entity tag of a file list: parts, the user's scope and the query string"""
+    window = int(time.time() // download_tokens.window) if API_TOKEN_FIELDS.intersection(fields) else None
+    return api.etag(request.endpoint, *parts, sorted(request.args.items(multi=True)), window)
+
+def api_file_options(fields):
+    return [joinedload(getattr(File, relationship))
+            for name, relationship in API_FILE_RELATIONSHIPS.items() if name in fields]
+
+def api_file_allowed(file_id):
+    """A file the current user may view; aborts with a JSON 404/403 otherwise"""
+    file, allowed = file_with_access(File.id == file_id)
+    if file is None:
+        abort(api_error('not found', 404))
+    if not allowed:
+        abort(api_error('forbidden', 403))
+    return file
+
+@app.route('/api/v1/files')
+@login_required
+def api_files():
+    """Files the user can see, newest first; takes the admin dashboard filters"""
+    fields = api_fields(API_FILE_FIELDS, API_FILE_DEFAULT_FIELDS)
+    criterion, scope = api_file_scope()
+    filters = get_file_filters()
+    tag = api_file_tag(file_change_marker(fields, search=bool(filters['search'])), scope, fields=fields)
+    response = api.not_modified(request, tag)
+    if response is not None:
+        return response
+    
+    query = apply_file_filters(File.query.filter(criterion), filters)
+    files, next_cursor = paginate_files(query.options(*api_file_options(fields)),
+                                        request.args.get('cursor', ''), get_page_size())
+    return api.json_response({
+        'items': [api.select(file, fields, API_FILE_FIELDS) for file in files],
+        'next_cursor': next_cursor,
+    }, tag)
+
+@app.route('/api/v1/files/<int:file_id>')
+@login_required
+def api_file(file_id):
+    fields = api_fields(API_FILE_FIELDS, API_FILE_FIELDS)
+    file = api_file_allowed(file_id)
+    return api.conditional_json(request, api.select(file, fields, API_FILE_FIELDS))
+
+@app.route('/api/v1/files/<int:file_id>/versions')
+@login_required
+def api_file_versions(file_id):
+    """Every version of a file's document, newest first; the cursor is a version number"""
+    fields = api_fields(API_FILE_FIELDS, API_FILE_DEFAULT_FIELDS + ('is_current_version', 'revision_notes'))
+    file = api_file_allowed(file_id)
+    tag = api_file_tag(file_change_marker(fields), file.document_id, fields=fields)
+    response = api.not_modified(request, tag)
+    if response is not None:
+        return response
+    
+    per_page = get_page_size()
+    query = File.query.options(*api_file_options(fields))
+    query = query.filter(File.document_id == file.document_id) if file.document_id else query.filter(File.id == file.id)
+    before = request.args.get('cursor', type=int)
+    if before is not None:
+        query = query.filter(File.version_number < before)
+    versions = query.order_by(File.version_number.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(versions) > per_page:
+        versions = versions[:per_page]
+        next_cursor = str(versions[-1].version_number)
+    return api.json_response({
+        'items': [api.select(version, fields, API_FILE_FIELDS) for version in versions],
+        'next_cursor': next_cursor,
+    }, tag)
+
+@app.route('/api/v1/files/<int:file_id>/comments')
+@login_required
+def api_file_comments(file_id):
+    """Comments on a file, newest first"""
+    fields = api_fields(API_COMMENT_FIELDS, API_COMMENT_FIELDS)
+    api_file_allowed(file_id)
+    # Comments are only ever added
+    newest = db.session.query(db.func.max(Comment.id)).scalar()
+    tag = api.etag(request.endpoint, file_id, newest, sorted(request.args.items(multi=True)))
+    response = api.not_modified(request, tag)
+    if response is not None:
+        return response
+    
+    comments, next_cursor = comment_page(file_id, request.args.get('cursor', ''), get_page_size())
+    return api.json_response({
+        'items': [api.select(comment, fields, API_COMMENT_FIELDS) for comment in comments],
+        'next_cursor': next_cursor,
+    }, tag)
+
+@app.route('/api/v1/departments')
+@login_required
+def api_departments():
+    """Every department (a short list, not paginated); file_count counts the files the user can see"""
+    fields = api_fields(set(API_DEPARTMENT_FIELDS) | {'file_count'}, API_DEPARTMENT_FIELDS)
+    criterion, scope = api_file_scope()
+    marker = tuple(db.session.query(db.func.count(Department.id), db.func.max(Department.id)).one())
+    # Renames and description edits (the cached list is invalidated by every Department write)
+    marker += (sorted((department['id'], department['name'], department['description'] or '')
+                      for department in cached_departments()),)
+    if 'file_count' in fields:
+        marker += (file_change_marker(), scope)
+    tag = api.etag(request.endpoint, marker, sorted(request.args.items(multi=True)))
+    response = api.not_modified(request, tag)
+    if response is not None:
+        return response
+    
+    getters = API_DEPARTMENT_FIELDS
+    if 'file_count' in fields:
+        counts = dict(db.session.query(File.department_id, db.func.count(File.id))
+                      .filter(criterion).group_by(File.department_id).all())
+        getters = dict(getters, file_count=lambda department: counts.get(department.id, 0))
+    departments = Department.query.order_by(Department.name, Department.id).all()
+    return api.json_response({'items': [api.select(department, fields, getters) for department in departments]}, tag)
+
+@app.route('/api/v1/stats')
+@login_required
+def api_stats():
+    """Dashboard counts: every file (?department= narrows) for admins, own uploads otherwise"""
+    tag = api_file_tag(file_change_marker(), current_user.id if current_user.role != 'admin' else 'admin')
+    response = api.not_modified(request, tag)
+    if response is not None:
+        return response
+    
+    if current_user.role == 'admin':
+        stats = cached_file_stats(department_id=request.args.get('department', type=int))
+    else:
+        stats = cached_file_stats(uploaded_by=current_user.id)
+    return api.json_response(stats, tag)
 
 @app.route('/file/<int:file_id>/comment', methods=['POST'])
 @login_required
 def add_comment(file_id):
-    file = File.query.get_or_404(file_id)
+    file, allowed = get_file_or_404(file_id, 'comment')
     
     # Check permissions
-    if current_user.role != 'admin' and file.uploaded_by != current_user.id:
+    if not allowed:
         flash('Bu dosyaya yorum yapma yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
@@ -315,6 +2238,8 @@ def add_comment(file_id):
             user_id=current_user.id
         )
         db.session.add(comment)
+        invalidate_cache('comments')
+        publish_event('comment', file.id, file.uploaded_by, author=current_user.username)
         db.session.commit()
         flash('Yorum eklendi!', 'success')
     
@@ -323,10 +2248,10 @@ def add_comment(file_id):
 @app.route('/file/<int:file_id>/revise', methods=['GET', 'POST'])
 @login_required
 def revise_file(file_id):
-    original_file = File.query.get_or_404(file_id)
+    original_file, allowed = get_file_or_404(file_id, 'revise')
     
-    # Check permissions - only file owner or admin can revise
-    if current_user.role != 'admin' and original_file.uploaded_by != current_user.id:
+    # Check permissions - file owner, admin or a department the file is shared with for revising
+    if not allowed:
         flash('Bu dosyayı revize etme yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
@@ -346,127 +2271,622 @@ def revise_file(file_id):
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            # Generate unique filename
-            filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Get file info
-            file_size = os.path.getsize(file_path)
-            file_type = file.filename.rsplit('.', 1)[1].lower()
-            
-            # Get the original file (in case this is already a revision)
-            original = original_file.get_original_file()
-            
-            # Get next version number
-            all_versions = original.get_all_versions()
-            next_version = max([v.version_number for v in all_versions]) + 1
+            if not ingest.content_matches(file.filename.rsplit('.', 1)[1], upload_head(file)):
+                flash('Dosya içeriği uzantısıyla uyuşmuyor!', 'error')
+                return redirect(request.url)
             
-            # Mark all previous versions as not current
-            for version in all_versions:
-                version.is_current_version = False
+            # Identical content is stored only once
+            blob_hash, file_size = store_upload(file)
             
             # Create new revision
-            new_revision = File(
-                title=title,
-                description=description,
-                filename=filename,
-                original_filename=file.filename,
-                file_type=file_type,
-                file_size=file_size,
-                category=category,
-                uploaded_by=current_user.id,
-                department_id=current_user.department_id,
-                parent_file_id=original.id,
-                version_number=next_version,
-                is_current_version=True,
-                revision_notes=revision_notes,
-                status='pending'  # New revisions need approval
-            )
-            
-            db.session.add(new_revision)
+            new_revision = create_revision(original_file, title, description, category, revision_notes,
+                                           file.filename, blob_hash, file_size)
+            enqueue_upload_jobs(new_revision)
+            publish_new_file(new_revision)
             db.session.commit()
             
-            flash(f'Belge başarıyla revize edildi! (Versiyon {next_version})', 'success')
+            flash(f'Belge başarıyla revize edildi! (Versiyon {new_revision.version_number})', 'success')
             return redirect(url_for('view_file', file_id=new_revision.id))
         else:
             flash('Geçersiz dosya türü!', 'error')
     
     return render_template('revise_file.html', file=original_file)
 
+# Resumable chunked uploads: create a session, PATCH chunks at the reported
+# offset (resuming after a dropped connection), then complete it with the metadata
+def get_upload_session(session_id, lock=False):
+    """The current user's upload session; lock=True re-reads and locks the row
+    (call it while holding ingest.locked_session)"""
+    query = UploadSession.query.filter_by(id=session_id)
+    if lock:
+        query = query.with_for_update().populate_existing()
+    upload_session = query.first()
+    if upload_session is None or upload_session.user_id != current_user.id:
+        return None
+    return upload_session
+
+def upload_session_state(upload_session):
+    return {
+        'id': upload_session.id,
+        'offset': upload_session.received,
+        'size': upload_session.file_size,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+    }
+
+@app.route('/upload/sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename', '')
+    try:
+        file_size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size is required'}), 400
+    if not allowed_file(original_filename):
+        return jsonify({'error': 'Geçersiz dosya türü!'}), 400
+    if file_size <= 0 or file_size > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'Dosya boyutu sınırın dışında!'}), 413
+    
+    upload_session = UploadSession(id=uuid.uuid4().hex, user_id=current_user.id,
+                                   original_filename=original_filename, file_size=file_size)
+    ingest.create_session(blob_store, upload_session.id)
+    db.session.add(upload_session)
+    db.session.commit()
+    return jsonify(upload_session_state(upload_session)), 201
+
+@app.route('/upload/sessions/<session_id>', methods=['GET'])
+@login_required
+def upload_session_status(session_id):
+    upload_session = get_upload_session(session_id)
+    if upload_session is None:
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(upload_session_state(upload_session))
+
+@app.route('/upload/sessions/<session_id>', methods=['PATCH'])
+@login_required
+def upload_session_chunk(session_id):
+    if get_upload_session(session_id) is None:
+        return jsonify({'error': 'not found'}), 404
+    offset = request.args.get('offset', type=int)
+    try:
+        # Held until the new offset is committed: a retry of this chunk that
+        # arrives while it is still being written waits, then sees the new offset
+        with ingest.locked_session(blob_store, session_id) as session_file:
+            upload_session = get_upload_session(session_id, lock=True)
+            if upload_session is None:
+                return jsonify({'error': 'not found'}), 404
+            try:
+                received = ingest.append_chunk(session_file, session_id, offset, upload_session.received,
+                                               request.stream, upload_session.file_size)
+            except ingest.OffsetMismatch:
+                db.session.rollback()
+                return jsonify(dict(upload_session_state(upload_session), error='offset mismatch')), 409
+            except ValueError as e:
+                db.session.rollback()
+                return jsonify({'error': str(e)}), 413
+            upload_session.received = received
+            upload_session.updated_at = datetime.utcnow()
+            try:
+                db.session.commit()
+            except Exception:
+                # The chunk is rewritten by the retry; its running hash no longer applies
+                ingest.forget_running_hash(session_id)
+                raise
+    except FileNotFoundError:
+        # Completed or cancelled by another request
+        return jsonify({'error': 'not found'}), 404
+    return jsonify(upload_session_state(upload_session))
+
+@app.route('/upload/sessions/<session_id>', methods=['DELETE'])
+@login_required
+def cancel_upload_session(session_id):
+    if get_upload_session(session_id) is None:
+        return jsonify({'error': 'not found'}), 404
+    try:
+        with ingest.locked_session(blob_store, session_id):
+            upload_session = get_upload_session(session_id, lock=True)
+            if upload_session is None:
+                return jsonify({'error': 'not found'}), 404
+            ingest.discard_session(blob_store, session_id)
+            db.session.delete(upload_session)
+            db.session.commit()
+    except FileNotFoundError:
+        return jsonify({'error': 'not found'}), 404
+    return '', 204
+
+@app.route('/upload/sessions/<session_id>/complete', methods=['POST'])
+@login_required
+def complete_upload_session(session_id):
+    if get_upload_session(session_id) is None:
+        return jsonify({'error': 'not found'}), 404
+    
+    data = request.get_json(silent=True) or request.form
+    original_file = None
+    if data.get('revise_file_id'):
+        original_file, allowed = get_file_or_404(int(data['revise_file_id']), 'revise')
+        if not allowed:
+            return jsonify({'error': 'Bu dosyayı revize etme yetkiniz yok!'}), 403
+    elif current_user.role != 'department':
+        return jsonify({'error': 'Dosya yükleme yetkiniz yok!'}), 403
+    
+    try:
+        # Locked like a chunk: the bytes hashed and adopted are the ones whose offset was committed
+        with ingest.locked_session(blob_store, session_id) as session_file:
+            return finish_upload_session(session_id, session_file, data, original_file)
+    except FileNotFoundError:
+        return jsonify({'error': 'not found'}), 404
+
+def finish_upload_session(session_id, session_file, data, original_file):
+    upload_session = get_upload_session(session_id, lock=True)
+    if upload_session is None:
+        return jsonify({'error': 'not found'}), 404
+    if upload_session.received != upload_session.file_size:
+        db.session.rollback()
+        return jsonify(dict(upload_session_state(upload_session), error='upload incomplete')), 409
+    
+    original_filename = upload_session.original_filename
+    if not ingest.content_matches(original_filename.rsplit('.', 1)[1], ingest.read_head(session_file)):
+        ingest.discard_session(blob_store, session_id)
+        db.session.delete(upload_session)
+        db.session.commit()
+        return jsonify({'error': 'Dosya içeriği uzantısıyla uyuşmuyor!'}), 400
+    
+    blob_hash, file_size = ingest.finish_session(blob_store, session_file, session_id, upload_session.file_size)
+    register_blob(blob_hash, file_size)
+    if original_file is not None:
+        new_file = create_revision(original_file, data.get('title', original_file.title),
+                                   data.get('description', ''), data.get('category', ''),
+                                   data.get('revision_notes', ''), original_filename, blob_hash, file_size)
+    else:
+        new_file = create_file_record(data.get('title') or original_filename, data.get('description', ''),
+                                      data.get('category', ''), original_filename, blob_hash, file_size)
+    db.session.delete(upload_session)
+    enqueue_upload_jobs(new_file)
+    publish_new_file(new_file)
+    db.session.commit()
+    
+    redirect_url = url_for('view_file', file_id=new_file.id) if original_file is not None \
+        else url_for('department_dashboard')
+    return jsonify({'file_id': new_file.id, 'version': new_file.version_number, 'redirect': redirect_url}), 201
+
 @app.route('/file/<int:file_id>/versions')
 @login_required
 def file_versions(file_id):
-    file = File.query.get_or_404(file_id)
+    file, allowed = get_file_or_404(file_id)
     
     # Check permissions
-    if current_user.role != 'admin' and file.uploaded_by != current_user.id:
+    if not allowed:
         flash('Bu dosyanın versiyonlarını görme yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
-    all_versions = file.get_all_versions()
-    return render_template('file_versions.html', file=file, versions=all_versions)
+    all_versions = file.get_all_versions(joinedload(File.uploader), joinedload(File.reviewer))
+    # Comment counts of every version from one grouped query
+    comment_counts = dict(db.session.query(Comment.file_id, db.func.count(Comment.id))
+                          .filter(Comment.file_id.in_([version.id for version in all_versions]))
+                          .group_by(Comment.file_id).all())
+    return render_template('file_versions.html', file=file, versions=all_versions, comment_counts=comment_counts)
+
+def file_mimetype(file):
+    """Content-Type of a File, from the name it was uploaded with"""
+    return mimetypes.guess_type(file.original_filename or file.filename)[0] or \
+        mimetypes.guess_type(file.filename)[0]
+
+def deliver_file(file, disposition='inline'):
+    """Send a stored file with validators and byte-range support, or hand it to the front-end server"""
+    path = stored_file_path(file)
+    if file.blob_hash:
+        touch_blob(file.blob_hash)
+        # The body never changes under a content hash
+        etag = file.blob_hash
+    else:
+        stat = os.stat(path)
+        etag = f'{file.id}-{file.version_number}-{stat.st_size}-{int(stat.st_mtime)}'
+    return delivery.send_stored_file(
+        request, path,
+        mimetype=file_mimetype(file),
+        etag=etag,
+        last_modified=file.uploaded_at,
+        disposition=disposition,
+        download_name=file.original_filename,
+        offload=file_offload,
+    )
+
+def storage_key(file):
+    """Names a File's bytes inside a download token: digest.ext, or the legacy upload name"""
+    if file.blob_hash:
+        return f'{file.blob_hash}.{file.file_type}'
+    return file.filename
+
+def storage_key_path(key):
+    digest = key.split('.', 1)[0]
+    if len(digest) == 64 and all(c in '0123456789abcdef' for c in digest):
+        return blob_path(digest)
+    return os.path.join(app.config['UPLOAD_FOLDER'], key)
+
+def rendition_key(key):
+    """Cache key of the renditions of a storage key; changes whenever the bytes do"""
+    digest = key.split('.', 1)[0]
+    # Legacy keys are upload names, possibly non-ASCII; the key also ends up in an ETag header
+    return digest if len(digest) == 64 else 'legacy-' + quote(key, safe='')
+
+@app.template_global()
+def signed_file_url(file):
+    """Token URL of a file the current page has already authorised; no login check when fetched"""
+    token = download_tokens.issue(file.id, storage_key(file))
+    return url_for('signed_download', token=token, name=file.original_filename)
+
+@app.template_global()
+def thumbnail_url(file, size='sm'):
+    """URL of a rendition of file, or None when its type cannot be rendered here"""
+    if not rendition_cache.can_render(file.file_type):
+        return None
+    return url_for('signed_thumbnail', token=download_tokens.issue(file.id, storage_key(file)), size=size)
+
+def verified_token(token):
+    """(key, seconds left) of a valid download token; aborts otherwise"""
+    verified = download_tokens.verify(token)
+    if verified is None:
+        abort(403)
+    _, key, expires = verified
+    return key, max(int(expires - time.time()), 0)
+
+@app.route('/d/<token>/<path:name>')
+def signed_download(token, name):
+    """Serve file bytes for a signed token, without reading the database"""
+    key, seconds_left = verified_token(token)
+    path = storage_key_path(key)
+    if not os.path.exists(path):
+        abort(404)
+    digest = key.split('.', 1)[0]
+    if len(digest) == 64:
+        touch_blob(digest)
+    return delivery.send_stored_file(
+        request, path,
+        mimetype=mimetypes.guess_type(key)[0],
+        etag=quote(key, safe=''),
+        disposition='attachment' if request.args.get('download') else 'inline',
+        download_name=name,
+        max_age=seconds_left,
+        public=True,
+        offload=file_offload,
+    )
+
+@app.route('/t/<token>/<size>')
+def signed_thumbnail(token, size):
+    """Rendition of the file named by a signed token"""
+    key, seconds_left = verified_token(token)
+    file_type = key.rsplit('.', 1)[-1]
+    if size not in renditions.SIZES or not rendition_cache.can_render(file_type):
+        abort(404)
+    source_path = storage_key_path(key)
+    if not os.path.exists(source_path):
+        abort(404)
+    cache_key = rendition_key(key)
+    path = rendition_cache.get(cache_key, size, source_path, file_type)
+    if path is None:
+        abort(404)
+    return delivery.send_stored_file(request, path, 'image/jpeg', etag=f'{cache_key}-{size}',
+                                     max_age=min(seconds_left, app.config['RENDITION_MAX_AGE']),
+                                     immutable=True, public=True, offload=file_offload)
 
 @app.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
     """Serve uploaded files with proper permissions"""
     # Find the file in database to check permissions
-    file_record = File.query.filter_by(filename=filename).first()
+    file_record, allowed = file_with_access(File.filename == filename)
     if not file_record:
         flash('Dosya bulunamadı!', 'error')
         return redirect(url_for('index'))
     
     # Check permissions
-    if current_user.role != 'admin' and file_record.uploaded_by != current_user.id:
+    if not allowed:
         flash('Bu dosyaya erişim yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(stored_file_path(file_record)):
+        flash('Dosya bulunamadı!', 'error')
+        return redirect(url_for('index'))
+    return deliver_file(file_record)
 
 @app.route('/file/<int:file_id>/preview')
 @login_required
 def preview_file(file_id):
     """Preview file in browser without downloading"""
-    file = File.query.get_or_404(file_id)
+    file, allowed = get_file_or_404(file_id)
     
     # Check permissions
-    if current_user.role != 'admin' and file.uploaded_by != current_user.id:
+    if not allowed:
         flash('Bu dosyaya erişim yetkiniz yok!', 'error')
         return redirect(url_for('index'))
     
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+    file_path = stored_file_path(file)
     if not os.path.exists(file_path):
         flash('Dosya bulunamadı!', 'error')
         return redirect(url_for('view_file', file_id=file_id))
     
-    # Get MIME type
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if not mime_type:
-        mime_type = 'application/octet-stream'
-    
-    # For certain file types, force inline display
-    if file.file_type.lower() in ['pdf', 'jpg', 'jpeg', 'png', 'gif', 'txt']:
-        def generate():
-            with open(file_path, 'rb') as f:
-                while True:
-                    data = f.read(4096)
-                    if not data:
-                        break
-                    yield data
+    # Keep Content-Disposition inline so the browser renders what it can
+    return deliver_file(file)
+
+@app.route('/file/<int:file_id>/thumbnail/<size>')
+@login_required
+def file_thumbnail(file_id, size):
+    """Serve a cached thumbnail (images) or first-page preview (PDF)"""
+    file, allowed = get_file_or_404(file_id)
+    if not allowed:
+        abort(403)
+    if size not in renditions.SIZES or not rendition_cache.can_render(file.file_type):
+        abort(404)
+    source_path = stored_file_path(file)
+    if not os.path.exists(source_path):
+        abort(404)
+    key = rendition_key(storage_key(file))
+    path = rendition_cache.get(key, size, source_path, file.file_type)
+    if path is None:
+        abort(404)
+    return delivery.send_stored_file(request, path, 'image/jpeg', etag=f'{key}-{size}',
+                                     max_age=app.config['RENDITION_MAX_AGE'], immutable=True,
+                                     offload=file_offload)
+
+def import_batch(staged, uploader_id, department_ids, folder_map, status):
+    """Insert a batch of staged archive files with bulk statements.
+
+    A file is skipped when it was already imported: a File with the same
+    relative path (kept as the description), target department and content
+    exists, so an import can be re-run safely. The same content in another
+    folder or department is imported again and shares the stored blob.
+    Blobs, documents, files, their search rows and processing jobs are
+    written with executemany in the caller's transaction.
+    Returns the number of files inserted.
+    """
+    targets = [(item, department_ids[folder_map.resolve(item.folder)['department']]) for item in staged]
+    sources = {(item.relative_path, department_id, item.digest) for item, department_id in targets}
+    known = set(db.session.execute(
+        db.select(File.description, File.department_id, File.blob_hash)
+        .where(tuple_(File.description, File.department_id, File.blob_hash).in_(sources))).all()) if sources else set()
+    new = []
+    for item, department_id in targets:
+        source = (item.relative_path, department_id, item.digest)
+        if source not in known:
+            known.add(source)
+            new.append((item, department_id))
+    if not new:
+        return 0
+    
+    now = datetime.utcnow()
+    references = collections.Counter(item.digest for item, _ in new)
+    stored = set(db.session.execute(db.select(Blob.hash).where(Blob.hash.in_(references))).scalars())
+    sizes = {item.digest: item.size for item, _ in new}
+    blob_rows = [{'hash': digest, 'size': sizes[digest], 'ref_count': count, 'created_at': now, 'last_used_at': now}
+                 for digest, count in references.items() if digest not in stored]
+    if blob_rows:
+        db.session.execute(Blob.__table__.insert(), blob_rows)
+    if stored:
+        db.session.execute(
+            Blob.__table__.update().where(Blob.hash == db.bindparam('b_hash'))
+            .values(ref_count=Blob.ref_count + db.bindparam('b_count'), last_used_at=now),
+            [{'b_hash': digest, 'b_count': references[digest]} for digest in stored])
+    
+    document_table = Document.__table__
+    document_ids = db.session.execute(
+        document_table.insert().returning(document_table.c.id, sort_by_parameter_order=True),
+        [{'version_count': 1, 'next_version_number': 2, 'created_at': now} for _ in new]).scalars().all()
+    file_rows = []
+    for (item, department_id), document_id in zip(new, document_ids):
+        mapping = folder_map.resolve(item.folder)
+        file_rows.append({
+            'title': item.name.rsplit('.', 1)[0][:200],
+            'description': item.relative_path,
+            'filename': new_stored_filename(item.name),
+            'original_filename': item.name[:255],
+            'file_type': item.extension,
+            'file_size': item.size,
+            'status': status,
+            'category': (mapping.get('category') or '')[:50] or None,
+            'uploaded_by': uploader_id,
+            'department_id': department_id,
+            'uploaded_at': item.modified_at,
+            'row_version': 1,
+            'blob_hash': item.digest,
+            'document_id': document_id,
+            'version_number': 1,
+            'is_current_version': True,
+        })
+    file_table = File.__table__
+    file_ids = db.session.execute(
+        file_table.insert().returning(file_table.c.id, sort_by_parameter_order=True), file_rows).scalars().all()
+    db.session.execute(
+        document_table.update().where(document_table.c.id == db.bindparam('b_id'))
+        .values(current_version_id=db.bindparam('b_version')),
+        [{'b_id': document_id, 'b_version': file_id} for document_id, file_id in zip(document_ids, file_ids)])
+    
+    connection = db.session.connection()
+    if search_index.is_available(connection):
+        search_index.index_new_files(connection, [(file_id, row['title'], row['description'])
+                                                  for file_id, row in zip(file_ids, file_rows)])
+    job_rows = []
+    for file_id, row in zip(file_ids, file_rows):
+        kinds = []
+        if row['file_type'] in extraction.EXTRACTABLE_TYPES:
+            kinds.append('extract_text')
+        if rendition_cache.can_render(row['file_type']):
+            kinds.append('render_thumbnail')
+        job_rows.extend({'kind': kind, 'payload': json.dumps({'file_id': file_id}), 'status': 'queued',
+                         'attempts': 0, 'max_attempts': app.config['JOB_MAX_ATTEMPTS'], 'run_at': now,
+                         'created_at': now} for kind in kinds)
+    if job_rows:
+        db.session.execute(Job.__table__.insert(), job_rows)
+    invalidate_cache(*{tag for row in file_rows for tag in file_cache_tags(uploader_id, row['department_id'])})
+    return len(new)
+
+def generate_batch(plans, department_ids, user_ids):
+    """Insert a batch of synthetic documents (synthetic.Generator plans) with bulk statements.
+
+    Department and user indexes of the plans are mapped through department_ids
+    and user_ids. Returns the number of files and comments inserted.
+    """
+    document_table = Document.__table__
+    document_ids = db.session.execute(
+        document_table.insert().returning(document_table.c.id, sort_by_parameter_order=True),
+        [{'version_count': len(plan['versions']), 'next_version_number': len(plan['versions']) + 1,
+          'created_at': plan['versions'][0]['uploaded_at']} for plan in plans]).scalars().all()
+    file_rows = []
+    for plan, document_id in zip(plans, document_ids):
+        for version in plan['versions']:
+            file_rows.append({
+                'title': version['title'],
+                'description': version['description'],
+                'filename': new_stored_filename(version['original_filename']),
+                'original_filename': version['original_filename'],
+                'file_type': version['file_type'],
+                'file_size': version['file_size'],
+                'status': version['status'],
+                'category': version['category'],
+                'uploaded_by': user_ids[version['uploader']],
+                'department_id': department_ids[plan['department']],
+                'uploaded_at': version['uploaded_at'],
+                'reviewed_at': version['reviewed_at'],
+                'reviewed_by': user_ids[version['reviewer']] if version['reviewer'] is not None else None,
+                'row_version': 2 if version['reviewed_at'] else 1,
+                'blob_hash': version['blob_hash'],
+                'document_id': document_id,
+                'version_number': version['version_number'],
+                'is_current_version': version['version_number'] == len(plan['versions']),
+                'revision_notes': version['revision_notes'],
+            })
+    file_table = File.__table__
+    file_ids = db.session.execute(
+        file_table.insert().returning(file_table.c.id, sort_by_parameter_order=True), file_rows).scalars().all()
+    
+    # Revisions point at the first version; documents at their last
+    parents, currents, comment_rows = [], [], []
+    position = 0
+    for plan, document_id in zip(plans, document_ids):
+        ids = file_ids[position:position + len(plan['versions'])]
+        position += len(ids)
+        parents.extend({'b_id': file_id, 'b_parent': ids[0]} for file_id in ids[1:])
+        currents.append({'b_id': document_id, 'b_version': ids[-1]})
+        for file_id, version in zip(ids, plan['versions']):
+            comment_rows.extend({'content': content, 'file_id': file_id, 'user_id': user_ids[author],
+                                 'created_at': created_at} for author, created_at, content in version['comments'])
+    if parents:
+        db.session.execute(file_table.update().where(file_table.c.id == db.bindparam('b_id'))
+                           .values(parent_file_id=db.bindparam('b_parent')), parents)
+    db.session.execute(document_table.update().where(document_table.c.id == db.bindparam('b_id'))
+                       .values(current_version_id=db.bindparam('b_version')), currents)
+    if comment_rows:
+        db.session.execute(Comment.__table__.insert(), comment_rows)
+    return len(file_ids), len(comment_rows)
+
+def lineage_document(rows):
+    """A Document for existing versions given as (is_current, version_number, file_id) rows"""
+    # The flagged current version wins; otherwise the highest version number
+    return Document(
+        current_version_id=max(rows)[2],
+        version_count=len(rows),
+        next_version_number=max(number for _, number, _ in rows) + 1,
+    )
+
+def backfill_documents(batch_size=500):
+    """Create Document rows for files stored before lineage was tracked.
+
+    An original file (parent_file_id NULL) and its revisions become one
+    document; a revision whose original no longer exists starts its own.
+    Returns the number of documents created.
+    """
+    created = 0
+    while True:
+        roots = File.query.filter(File.document_id.is_(None), File.parent_file_id.is_(None)) \
+            .order_by(File.id).limit(batch_size).all()
+        if not roots:
+            # Revisions left over are orphans; they are their own roots
+            roots = File.query.filter(File.document_id.is_(None)).order_by(File.id).limit(batch_size).all()
+            orphans = True
+        else:
+            orphans = False
+        if not roots:
+            return created
         
-        response = Response(generate(), mimetype=mime_type)
-        response.headers['Content-Disposition'] = f'inline; filename="{file.original_filename}"'
-        return response
-    else:
-        # For other file types, still try to display inline if possible
-        return send_from_directory(
-            app.config['UPLOAD_FOLDER'], 
-            file.filename,
-            as_attachment=False,
-            download_name=file.original_filename,
-            mimetype=mime_type
-        )
+        root_ids = [root.id for root in roots]
+        lineage = File.id if orphans else db.func.coalesce(File.parent_file_id, File.id)
+        version_filter = File.id.in_(root_ids) if orphans else \
+            or_(File.id.in_(root_ids), File.parent_file_id.in_(root_ids))
+        versions = {}
+        for root_id, version_id, version_number, is_current in db.session.query(
+                lineage, File.id, File.version_number, File.is_current_version).filter(version_filter):
+            versions.setdefault(root_id, []).append((bool(is_current), version_number or 1, version_id))
+        
+        documents = {root_id: lineage_document(rows) for root_id, rows in versions.items()}
+        db.session.add_all(documents.values())
+        db.session.flush()
+        
+        # Bulk UPDATE by primary key (executemany)
+        db.session.execute(db.update(File), [
+            {'id': version_id, 'document_id': documents[root_id].id}
+            for root_id, rows in versions.items() for _, _, version_id in rows
+        ])
+        db.session.commit()
+        created += len(documents)
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models.
+
+    create_all() only creates missing tables, so columns and indexes added
+    to existing tables are created here explicitly. New columns are always
+    added as nullable; integer defaults are applied to existing rows.
+    """
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, int) and not isinstance(default, bool):
+                    column_type += f' DEFAULT {default}'
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                print(f"  ➕ {table.name}.{column.name}")
+        for index in table.indexes:
+            # Existing rows may violate a unique index; those are created last
+            if not index.unique:
+                index.create(bind=db.engine, checkfirst=True)
+    
+    backfilled = backfill_documents()
+    if backfilled:
+        print(f"📚 {backfilled} belge için versiyon geçmişi oluşturuldu")
+    
+    with db.engine.begin() as connection:
+        if search_index.ensure_index(connection):
+            indexed = search_index.rebuild_index(connection)
+            print(f"🔎 Arama dizini oluşturuldu ({indexed} dosya)")
+    
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.unique and index.name not in existing:
+                create_unique_index(index)
+
+def create_unique_index(index):
+    """Create a unique index on an existing table, unless rows already repeat its key.
+
+    Repeats are reported instead (several legacy rows can share one stored
+    file); the lookups it serves work without it, only slower.
+    """
+    columns = list(index.columns)
+    count = db.func.count()
+    duplicates = db.session.query(*columns, count).group_by(*columns).having(count > 1) \
+        .order_by(count.desc()).limit(5).all()
+    if duplicates:
+        db.session.rollback()
+        listed = ', '.join(f"{'/'.join(map(str, row[:-1]))} ({row[-1]})" for row in duplicates)
+        print(f"⚠️ {index.name} oluşturulamadı, tekrarlanan değerler var: {listed}")
+        return False
+    index.create(bind=db.engine)
+    return True
 
 def initialize_app():
     """SQLite veritabanı kurulumu ve başlatma"""
@@ -474,8 +2894,8 @@ def initialize_app():
         try:
             print("🗃️ SQLite veritabanı başlatılıyor...")
             
-            # Tabloları oluştur
-            db.create_all()
+            # Tabloları ve indeksleri oluştur
+            upgrade_schema()
             print("✅ Veritabanı tabloları oluşturuldu")
             
             # Kullanıcı sayısını kontrol et
@@ -572,6 +2992,433 @@ def create_admin_user():
     except Exception as e:
         print(f"❌ Admin oluşturma hatası: {e}")
 
+# CLI: flask --app app docuvault <command>
+@app.cli.group()
+def docuvault():
+    """DocuVault yönetim komutları"""
+
+@docuvault.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables, indexes and the search index"""
+    upgrade_schema()
+    print("✅ Veritabanı şeması güncel")
+
+@docuvault.command('reindex')
+@click.option('--all', 'reindex_all', is_flag=True, help='Re-extract every file, not only the backlog.')
+@click.option('--workers', default=4, show_default=True, help='Parallel extraction threads.')
+@click.option('--batch-size', default=200, show_default=True, help='Files read from the database per batch.')
+def reindex_command(reindex_all, workers, batch_size):
+    """Extract and index the text content of stored files"""
+    base = File.query.filter(File.file_type.in_(extraction.EXTRACTABLE_TYPES)) if reindex_all \
+        else extraction_backlog_query()
+    total = base.count()
+    print(f"🔎 {total} dosya işlenecek ({workers} iş parçacığı)")
+    
+    def extract(job):
+        file_id, path, file_type = job
+        try:
+            return file_id, extraction.extract_text(path, file_type, app.config['EXTRACTION_MAX_CHARS']), None
+        except Exception as e:
+            return file_id, None, str(e)[:500]
+    
+    done = failed = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            # Keyset on id: rows written in this loop drop out of the backlog query
+            batch = base.filter(File.id > last_id).order_by(File.id).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            jobs = [(file.id, stored_file_path(file), file.file_type) for file in batch]
+            for file_id, text, error in pool.map(extract, jobs):
+                save_file_content(file_id, text, error=error)
+                done += 1
+                failed += error is not None
+            print(f"   {done}/{total} dosya ({failed} hata)")
+    print(f"✅ İçerik dizini güncellendi: {done} dosya, {failed} hata")
+
+@docuvault.command('migrate-blobs')
+@click.option('--dry-run', is_flag=True, help='Only report what would be moved.')
+def migrate_blobs_command(dry_run):
+    """Rehash legacy uploads/<filename> files into the blob store in place"""
+    files = File.query.filter(File.blob_hash.is_(None)).order_by(File.id).all()
+    moved = deduplicated = missing = 0
+    bytes_saved = 0
+    digests = {}
+    for file in files:
+        legacy_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+        if file.filename in digests:
+            # Several rows share one legacy file; it was moved already
+            file.blob_hash = digests[file.filename]
+            continue
+        if not os.path.isfile(legacy_path):
+            missing += 1
+            print(f"   ⚠️ Dosya yok: {file.filename}")
+            continue
+        if dry_run:
+            moved += 1
+            continue
+        digest, size, created = blob_store.adopt(legacy_path)
+        register_blob(digest, size)
+        file.blob_hash = digest
+        digests[file.filename] = digest
+        if created:
+            moved += 1
+        else:
+            deduplicated += 1
+            bytes_saved += size
+        db.session.commit()
+    db.session.commit()
+    prefix = "(deneme) " if dry_run else ""
+    print(f"✅ {prefix}{moved} dosya taşındı, {deduplicated} kopya birleştirildi, {missing} dosya eksik")
+    print(f"💾 Kazanılan alan: {bytes_saved / 1024 / 1024:.2f} MB")
+
+@docuvault.command('import')
+@click.argument('source', type=click.Path(exists=True, file_okay=False))
+@click.option('--user', 'username', required=True, help='Username recorded as the uploader.')
+@click.option('--mapping', type=click.Path(exists=True, dir_okay=False),
+              help='JSON file mapping folders to departments and categories (see importer.py).')
+@click.option('--status', type=click.Choice(['approved', 'pending']), default='approved', show_default=True,
+              help='Review status of the imported files.')
+@click.option('--workers', default=8, show_default=True, help='Threads reading and hashing files.')
+@click.option('--batch-size', default=2000, show_default=True, help='Files inserted per transaction.')
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help='Progress file for resuming (default: instance/import-<folder>.checkpoint).')
+@click.option('--create-departments', is_flag=True, help='Create departments named in the mapping if missing.')
+def import_command(source, username, mapping, status, workers, batch_size, checkpoint, create_departments):
+    """Bulk-import a directory tree of existing documents"""
+    uploader = User.query.filter_by(username=username).first()
+    if uploader is None:
+        raise click.ClickException(f'Kullanıcı bulunamadı: {username}')
+    folder_map = importer.FolderMap.load(mapping) if mapping else importer.FolderMap()
+    if 'department' not in folder_map.defaults:
+        if uploader.department is None:
+            raise click.ClickException('Eşleme dosyasında varsayılan "department" gerekli')
+        folder_map.defaults['department'] = uploader.department.name
+    
+    department_ids = {department.name: department.id for department in Department.query.all()}
+    missing = sorted(folder_map.departments() - set(department_ids))
+    if missing and not create_departments:
+        raise click.ClickException(f"Departman bulunamadı: {', '.join(missing)} (--create-departments)")
+    for name in missing:
+        department = Department(name=name)
+        db.session.add(department)
+        db.session.flush()
+        department_ids[name] = department.id
+        print(f"✅ Departman oluşturuldu: {name}")
+    db.session.commit()
+    
+    source = os.path.abspath(source)
+    os.makedirs(app.instance_path, exist_ok=True)
+    checkpoint = importer.Checkpoint(checkpoint or os.path.join(
+        app.instance_path, f'import-{secure_filename(os.path.basename(source)) or "root"}.checkpoint'))
+    if checkpoint.done:
+        print(f"↩️ {len(checkpoint.done)} dosya önceki çalıştırmada işlenmiş, atlanıyor ({checkpoint.path})")
+    
+    paths = (path for path in importer.walk(source, ALLOWED_EXTENSIONS) if path not in checkpoint)
+    throughput = importer.Throughput()
+    totals = {'imported': 0, 'duplicate': 0, 'rejected': 0, 'failed': 0}
+    for batch in importer.staged_batches(blob_store, source, paths, workers, batch_size):
+        staged = [item for item in batch if item.error is None]
+        imported = import_batch(staged, uploader.id, department_ids, folder_map, status)
+        db.session.commit()
+        checkpoint.add([item.relative_path for item in batch if item.error is None or item.rejected])
+        
+        totals['imported'] += imported
+        totals['duplicate'] += len(staged) - imported
+        for item in batch:
+            if item.error is not None:
+                totals['rejected' if item.rejected else 'failed'] += 1
+                print(f"  ⚠️ {item.relative_path}: {item.error}")
+        throughput.add(len(batch), sum(item.size for item in staged))
+        files_per_second, mb_per_second = throughput.rates()
+        print(f"📦 {throughput.files} dosya okundu, {totals['imported']} eklendi "
+              f"({files_per_second:.1f} dosya/sn, {mb_per_second:.1f} MB/sn)", flush=True)
+    
+    files_per_second, mb_per_second = throughput.rates()
+    print(f"✅ İçe aktarma bitti: {totals['imported']} yeni, {totals['duplicate']} zaten kayıtlı, "
+          f"{totals['rejected']} reddedildi, {totals['failed']} hatalı "
+          f"({files_per_second:.1f} dosya/sn, {mb_per_second:.1f} MB/sn)")
+    if totals['failed']:
+        print("🔄 Hatalı dosyalar için komutu yeniden çalıştırın; işlenenler atlanır")
+
+@docuvault.command('generate-data')
+@click.option('--departments', default=50, show_default=True, help='Departments to create.')
+@click.option('--users', default=5000, show_default=True, help='Department users to create.')
+@click.option('--admins', default=5, show_default=True, help='Admin users to create.')
+@click.option('--files', default=1_000_000, show_default=True, help='File rows to create, versions included.')
+@click.option('--blobs', default=2000, show_default=True, help='Placeholder file bodies shared by the files.')
+@click.option('--comments-per-file', default=1.5, show_default=True, help='Average comments per file.')
+@click.option('--max-versions', default=20, show_default=True, help='Longest version chain.')
+@click.option('--days', default=730, show_default=True, help='Upload dates are spread over this many days.')
+@click.option('--password', required=True, help='Password of every generated user, admins included.')
+@click.option('--seed', default=1, show_default=True, help='Random seed; the same seed gives the same data.')
+@click.option('--batch-size', default=5000, show_default=True, help='File rows inserted per transaction.')
+@click.option('--force', is_flag=True, help='Add to a database that already has users or files.')
+def generate_data_command(departments, users, admins, files, blobs, comments_per_file, max_versions, days,
+                          password, seed, batch_size, force):
+    """Fill the database with synthetic departments, users, files and comments for load tests (see synthetic.py)"""
+    if users < departments:
+        raise click.ClickException('--users en az --departments kadar olmalı')
+    # Placeholder bodies do not match their digests: keep them out of a real database and blob store
+    if not force and (db.session.query(User.id).first() is not None or db.session.query(File.id).first() is not None):
+        raise click.ClickException('Veritabanında kullanıcı veya dosya var; sentetik veri yalnızca boş bir '
+                                   'veritabanına eklenir (yine de eklemek için --force)')
+    if User.query.filter(User.username.like('synthetic-%')).first() is not None:
+        raise click.ClickException('Veritabanında zaten sentetik veri var; boş bir DATABASE_URL kullanın')
+    generator = synthetic.Generator(seed=seed, departments=departments, users=users, admins=max(1, admins),
+                                    blobs=blobs, days=days, max_versions=max_versions,
+                                    comments_per_file=comments_per_file)
+    now = datetime.utcnow()
+    
+    department_table = Department.__table__
+    department_ids = db.session.execute(
+        department_table.insert().returning(department_table.c.id, sort_by_parameter_order=True),
+        generator.departments()).scalars().all()
+    # One hash for everyone: hashing thousands of passwords would take minutes
+    user_rows = generator.users(generate_password_hash(password))
+    user_table = User.__table__
+    user_ids = db.session.execute(
+        user_table.insert().returning(user_table.c.id, sort_by_parameter_order=True),
+        [{'username': row['username'], 'email': row['email'], 'password_hash': row['password_hash'],
+          'role': row['role'], 'department_id': department_ids[row['department']], 'created_at': now}
+         for row in user_rows]).scalars().all()
+    
+    pool = generator.blobs()
+    for blob in pool:
+        synthetic.write_placeholder(blob_store.path(blob['digest']), blob['size'])
+    stored = set(db.session.execute(db.select(Blob.hash).where(Blob.hash.in_([blob['digest'] for blob in pool])))
+                 .scalars())
+    blob_rows = [{'hash': blob['digest'], 'size': blob['size'], 'ref_count': 0, 'created_at': now,
+                  'last_used_at': now} for blob in pool if blob['digest'] not in stored]
+    if blob_rows:
+        db.session.execute(Blob.__table__.insert(), blob_rows)
+    db.session.commit()
+    print(f"👥 {len(department_ids)} departman, {len(user_ids)} kullanıcı, {len(pool)} örnek dosya içeriği "
+          f"oluşturuldu")
+    
+    references = {}
+    totals = {'files': 0, 'comments': 0}
+    started = time.perf_counter()
+    
+    def flush(plans):
+        inserted_files, inserted_comments = generate_batch(plans, department_ids, user_ids)
+        db.session.commit()
+        for plan in plans:
+            for version in plan['versions']:
+                references[version['blob_hash']] = references.get(version['blob_hash'], 0) + 1
+        totals['files'] += inserted_files
+        totals['comments'] += inserted_comments
+        rate = totals['files'] / (time.perf_counter() - started)
+        print(f"📦 {totals['files']}/{files} dosya, {totals['comments']} yorum eklendi ({rate:.0f} dosya/sn)",
+              flush=True)
+    
+    plans, planned = [], 0
+    for plan in generator.documents(files, pool):
+        plans.append(plan)
+        planned += len(plan['versions'])
+        if planned >= batch_size:
+            flush(plans)
+            plans, planned = [], 0
+    if plans:
+        flush(plans)
+    
+    db.session.execute(Blob.__table__.update().where(Blob.hash == db.bindparam('b_hash'))
+                       .values(ref_count=Blob.ref_count + db.bindparam('b_count')),
+                       [{'b_hash': digest, 'b_count': count} for digest, count in references.items()])
+    db.session.commit()
+    with db.engine.begin() as connection:
+        if search_index.is_available(connection):
+            print(f"🔎 Arama dizini yeniden oluşturuldu ({search_index.rebuild_index(connection)} dosya)")
+    print(f"✅ Sentetik veri hazır: {totals['files']} dosya, {totals['comments']} yorum "
+          f"({time.perf_counter() - started:.1f} sn)")
+
+@docuvault.command('copy-db')
+@click.option('--source', default=None, help='Source database URL (default: instance/docuvault.db).')
+@click.option('--target', default=None, help='Target database URL (default: DATABASE_URL).')
+@click.option('--batch-size', default=database.COPY_BATCH_SIZE, show_default=True, help='Rows per INSERT batch.')
+def copy_db_command(source, target, batch_size):
+    """Copy an existing SQLite database into PostgreSQL (or any empty database)"""
+    source = source or 'sqlite:///' + os.path.join(app.instance_path, 'docuvault.db')
+    target = target or app.config['SQLALCHEMY_DATABASE_URI']
+    if source == target:
+        raise click.ClickException('Kaynak ve hedef veritabanı aynı; hedefi --target veya DATABASE_URL ile verin')
+    print(f"🚚 {source} → {target.split('@')[-1]}")
+    started = datetime.utcnow()
+    try:
+        copied = database.copy_database(source, target, db.metadata, batch_size=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    seconds = (datetime.utcnow() - started).total_seconds()
+    print(f"✅ {sum(copied.values())} satır {len(copied)} tabloda kopyalandı ({seconds:.1f} sn)")
+    print("ℹ️ Hedefte 'flask docuvault upgrade-db' çalıştırmayı unutmayın")
+
+@docuvault.command('share')
+@click.argument('department')
+@click.argument('grantee')
+@click.option('--access', type=click.Choice(ACCESS_LEVELS + ('none',)), default='view', show_default=True,
+              help="What the grantee may do; 'none' removes the rule.")
+def share_command(department, grantee, access):
+    """Share DEPARTMENT's files with the users of GRANTEE (department names)"""
+    owner = Department.query.filter_by(name=department).first()
+    target = Department.query.filter_by(name=grantee).first()
+    if owner is None or target is None:
+        raise click.ClickException('Departman bulunamadı')
+    rule = DepartmentShare.query.filter_by(department_id=owner.id, grantee_department_id=target.id).first()
+    if access == 'none':
+        if rule is not None:
+            db.session.delete(rule)
+    elif rule is None:
+        db.session.add(DepartmentShare(department_id=owner.id, grantee_department_id=target.id, access=access))
+    else:
+        rule.access = access
+    db.session.commit()
+    for rule in DepartmentShare.query.filter_by(department_id=owner.id):
+        print(f"🔗 {owner.name} → {db.session.get(Department, rule.grantee_department_id).name}: {rule.access}")
+
+@docuvault.command('offload-config')
+def offload_config_command():
+    """Print the nginx internal locations that FILE_OFFLOAD=nginx redirects to"""
+    print(delivery.Offload('nginx', offload_locations).nginx_config())
+
+@docuvault.command('worker')
+@click.option('--concurrency', default=None, type=int, help='Jobs run in parallel (default: JOB_CONCURRENCY).')
+@click.option('--until-empty', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+def worker_command(concurrency, until_empty):
+    """Run queued background jobs (text extraction, thumbnails, storage tiering)"""
+    worker = jobs.Worker(
+        db.engine, Job.__table__, job_handlers,
+        concurrency=concurrency or app.config['JOB_CONCURRENCY'],
+        lease=app.config['JOB_LEASE_SECONDS'],
+        poll_interval=app.config['JOB_POLL_INTERVAL'],
+        retry_base=app.config['JOB_RETRY_BASE'],
+        retry_max=app.config['JOB_RETRY_MAX'],
+        retention=app.config['JOB_RETENTION'].total_seconds(),
+        log=lambda message: print(f"  {message}", flush=True),
+    )
+    # Recurring jobs re-queue themselves; this starts the chain on a fresh queue
+    ensure_job_queued('tier_storage')
+    db.session.commit()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: worker.stop())
+    print(f"⚙️ İş kuyruğu çalışıyor ({worker.worker_id}, {worker.concurrency} iş parçacığı)", flush=True)
+    counters = worker.run(until_empty=until_empty)
+    print(f"✅ {counters['done']} iş tamamlandı, {counters['retried']} yeniden denenecek, "
+          f"{counters['dead']} ölü kuyrukta")
+
+@docuvault.command('tier')
+@click.option('--workers', default=2, show_default=True, help='Blobs compressed in parallel.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be moved.')
+def tier_command(workers, dry_run):
+    """Move non-current versions and old content into the compressed cold tier now"""
+    started = time.monotonic()
+    counters = tier_storage(workers=workers, dry_run=dry_run)
+    prefix = "(deneme) " if dry_run else ""
+    print(f"🧊 {prefix}{counters['archived']} blob soğuk katmana taşındı, "
+          f"{counters['not_worth']} sıkıştırmaya değmez, {counters['failed']} hata "
+          f"({time.monotonic() - started:.1f} sn)")
+    if counters['bytes_in']:
+        print(f"   {counters['bytes_in'] / 1024 / 1024:.1f} MB → {counters['bytes_out'] / 1024 / 1024:.1f} MB")
+    for name, values in sorted(storage_stats()['tiers'].items()):
+        print(f"   {name}: {values['blobs']} blob, {values['files']} dosya, "
+              f"{values['stored_bytes'] / 1024 / 1024:.1f} MB depoda, "
+              f"{values['saved_bytes'] / 1024 / 1024:.1f} MB tasarruf")
+
+@docuvault.command('encode-deltas')
+def encode_deltas_command():
+    """Store every superseded version that is still kept in full as a reverse delta"""
+    candidates = db.session.query(File.id).join(Blob, Blob.hash == File.blob_hash).filter(
+        File.is_current_version.is_(False), or_(Blob.tier.is_(None), Blob.tier == 'hot')
+    ).order_by(File.document_id, File.version_number.desc()).all()
+    encoded = bytes_before = bytes_after = 0
+    for file_id, in candidates:
+        file = db.session.get(File, file_id)
+        size = file.file_size or 0
+        stored_size = encode_delta(file)
+        if stored_size is not None:
+            encoded += 1
+            bytes_before += size
+            bytes_after += stored_size
+    print(f"🧬 {len(candidates)} eski versiyondan {encoded} tanesi fark olarak saklandı: "
+          f"{bytes_before / 1024 / 1024:.1f} MB → {bytes_after / 1024 / 1024:.1f} MB")
+
+@docuvault.command('gc-blobs')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+def gc_blobs_command(dry_run):
+    """Delete blobs that no File row references any more"""
+    # Recount references from the File table so that drifted counters heal themselves
+    counts = dict(db.session.query(File.blob_hash, db.func.count())
+                  .filter(File.blob_hash.isnot(None)).group_by(File.blob_hash).all())
+    # Bases of reverse deltas are kept as long as the deltas are
+    bases = {digest for digest, in db.session.query(Blob.base_hash).filter(Blob.tier == 'delta')}
+    cutoff = datetime.utcnow() - app.config['BLOB_GC_GRACE']
+    deleted = 0
+    bytes_freed = 0
+    for blob in Blob.query.all():
+        blob.ref_count = counts.get(blob.hash, 0)
+        if blob.ref_count == 0 and blob.hash not in bases and (blob.last_used_at or blob.created_at) < cutoff:
+            if not dry_run:
+                blob_store.delete(blob.hash)
+                cold_store.delete(blob.hash)
+                delta_store.delete(blob.hash)
+                db.session.delete(blob)
+            deleted += 1
+            bytes_freed += blob.size
+    
+    # Bytes on disk without any Blob row (e.g. a crash between write and commit)
+    known = {blob.hash for blob in Blob.query.all()} | set(counts)
+    for digest in blob_store.iter_digests():
+        path = blob_store.path(digest)
+        if digest not in known and datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+            size = os.path.getsize(path)
+            if not dry_run:
+                blob_store.delete(digest)
+            deleted += 1
+            bytes_freed += size
+    
+    # Cold copies without a Blob row, or left behind when the content was uploaded again
+    cold = {digest for digest, in db.session.query(Blob.hash).filter(Blob.tier == 'cold')}
+    for digest in list(cold_store.iter_digests()):
+        codec = cold_store.find(digest)
+        path = cold_store.path(digest, codec)
+        stale = digest in known and digest not in cold and blob_store.exists(digest)
+        if stale or (digest not in known and datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff):
+            size = os.path.getsize(path)
+            if not dry_run:
+                cold_store.delete(digest)
+            deleted += 1
+            bytes_freed += size
+    
+    # Deltas without a Blob row, or left behind when the content was stored in full again
+    delta = {digest for digest, in db.session.query(Blob.hash).filter(Blob.tier == 'delta')}
+    for digest in list(delta_store.iter_digests()):
+        path = delta_store.path(digest)
+        stale = digest in known and digest not in delta and \
+            (blob_store.exists(digest) or cold_store.find(digest) is not None)
+        if stale or (digest not in known and datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff):
+            size = os.path.getsize(path)
+            if not dry_run:
+                delta_store.delete(digest)
+            deleted += 1
+            bytes_freed += size
+    
+    # Abandoned resumable uploads
+    expired = UploadSession.query.filter(
+        UploadSession.updated_at < datetime.utcnow() - app.config['UPLOAD_SESSION_TTL']).all()
+    for upload_session in expired:
+        if not dry_run:
+            ingest.discard_session(blob_store, upload_session.id)
+            db.session.delete(upload_session)
+    
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    prefix = "(deneme) " if dry_run else ""
+    print(f"🧹 {prefix}{len(expired)} yarım kalan yükleme temizlendi")
+    print(f"🧹 {prefix}{deleted} blob silindi, {bytes_freed / 1024 / 1024:.2f} MB boşaltıldı")
+
 if __name__ == '__main__':
     # Uygulama başlatma
     initialize_app()
@@ -580,5 +3427,9 @@ if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('FLASK_ENV') != 'production'
     
+    # The development server runs each request in its own thread: streams don't starve it
+    if 'EVENT_STREAM_SYNC_SECONDS' not in os.environ:
+        app.config['EVENT_STREAM_SYNC_SECONDS'] = 30
+    
     print(f"🚀 DocuVault başlatılıyor - Port: {port}, Debug: {debug_mode}")
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
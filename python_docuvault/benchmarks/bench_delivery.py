@@ -0,0 +1,90 @@
+"""Bytes and latency of file delivery with validators and ranges.
+
+Serves a synthetic file through delivery.send_stored_file() from a bare
+Flask app (no database) and compares:
+  * first view      - full 200 response
+  * repeat view     - If-None-Match revalidation (304, no body)
+  * video seeks     - Range requests at random offsets (206)
+against the old behaviour of always streaming the whole file.
+
+    python benchmarks/bench_delivery.py [--size-mb 64] [--seeks 50]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request  # noqa: E402
+
+import delivery  # noqa: E402
+
+
+def make_app(path):
+    app = Flask(__name__)
+
+    @app.route('/file')
+    def serve():
+        return delivery.send_stored_file(request, path, 'video/mp4', etag='bench', disposition='inline',
+                                         download_name='örnek video.mp4')
+
+    return app
+
+
+def timed(client, headers, repeat):
+    transferred = 0
+    status = None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = client.get('/file', headers=headers)
+        status = response.status_code
+        transferred += len(response.get_data())
+        response.close()
+    elapsed = time.perf_counter() - started
+    return status, transferred, elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--seeks', type=int, default=50)
+    parser.add_argument('--seek-kb', type=int, default=512, help='bytes fetched per seek')
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            f.write(block)
+        path = f.name
+    try:
+        client = make_app(path).test_client()
+        rows = []
+        status, sent, latency = timed(client, {}, 3)
+        rows.append(('first view', status, sent / 3, latency))
+        status, sent, latency = timed(client, {'If-None-Match': '"bench"'}, 100)
+        rows.append(('repeat view', status, sent / 100, latency))
+
+        rng = random.Random(42)
+        span = args.seek_kb * 1024
+        total_sent = 0
+        started = time.perf_counter()
+        for _ in range(args.seeks):
+            start = rng.randrange(0, size - span)
+            status, sent, _ = timed(client, {'Range': f'bytes={start}-{start + span - 1}'}, 1)
+            total_sent += sent
+        rows.append(('video seek', status, total_sent / args.seeks, (time.perf_counter() - started) / args.seeks))
+
+        print(f'file size: {args.size_mb} MB')
+        print(f"{'request':<14}{'status':>8}{'bytes/request':>16}{'ms/request':>12}{'full-file bytes':>18}")
+        for name, status, sent, latency in rows:
+            print(f'{name:<14}{status:>8}{int(sent):>16,}{latency * 1000:>12.2f}{size:>18,}')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
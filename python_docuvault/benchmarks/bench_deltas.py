@@ -0,0 +1,137 @@
+"""Storage and rebuild cost of reverse deltas for heavily revised documents.
+
+Simulates documents revised --versions times (a few lines edited each time):
+  * report.txt  - a text report
+  * report.docx - a Word file: a zip whose document.xml is edited, next to
+                  styles and an image that do not change
+and stores their history the way the app does with DELTA_STORAGE=reverse:
+the newest version in full, each older one as a deltas.DeltaStore delta
+against the next, every --snapshot-th version in full. Reports the storage
+ratio against full copies and the time to materialise the oldest version,
+which has the longest chain to walk (each step is written to disk, as the
+hot cache does in the app).
+
+    python benchmarks/bench_deltas.py [--versions 20] [--lines 20000] [--snapshots 5,10,0]
+"""
+import argparse
+import hashlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deltas  # noqa: E402
+
+
+def text_versions(count, lines, rng):
+    rows = [f"{i:06d};{rng.choice(['Fatura', 'İrsaliye', 'Sözleşme'])};{rng.randint(1, 99999)},{rng.randint(0, 99):02d} TL;"
+            f"{rng.random():.8f}\n" for i in range(lines)]
+    versions = []
+    for _ in range(count):
+        versions.append(''.join(rows).encode())
+        for _ in range(rng.randint(2, 8)):
+            position = rng.randrange(len(rows))
+            if rng.random() < 0.7:
+                rows[position] = f"{position:06d};Düzeltme;{rng.randint(1, 99999)},00 TL;{rng.random():.8f}\n"
+            else:
+                rows.insert(position, f"{position:06d};Ek satır;{rng.random():.8f}\n")
+    return versions
+
+
+def docx_versions(count, lines, rng):
+    image = rng.randbytes(200_000)
+    styles = ''.join(f'<w:style w:styleId="s{i}"><w:name w:val="Stil {i}"/></w:style>' for i in range(500)).encode()
+    versions = []
+    for body in text_versions(count, lines // 4, rng):
+        paragraphs = ''.join(f'<w:p><w:r><w:t>{line}</w:t></w:r></w:p>\n'
+                             for line in body.decode().splitlines())
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in (('[Content_Types].xml', b'<Types/>'), ('word/styles.xml', styles),
+                               ('word/media/image1.png', image),
+                               ('word/document.xml', f'<w:document><w:body>{paragraphs}</w:body></w:document>'.encode())):
+                info = zipfile.ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+                archive.writestr(info, data, zipfile.ZIP_STORED if name.endswith('.png') else zipfile.ZIP_DEFLATED)
+        versions.append(buffer.getvalue())
+    return versions
+
+
+def store_history(workdir, versions, snapshot):
+    """Store a version history; returns (store, digests, stored bytes, encode seconds)"""
+    digests = [hashlib.sha256(body).hexdigest() for body in versions]
+    full = os.path.join(workdir, 'full')
+    os.makedirs(full, exist_ok=True)
+    for digest, body in zip(digests, versions):
+        with open(os.path.join(full, digest), 'wb') as f:
+            f.write(body)
+    store = deltas.DeltaStore(os.path.join(workdir, 'delta'))
+    stored = len(versions[-1])
+    started = time.perf_counter()
+    # In revision order: version n is encoded when n + 1 arrives, while n + 1 is still stored in full
+    for number in range(1, len(versions)):
+        digest, base = digests[number - 1], digests[number]
+        size = None
+        if not snapshot or number % snapshot:
+            size = store.store(digest, os.path.join(full, digest), base, os.path.join(full, base))
+        stored += size if size is not None else len(versions[number - 1])
+        if size is not None:
+            os.remove(os.path.join(full, digest))
+    return store, digests, stored, time.perf_counter() - started
+
+
+def materialise(workdir, store, digest):
+    """Path of a version, rebuilding it and every delta on its chain from the nearest full copy"""
+    path = os.path.join(workdir, 'full', digest)
+    if os.path.exists(path):
+        return path
+    base_path = materialise(workdir, store, store.base_of(digest))
+    with open(path, 'wb') as f:
+        for chunk in store.iter_chunks(digest, base_path):
+            f.write(chunk)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--snapshots', default='5,10,0', help='Snapshot intervals to compare (0: none).')
+    args = parser.parse_args()
+
+    print(f"{'document':<13}{'snapshot':>9}{'full MB':>9}{'stored MB':>11}{'ratio':>8}"
+          f"{'encode s':>10}{'chain':>7}{'oldest ms':>11}{'newest ms':>11}")
+    for name, make in (('report.txt', text_versions), ('report.docx', docx_versions)):
+        versions = make(args.versions, args.lines, random.Random(7))
+        full_bytes = sum(len(body) for body in versions)
+        for snapshot in (int(value) for value in args.snapshots.split(',')):
+            workdir = tempfile.mkdtemp(prefix='bench-deltas-')
+            try:
+                store, digests, stored, encode = store_history(workdir, versions, snapshot)
+                chain = 0
+                digest = digests[0]
+                while store.exists(digest):
+                    chain += 1
+                    digest = store.base_of(digest)
+                started = time.perf_counter()
+                path = materialise(workdir, store, digests[0])
+                oldest = time.perf_counter() - started
+                with open(path, 'rb') as f:
+                    assert hashlib.sha256(f.read()).hexdigest() == digests[0]
+                started = time.perf_counter()
+                with open(materialise(workdir, store, digests[-1]), 'rb') as f:
+                    f.read()
+                newest = time.perf_counter() - started
+            finally:
+                shutil.rmtree(workdir)
+            print(f"{name:<13}{snapshot or '-':>9}{full_bytes / 1024 / 1024:>9.1f}{stored / 1024 / 1024:>11.2f}"
+                  f"{stored / full_bytes:>8.3f}{encode:>10.2f}{chain:>7}{oldest * 1000:>11.1f}{newest * 1000:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Per-request lookup cost of a file download as the file table grows.
+
+Fills an in-memory SQLite file table with 1k .. 1M rows and times what a
+download request has to do before it can open the file:
+  * filename, no index  - the old /uploads/<filename> lookup (full scan)
+  * filename, indexed   - the same lookup with ux_file_filename
+  * signed token        - tokens.DownloadTokens.verify(), no database at all
+
+    python benchmarks/bench_download_lookup.py [--sizes 1000,10000,100000,1000000] [--lookups 200]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokens  # noqa: E402
+
+
+def make_table(rows):
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE file (id INTEGER PRIMARY KEY, filename TEXT NOT NULL, '
+                       'blob_hash TEXT, file_type TEXT, uploaded_by INTEGER)')
+    connection.executemany(
+        'INSERT INTO file (id, filename, blob_hash, file_type, uploaded_by) VALUES (?, ?, ?, ?, ?)',
+        ((i, f'rapor_{i:07d}.pdf', f'{i:064x}', 'pdf', i % 50) for i in range(1, rows + 1)))
+    connection.commit()
+    return connection
+
+
+def time_lookups(connection, names):
+    started = time.perf_counter()
+    for name in names:
+        connection.execute('SELECT id, blob_hash, file_type FROM file WHERE filename = ?', (name,)).fetchone()
+    return (time.perf_counter() - started) / len(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    signer = tokens.DownloadTokens('bench-secret')
+    rng = random.Random(42)
+    print(f"{'rows':>10}{'no index ms':>14}{'indexed ms':>13}{'token ms':>11}")
+    for rows in (int(size) for size in args.sizes.split(',')):
+        connection = make_table(rows)
+        ids = [rng.randint(1, rows) for _ in range(args.lookups)]
+        names = [f'rapor_{i:07d}.pdf' for i in ids]
+        # Full scans get slow at 1M rows; a handful of lookups is enough there
+        scan = time_lookups(connection, names[:max(5, args.lookups * 1000 // rows)])
+        connection.execute('CREATE UNIQUE INDEX ux_file_filename ON file (filename)')
+        indexed = time_lookups(connection, names)
+        connection.close()
+
+        issued = [signer.issue(i, f'{i:064x}.pdf') for i in ids]
+        started = time.perf_counter()
+        for token in issued:
+            signer.verify(token)
+        verify = (time.perf_counter() - started) / len(issued)
+        print(f'{rows:>10,}{scan * 1000:>14.3f}{indexed * 1000:>13.4f}{verify * 1000:>11.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""SQL queries per request of the file detail and version history pages as threads grow.
+
+Builds documents with 1 .. N versions and 0 .. M comments on their current
+version in a throwaway SQLite database, then counts the statements the app
+runs for /file/<id> and /file/<id>/versions as an admin. Both pages load
+what they show with the file (authors of the comments, uploaders and
+reviewers of the versions, per-version comment counts in one grouped
+query), so the count must not depend on the size of the thread; the script
+exits with status 1 when it does.
+
+    python benchmarks/bench_file_detail.py [--versions 1,5,25] [--comments 0,10,100,1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKDIR = tempfile.mkdtemp(prefix='docuvault-bench-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'bench.db')
+os.environ['BLOB_FOLDER'] = os.path.join(WORKDIR, 'uploads')
+os.chdir(WORKDIR)
+
+import app as docuvault  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+statements = []
+
+
+@docuvault.db.event.listens_for(Engine, 'before_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def make_users():
+    department = docuvault.Department(name='Bench')
+    docuvault.db.session.add(department)
+    docuvault.db.session.flush()
+    users = [docuvault.User(username=f'user{i}', email=f'user{i}@bench.local', department_id=department.id,
+                            role='admin' if i == 0 else 'department') for i in range(20)]
+    docuvault.db.session.add_all(users)
+    docuvault.db.session.commit()
+    return department.id, [user.id for user in users]
+
+
+def make_document(department_id, user_ids, versions, comments):
+    """A document with versions versions; the current one has comments comments. Returns its id."""
+    started = datetime.utcnow() - timedelta(days=versions)
+    document = docuvault.Document(version_count=versions, next_version_number=versions + 1)
+    docuvault.db.session.add(document)
+    docuvault.db.session.flush()
+    files = []
+    for number in range(1, versions + 1):
+        files.append(docuvault.File(
+            title=f'Rapor v{number}', filename=f'{document.id}_{number}.pdf', original_filename='rapor.pdf',
+            file_type='pdf', file_size=1024, uploaded_by=user_ids[number % len(user_ids)],
+            reviewed_by=user_ids[0], reviewed_at=started + timedelta(days=number), status='approved',
+            department_id=department_id, document_id=document.id, version_number=number,
+            is_current_version=number == versions, uploaded_at=started + timedelta(days=number)))
+    docuvault.db.session.add_all(files)
+    docuvault.db.session.flush()
+    for version in files[1:]:
+        version.parent_file_id = files[0].id
+    document.current_version_id = files[-1].id
+    docuvault.db.session.bulk_insert_mappings(docuvault.Comment, [
+        {'content': f'Yorum {i}', 'file_id': files[-1].id, 'user_id': user_ids[i % len(user_ids)],
+         'created_at': started + timedelta(minutes=i)} for i in range(comments)])
+    # Older versions get a comment each, so the history has counts to show
+    docuvault.db.session.bulk_insert_mappings(docuvault.Comment, [
+        {'content': 'Eski yorum', 'file_id': version.id, 'user_id': user_ids[1]} for version in files[:-1]])
+    docuvault.db.session.commit()
+    return files[-1].id
+
+
+def count_queries(client, path):
+    del statements[:]
+    started = time.perf_counter()
+    response = client.get(path)
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise SystemExit(f'{path} answered {response.status_code}')
+    return len(statements), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', default='1,5,25')
+    parser.add_argument('--comments', default='0,10,100,1000')
+    args = parser.parse_args()
+
+    with docuvault.app.app_context():
+        docuvault.upgrade_schema()
+        department_id, user_ids = make_users()
+        cases = [(versions, comments, make_document(department_id, user_ids, versions, comments))
+                 for versions in (int(size) for size in args.versions.split(','))
+                 for comments in (int(size) for size in args.comments.split(','))]
+
+    client = docuvault.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_ids[0])
+        session['_fresh'] = True
+    # Warm the per-process caches (user, departments) so every measured request starts alike
+    client.get(f'/file/{cases[0][2]}')
+
+    print(f"{'versions':>9}{'comments':>10}{'detail queries':>16}{'detail ms':>11}"
+          f"{'history queries':>17}{'history ms':>12}")
+    counts = set()
+    for versions, comments, file_id in cases:
+        detail, detail_seconds = count_queries(client, f'/file/{file_id}')
+        history, history_seconds = count_queries(client, f'/file/{file_id}/versions')
+        counts.add((detail, history))
+        print(f'{versions:>9}{comments:>10}{detail:>16}{detail_seconds * 1000:>11.1f}'
+              f'{history:>17}{history_seconds * 1000:>12.1f}')
+    if len(counts) > 1:
+        print('query count depends on the number of versions or comments')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
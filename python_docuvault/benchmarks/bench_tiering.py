@@ -0,0 +1,132 @@
+"""Space saved and read latency added by the cold tier, per codec and file type.
+
+Builds sample files (or takes them from --source), archives each one with
+every available codec into a temporary tiering.ColdStore and reports:
+  * ratio       - compressed size / original size
+  * archive     - compression plus verification throughput
+  * hot read    - reading the plain file from the blob store
+  * cold read   - first read: restoring it into the hot cache, then reading
+  * cached read - later reads, served from the hot cache
+
+    python benchmarks/bench_tiering.py [--size-mb 4] [--source DIR] [--rounds 5]
+"""
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tiering  # noqa: E402
+
+WORDS = ('fatura sözleşme rapor toplam tutar müşteri tarih onay belge departman tedarikçi ödeme '
+         'vade kdv iskonto teslimat sipariş stok birim fiyat açıklama imza kaşe').split()
+
+
+def sample_text(size, rng):
+    lines = []
+    total = 0
+    while total < size:
+        line = f"{rng.randint(1, 9999):>5} {' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 12)))} " \
+               f"{rng.randint(1, 99999)},{rng.randint(0, 99):02d} TL\n"
+        lines.append(line)
+        total += len(line.encode())
+    return ''.join(lines).encode()[:size]
+
+
+def sample_pdf(size, rng):
+    # Text objects next to already-deflated streams (fonts, images), as in most PDFs
+    parts = [b'%PDF-1.7\n']
+    total = len(parts[0])
+    while total < size:
+        if rng.random() < 0.4:
+            body = zlib.compress(rng.randbytes(rng.randint(4000, 20000)))
+        else:
+            body = b'BT /F1 10 Tf ' + sample_text(rng.randint(2000, 8000), rng) + b' ET'
+        part = b'obj\n<< /Length %d >>\nstream\n' % len(body) + body + b'\nendstream\nendobj\n'
+        parts.append(part)
+        total += len(part)
+    return b''.join(parts)[:size]
+
+
+def samples(args, rng):
+    if args.source:
+        for name in sorted(os.listdir(args.source)):
+            path = os.path.join(args.source, name)
+            if os.path.isfile(path) and '.' in name:
+                with open(path, 'rb') as f:
+                    yield name, name.rsplit('.', 1)[1].lower(), f.read()
+        return
+    size = int(args.size_mb * 1024 * 1024)
+    yield 'sample.txt', 'txt', sample_text(size, rng)
+    yield 'sample.pdf', 'pdf', sample_pdf(size, rng)
+
+
+def read_all(path):
+    with open(path, 'rb') as f:
+        while f.read(1024 * 1024):
+            pass
+
+
+def best_of(rounds, action):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=4)
+    parser.add_argument('--source', help='Directory of real files to measure instead of generated ones.')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = ['xz'] + (['zst'] if tiering.zstandard is not None else [])
+    print(f"{'file':<24}{'codec':>6}{'MB':>7}{'ratio':>7}{'archive MB/s':>14}"
+          f"{'hot ms':>9}{'cold ms':>9}{'cached ms':>11}{'extra ms':>10}")
+    workdir = tempfile.mkdtemp(prefix='bench-tiering-')
+    try:
+        for name, file_type, body in samples(args, random.Random(42)):
+            digest = hashlib.sha256(body).hexdigest()
+            source = os.path.join(workdir, 'hot', digest)
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            with open(source, 'wb') as f:
+                f.write(body)
+            megabytes = len(body) / 1024 / 1024
+            hot = best_of(args.rounds, lambda: read_all(source))
+            chosen = tiering.codec_for(file_type)
+            for codec in codecs:
+                store = tiering.ColdStore(os.path.join(workdir, codec), os.path.join(workdir, codec + '-cache'),
+                                          cache_bytes=1 << 40)
+                started = time.perf_counter()
+                stored_size = store.archive(source, digest, codec, min_saving=0)
+                archive = time.perf_counter() - started
+
+                def cold_read():
+                    if os.path.exists(store.cache_path(digest)):
+                        os.remove(store.cache_path(digest))
+                    read_all(store.cached_path(digest))
+                cold = best_of(args.rounds, cold_read)
+                cached = best_of(args.rounds, lambda: read_all(store.cached_path(digest)))
+                label = f"{name}{' *' if codec == chosen else ''}"
+                print(f"{label[:23]:<24}{codec:>6}{megabytes:>7.1f}{stored_size / len(body):>7.2f}"
+                      f"{megabytes / archive:>14.1f}{hot * 1000:>9.2f}{cold * 1000:>9.2f}{cached * 1000:>11.2f}"
+                      f"{(cold - hot) * 1000:>10.2f}")
+            if chosen is None:
+                print(f"{name[:23]:<24}{'-':>6}  {file_type} is already compressed; it stays in the hot tier")
+        print("* codec that tiering.codec_for() picks for the type")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""Header checks and worker time for X-Accel-Redirect / X-Sendfile offload.
+
+Runs delivery.send_stored_file() from a bare Flask app (no database) behind
+a small WSGI stand-in for the front-end server that does what nginx does
+with X-Accel-Redirect (and mod_xsendfile with X-Sendfile):
+  * the redirect URI must fall under an `internal` location; it is
+    percent-decoded and mapped through the location's alias,
+  * the file is sent by the front end, which adds its own ETag and
+    Last-Modified and answers Range requests,
+  * Content-Type, Content-Disposition and Cache-Control of the upstream
+    response are kept,
+  * clients cannot request internal locations directly (404).
+The internal locations are parsed from Offload.nginx_config(), the text
+`flask docuvault offload-config` prints for the real deployment.
+
+    python benchmarks/check_offload.py [--size-mb 64]
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request  # noqa: E402
+from werkzeug.test import Client  # noqa: E402
+from werkzeug.wrappers import Request, Response  # noqa: E402
+
+import delivery  # noqa: E402
+
+# Headers nginx passes on from an X-Accel-Redirect response
+KEPT_HEADERS = ('Content-Type', 'Content-Disposition', 'Cache-Control', 'Expires', 'Set-Cookie')
+LOCATION_RE = re.compile(r'location\s+(\S+)\s*\{([^}]*)\}')
+
+
+def internal_locations(nginx_conf):
+    """{uri prefix: alias directory} of the internal locations in an nginx config"""
+    locations = {}
+    for prefix, body in LOCATION_RE.findall(nginx_conf):
+        alias = re.search(r'alias\s+([^;]+);', body)
+        if re.search(r'\binternal\s*;', body) and alias:
+            locations[prefix] = alias.group(1).strip()
+    return locations
+
+
+class FrontEnd:
+    """Serves X-Accel-Redirect / X-Sendfile responses of a WSGI app the way the front-end server would"""
+
+    def __init__(self, app, locations, sendfile_roots=()):
+        self.app = app
+        self.locations = locations
+        self.sendfile_roots = [os.path.abspath(root) + os.sep for root in sendfile_roots]
+        self.upstream_seconds = 0.0
+        self.upstream_body = b''
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if any(path.startswith(prefix) for prefix in self.locations):
+            return Response('internal location', status=404)(environ, start_response)
+        started = time.perf_counter()
+        upstream = Response.from_app(self.app, environ)
+        self.upstream_body = upstream.get_data()
+        self.upstream_seconds = time.perf_counter() - started
+        if 'X-Accel-Redirect' in upstream.headers:
+            file_path = self._alias(unquote(upstream.headers['X-Accel-Redirect']))
+        elif 'X-Sendfile' in upstream.headers:
+            file_path = self._sendfile_path(upstream.headers['X-Sendfile'])
+        else:
+            return upstream(environ, start_response)
+        if file_path is None or not os.path.isfile(file_path):
+            return Response('not found', status=404)(environ, start_response)
+        return self._static(Request(environ), file_path, upstream)(environ, start_response)
+
+    def _alias(self, uri):
+        for prefix, alias in sorted(self.locations.items(), key=lambda item: len(item[0]), reverse=True):
+            if uri.startswith(prefix):
+                path = os.path.normpath(os.path.join(alias, uri[len(prefix):]))
+                return path if path.startswith(os.path.normpath(alias) + os.sep) else None
+        return None
+
+    def _sendfile_path(self, path):
+        path = os.path.normpath(path)
+        return path if any(path.startswith(root) for root in self.sendfile_roots) else None
+
+    def _static(self, req, file_path, upstream):
+        data = read(file_path)
+        stat = os.stat(file_path)
+        response = Response(data, status=200)
+        for name in KEPT_HEADERS:
+            if name in upstream.headers:
+                response.headers[name] = upstream.headers[name]
+        if 'ETag' in upstream.headers:
+            response.headers['ETag'] = upstream.headers['ETag']
+        else:
+            response.headers['ETag'] = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+        response.last_modified = stat.st_mtime
+        response.headers['Accept-Ranges'] = 'bytes'
+        byte_range = req.range
+        if byte_range is not None and len(byte_range.ranges) == 1:
+            start, stop = byte_range.range_for_length(len(data)) or (0, len(data))
+            response.set_data(data[start:stop])
+            response.status_code = 206
+            response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(data)}'
+        return response
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def make_app(paths, offload):
+    app = Flask(__name__)
+
+    @app.route('/file/<name>')
+    def serve(name):
+        path, mimetype, download_name = paths[name]
+        return delivery.send_stored_file(request, path, mimetype, etag=name, disposition='inline',
+                                         download_name=download_name, offload=offload)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        uploads = os.path.join(workdir, 'uploads')
+        renditions = os.path.join(uploads, '.renditions')
+        outside = os.path.join(workdir, 'elsewhere')
+        digest = 'ab' * 32
+        files = {
+            'blob': (os.path.join(uploads, digest[:2], digest[2:4], digest), 'video/mp4', 'Toplantı kaydı.mp4'),
+            'legacy': (os.path.join(uploads, 'DOF Rapor (1).pdf'), 'application/pdf', 'DOF Rapor (1).pdf'),
+            'rendition': (os.path.join(renditions, 'ab', f'{digest}-md.jpg'), 'image/jpeg', 'thumb.jpg'),
+            'outside': (os.path.join(outside, 'notes.txt'), 'text/plain', 'notes.txt'),
+        }
+        for path, _, _ in files.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(4096))
+        block = os.urandom(1024 * 1024)
+        with open(files['blob'][0], 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(block)
+
+        roots = {uploads: '/_protected/uploads/', renditions: '/_protected/renditions/'}
+        nginx = delivery.Offload('nginx', roots)
+        locations = internal_locations(nginx.nginx_config())
+
+        results = []
+
+        def check(name, passed):
+            results.append((name, passed))
+
+        # nginx: X-Accel-Redirect
+        front = FrontEnd(make_app(files, nginx), locations)
+        client = Client(front)
+        response = client.get('/file/blob')
+        check('nginx: 200 from front end', response.status_code == 200)
+        check('nginx: empty upstream body', front.upstream_body == b'')
+        check('nginx: body is the stored file', response.get_data() == read(files['blob'][0]))
+        check('nginx: Content-Type from the application', response.headers['Content-Type'] == 'video/mp4')
+        check('nginx: UTF-8 Content-Disposition',
+              "filename*=UTF-8''Toplant%C4%B1%20kayd%C4%B1.mp4" in response.headers.get('Content-Disposition', ''))
+        check('nginx: Cache-Control kept', response.headers.get('Cache-Control') == 'private, no-cache')
+        offloaded_seconds = front.upstream_seconds
+        response = client.get('/file/blob', headers={'Range': 'bytes=100-199'})
+        check('nginx: ranges answered by front end', response.status_code == 206 and len(response.get_data()) == 100)
+        response = client.get('/file/legacy')
+        check('nginx: escaped legacy name', response.status_code == 200 and
+              response.get_data() == read(files['legacy'][0]))
+        response = client.get('/file/rendition')
+        check('nginx: nested location', response.status_code == 200 and
+              nginx.header(files['rendition'][0])[1].startswith('/_protected/renditions/'))
+        response = client.get('/file/outside')
+        check('nginx: unmapped path falls back to Python',
+              response.status_code == 200 and 'X-Accel-Redirect' not in response.headers and
+              response.get_data() == read(files['outside'][0]))
+        response = client.get('/_protected/uploads/' + 'DOF%20Rapor%20(1).pdf')
+        check('nginx: internal location hidden from clients', response.status_code == 404)
+
+        # Apache mod_xsendfile / lighttpd: X-Sendfile
+        front = FrontEnd(make_app(files, delivery.Offload('sendfile', roots)), {}, sendfile_roots=[uploads])
+        client = Client(front)
+        response = client.get('/file/blob')
+        check('sendfile: 200 from front end', response.status_code == 200 and front.upstream_body == b'')
+        check('sendfile: ETag from the application', response.headers.get('ETag') == '"blob"')
+
+        # No offload: Python sends the body
+        front = FrontEnd(make_app(files, delivery.Offload('none')), locations)
+        client = Client(front)
+        response = client.get('/file/blob')
+        check('none: Python sends the body', response.status_code == 200 and
+              len(front.upstream_body) == args.size_mb * 1024 * 1024)
+        python_seconds = front.upstream_seconds
+
+        width = max(len(name) for name, _ in results)
+        for name, passed in results:
+            print(f"{name:<{width}}  {'ok' if passed else 'FAIL'}")
+        print(f'\nworker time for a {args.size_mb} MB file: python {python_seconds * 1000:.1f} ms, '
+              f'offloaded {offloaded_seconds * 1000:.2f} ms')
+        if not all(passed for _, passed in results):
+            sys.exit(1)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
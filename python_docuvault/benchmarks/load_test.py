@@ -0,0 +1,346 @@
+"""Concurrent load test of the main routes: latency percentiles, throughput and SQL queries per request.
+
+Fill a database first with `flask --app app docuvault generate-data` (see
+synthetic.py); the clients log in as its users. Without --url the app runs
+in this process (DATABASE_URL as usual) and every client is a Flask test
+client on its own thread; with --url they are HTTP clients of a running
+server. Each client logs in, then loops over a weighted mix of routes until
+--duration is over: admins browse the admin dashboard with filters, files,
+version histories and previews; department users their dashboard, their
+files, previews, revisions and new uploads. Query counts come from the
+server's /metrics (docuvault_request_queries), read before and after the
+run; with several gunicorn workers the server needs METRICS_DIR.
+
+Results are compared with a stored baseline: a route regresses when its p95
+grows by more than --tolerance, when it runs more queries per request or
+when it answered errors. --save-baseline records this run as the baseline
+instead. Timings depend on the machine, so record the baseline where the
+comparison runs.
+
+    python benchmarks/load_test.py [--url http://localhost:5000] [--clients 16] [--admin-clients 4]
+        [--duration 60] [--users 200] [--baseline benchmarks/baseline.json] [--save-baseline]
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# p95 changes smaller than this are noise, whatever the tolerance says
+NOISE_MS = 2.0
+UPLOAD_SIZE = 64 * 1024
+# Previews ask for the first bytes only, like a browser's PDF viewer or video player does
+PREVIEW_RANGE = 'bytes=0-65535'
+STATUSES = ('', 'pending', 'approved', 'rejected')
+TYPES = ('', 'pdf', 'docx', 'xlsx', 'jpg')
+QUERY_METRIC = re.compile(r'^docuvault_request_queries_(sum|count)\{endpoint="([^"]+)"\} (\S+)$', re.M)
+
+
+class HttpClient:
+    """A browser-like HTTP client of a running server: keeps cookies, does not follow redirects"""
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, req, fp, code, msg, headers, newurl):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self.NoRedirect)
+
+    def request(self, method, path, form=None, upload=None, headers=None):
+        """(status, body) of a request; upload is (field, filename, bytes) and makes it multipart"""
+        headers = dict(headers or {})
+        data = None
+        if upload is not None:
+            boundary = uuid.uuid4().hex
+            data = encode_multipart(boundary, form or {}, upload)
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class AppClient:
+    """The same interface on a Flask test client of the app in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, upload=None, headers=None):
+        data = dict(form or {})
+        if upload is not None:
+            field, filename, content = upload
+            data[field] = (io.BytesIO(content), filename)
+        response = self.client.open(path, method=method, data=data or None, headers=headers,
+                                    content_type='multipart/form-data' if upload is not None else None)
+        return response.status_code, response.get_data()
+
+
+def encode_multipart(boundary, form, upload):
+    field, filename, content = upload
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in form.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts)
+
+
+def percentile(values, p):
+    """p-th percentile of sorted values, interpolated"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * p / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+class Session:
+    """One simulated user: logs in, learns which files it sees, then requests routes at random"""
+
+    def __init__(self, client, username, password, admin, recorder, rng):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.admin = admin
+        self.recorder = recorder
+        self.rng = rng
+        self.file_ids = []
+        self.department_ids = []
+
+    def call(self, route, method, path, expect=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            status, body = self.client.request(method, path, **kwargs)
+        except Exception:
+            status, body = None, b''
+        self.recorder.add(route, time.perf_counter() - started, status in expect)
+        return status, body
+
+    def login(self):
+        status, _ = self.call('login', 'POST', '/login', expect=(302,),
+                              form={'username': self.username, 'password': self.password})
+        if status != 302:
+            return False
+        _, body = self.client.request('GET', '/api/v1/files?fields=id&per_page=200')
+        self.file_ids = [item['id'] for item in json.loads(body)['items']]
+        if self.admin:
+            _, body = self.client.request('GET', '/api/v1/departments?fields=id')
+            self.department_ids = [item['id'] for item in json.loads(body)['items']]
+        return True
+
+    def admin_dashboard(self):
+        filters = {'status': self.rng.choice(STATUSES), 'type': self.rng.choice(TYPES)}
+        if self.department_ids and self.rng.random() < 0.5:
+            filters['department'] = self.rng.choice(self.department_ids)
+        query = urllib.parse.urlencode({name: value for name, value in filters.items() if value})
+        self.call('admin_dashboard', 'GET', '/admin/dashboard' + ('?' + query if query else ''))
+
+    def department_dashboard(self):
+        self.call('department_dashboard', 'GET', '/department/dashboard')
+
+    def view_file(self):
+        self.call('view_file', 'GET', f'/file/{self.rng.choice(self.file_ids)}')
+
+    def file_versions(self):
+        self.call('file_versions', 'GET', f'/file/{self.rng.choice(self.file_ids)}/versions')
+
+    def preview_file(self):
+        self.call('preview_file', 'GET', f'/file/{self.rng.choice(self.file_ids)}/preview', expect=(200, 206),
+                  headers={'Range': PREVIEW_RANGE})
+
+    def upload_file(self):
+        self.call('upload_file', 'POST', '/upload', expect=(302,),
+                  form={'title': 'Yük testi', 'description': 'load_test.py', 'category': 'Rapor'},
+                  upload=('file', 'yuk_testi.pdf', b'%PDF-1.4\n' + os.urandom(UPLOAD_SIZE)))
+
+    def revise_file(self):
+        self.call('revise_file', 'POST', f'/file/{self.rng.choice(self.file_ids)}/revise', expect=(302,),
+                  form={'title': 'Yük testi revizyonu', 'description': 'load_test.py', 'category': 'Rapor',
+                        'revision_notes': 'Otomatik revizyon'},
+                  upload=('file', 'yuk_testi.pdf', b'%PDF-1.4\n' + os.urandom(UPLOAD_SIZE)))
+
+    def mix(self):
+        """(action, weight) pairs this user chooses from"""
+        if self.admin:
+            actions = [(self.admin_dashboard, 35)]
+        else:
+            actions = [(self.department_dashboard, 30), (self.upload_file, 4)]
+        if self.file_ids:
+            actions += [(self.view_file, 30), (self.file_versions, 15), (self.preview_file, 15)]
+            if not self.admin:
+                actions.append((self.revise_file, 4))
+        return actions
+
+    def run(self, deadline):
+        if not self.login():
+            return
+        actions, weights = zip(*self.mix())
+        while time.monotonic() < deadline:
+            self.rng.choices(actions, weights)[0]()
+
+
+def query_counts(client, token):
+    """{endpoint: (sum, count)} of docuvault_request_queries on the server"""
+    headers = {'Authorization': f'Bearer {token}'} if token else None
+    status, body = client.request('GET', '/metrics', headers=headers)
+    if status != 200:
+        raise SystemExit(f'/metrics answered {status}; log in an admin or pass --metrics-token')
+    counts = {}
+    for kind, endpoint, value in QUERY_METRIC.findall(body.decode()):
+        total, count = counts.get(endpoint, (0.0, 0))
+        counts[endpoint] = (total + float(value), count) if kind == 'sum' else (total, count + int(float(value)))
+    return counts
+
+
+def summarise(recorder, before, after, elapsed):
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        total, count = (a - b for a, b in zip(after.get(route, (0, 0)), before.get(route, (0, 0))))
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': recorder.errors.get(route, 0),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'rps': round(len(latencies) / elapsed, 2),
+            'queries': round(total / count, 2) if count else None,
+        }
+    return routes
+
+
+def regressions(routes, baseline, tolerance):
+    """(route, reason) for every route doing worse than in baseline"""
+    found = []
+    for route, result in routes.items():
+        if result['errors']:
+            found.append((route, f"{result['errors']} errors"))
+        base = baseline.get(route)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance) and result['p95_ms'] - base['p95_ms'] > NOISE_MS:
+            found.append((route, f"p95 {base['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms"))
+        if result['queries'] is not None and base.get('queries') is not None and \
+                result['queries'] > base['queries'] + 0.5:
+            found.append((route, f"queries/request {base['queries']:.1f} -> {result['queries']:.1f}"))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='Server to test; default: the app in this process')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--admin-clients', type=int, default=4, help='How many of the clients are admins')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of load')
+    parser.add_argument('--users', type=int, default=200,
+                        help='Department clients log in as one of the first USERS synthetic users')
+    parser.add_argument('--password', required=True, help='The --password the data was generated with')
+    parser.add_argument('--metrics-token', default=os.environ.get('METRICS_TOKEN'))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Record this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        os.chdir(APP_DIR)  # the upload folder is relative to the app
+        from app import app
+        make_client = lambda: AppClient(app)
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    sessions = []
+    for i in range(args.clients):
+        admin = i < args.admin_clients
+        username = f'synthetic-admin-{i % 5 + 1}' if admin else f'synthetic-user-{rng.randint(1, args.users):05d}'
+        sessions.append(Session(make_client(), username, args.password, admin, recorder,
+                                random.Random(rng.random())))
+
+    observer = make_client()
+    if not args.metrics_token:
+        observer.request('POST', '/login', form={'username': 'synthetic-admin-1', 'password': args.password})
+    before = query_counts(observer, args.metrics_token)
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=session.run, args=(deadline,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    after = query_counts(observer, args.metrics_token)
+    routes = summarise(recorder, before, after, elapsed)
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)['routes']
+    total = sum(result['requests'] for result in routes.values())
+    print(f'{args.clients} clients, {elapsed:.1f} s, {total} requests, {total / elapsed:.1f} req/s'
+          f" ({args.url or 'in-process'})")
+    print(f"{'route':<22}{'requests':>9}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}"
+          f"{'queries':>9}{'base p95':>10}{'base q':>8}")
+    for route, result in routes.items():
+        base = baseline.get(route, {})
+        queries = '-' if result['queries'] is None else f"{result['queries']:.1f}"
+        base_p95 = f"{base['p95_ms']:.1f}" if 'p95_ms' in base else '-'
+        base_queries = f"{base['queries']:.1f}" if base.get('queries') is not None else '-'
+        print(f"{route:<22}{result['requests']:>9}{result['errors']:>7}{result['p50_ms']:>9.1f}"
+              f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['rps']:>8.1f}{queries:>9}"
+              f"{base_p95:>10}{base_queries:>8}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as handle:
+            json.dump({'recorded_at': datetime.utcnow().isoformat(timespec='seconds'),
+                       'target': args.url or 'in-process', 'clients': args.clients, 'duration': args.duration,
+                       'routes': routes}, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+        print(f'baseline saved to {args.baseline}')
+        return
+    found = regressions(routes, baseline, args.tolerance)
+    for route, reason in found:
+        print(f'REGRESSION {route}: {reason}')
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Content-addressed storage for uploaded file bodies.
+
+Every body is stored once under its SHA-256: <root>/ab/cd/abcd1234...
+The digest is computed while the bytes are written to a temporary file in
+<root>/.tmp, which is then renamed into place. If a blob with the same digest
+already exists the temporary copy is simply discarded. Reference counting
+lives in the database (the Blob model); this module only deals with bytes.
+
+DiskLRU bounds the directories of derived copies kept next to the store
+(renditions, blobs restored from the cold tier) by their total size.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+CHUNK_SIZE = 1024 * 1024
+# Leading bytes kept while writing, for content sniffing
+HEAD_SIZE = 64
+# A DiskLRU hit refreshes the file's LRU position at most this often (saves a metadata write per hit)
+TOUCH_INTERVAL = 3600
+
+
+def remove_with_empty_parents(path, levels):
+    """Remove a file and up to levels of parent directories it leaves empty; False if it was missing"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    directory = os.path.dirname(path)
+    for _ in range(levels):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+    return True
+
+
+def iter_fanout(root):
+    """(prefix, name) of every file in the <root>/ab/cd/ fan-out directories; prefix is 'abcd'"""
+    for first in sorted(os.listdir(root)):
+        first_dir = os.path.join(root, first)
+        if len(first) != 2 or not os.path.isdir(first_dir):
+            continue
+        for second in sorted(os.listdir(first_dir)):
+            second_dir = os.path.join(first_dir, second)
+            if len(second) != 2 or not os.path.isdir(second_dir):
+                continue
+            for name in os.listdir(second_dir):
+                yield first + second, name
+
+
+class BlobWriter:
+    """Write a blob in chunks, hashing, counting and keeping the first bytes as it goes.
+
+    Use as a context manager; call commit() to move the bytes into the store.
+    Leaving the block (or close()) without commit() removes the temporary file.
+    The writer also serves as the stream of a Werkzeug FileStorage, which is
+    how multipart uploads are streamed straight into the store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.digest = None
+        self.created = False
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir, prefix='blob-')
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        if len(self.head) < HEAD_SIZE:
+            self.head += bytes(chunk[:HEAD_SIZE - len(self.head)])
+        self.hash.update(chunk)
+        self.size += len(chunk)
+        self.file.write(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=0):
+        # The multipart parser rewinds finished parts; bytes are only ever appended
+        self.file.flush()
+        return self.size
+
+    def tell(self):
+        return self.size
+
+    def close(self):
+        if self.temp_path:
+            self.abort()
+
+    @property
+    def committed(self):
+        return self.digest is not None
+
+    def commit(self):
+        """Finish the blob. Returns (digest, size, created)."""
+        self.file.close()
+        self.digest = self.hash.hexdigest()
+        self.created = self.store.adopt_temp(self.temp_path, self.digest)
+        self.temp_path = None
+        return self.digest, self.size, self.created
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.temp_path:
+            self.abort()
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+        self.temp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def writer(self):
+        return BlobWriter(self)
+
+    def ingest(self, stream, chunk_size=CHUNK_SIZE):
+        """Copy a readable stream into the store. Returns (digest, size, created)."""
+        with self.writer() as writer:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            return writer.commit()
+
+    def adopt_temp(self, temp_path, digest):
+        """Move a fully written temporary file into place under its digest.
+
+        Returns True if the blob is new, False if identical content was already
+        stored (the temporary file is then deleted).
+        """
+        final_path = self.path(digest)
+        if os.path.exists(final_path):
+            os.remove(temp_path)
+            return False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, final_path)
+        return True
+
+    def adopt(self, path, chunk_size=CHUNK_SIZE):
+        """Move an existing file into the store in place (rename, no copy).
+
+        Returns (digest, size, created). When the content is already stored the
+        original file is removed, so the caller can count its size as saved.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+        digest = digest.hexdigest()
+        final_path = self.path(digest)
+        if os.path.exists(final_path):
+            os.remove(path)
+            return digest, size, False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(path, final_path)
+        return digest, size, True
+
+    def delete(self, digest):
+        """Remove a blob and any fan-out directories it leaves empty"""
+        return remove_with_empty_parents(self.path(digest), 2)
+
+    def iter_digests(self):
+        """Every digest present on disk"""
+        for prefix, name in iter_fanout(self.root):
+            if len(name) == 64 and name.startswith(prefix):
+                yield name
+
+
+class DiskLRU:
+    """Files in <root>/ab/..., bounded in bytes; the least recently used are removed first.
+
+    The LRU position of a file is its mtime, refreshed by touch(). Several
+    processes may share the directory, so the total size is re-read from
+    disk whenever it may have crossed max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, suffix=''):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.evicted = 0
+
+    def touch(self, path):
+        """True if path is in the cache, refreshing its LRU position"""
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            os.utime(path, (now, now))
+        return True
+
+    def added(self, path, size):
+        """Account for a file just moved into the cache.
+
+        Past max_bytes the least recently used files are removed until the
+        cache is under 90% of it; path (about to be served) is never removed.
+        """
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += size
+                if self.total_bytes <= self.max_bytes:
+                    return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        if total > self.max_bytes:
+            for _, size, entry_path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                if entry_path == path:
+                    continue
+                try:
+                    os.remove(entry_path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+        with self.lock:
+            self.total_bytes = total
+            self.evicted += evicted
+
+    def _entries(self):
+        for first in os.scandir(self.root):
+            if len(first.name) != 2 or not first.is_dir():
+                continue
+            for entry in os.scandir(first.path):
+                if entry.name.endswith(self.suffix):
+                    stat = entry.stat()
+                    yield stat.st_mtime, stat.st_size, entry.path
@@ -0,0 +1,217 @@
+"""Cache of query results and rendered fragments, invalidated by writes.
+
+A value is cached under a name, a key and a set of tags ('files',
+'files:user:7', ...). Invalidating a tag bumps its generation; the
+generations of a value's tags are part of where it is stored, so one bump
+orphans every entry of the tag at once and the LRU ages them out - there
+is no index of keys per tag to maintain. Writers invalidate after their
+transaction commits (see invalidate_cache in app.py); every entry also
+expires after ttl seconds.
+
+Values are pickled into an in-process LRU bounded by bytes, so its memory
+use is known and a cached object is never shared between requests. Tag
+generations come from a backend:
+  * LocalBackend: this process only (one worker, development),
+  * DatabaseBackend: rows in a table, re-read at most every interval
+    seconds per tag; every worker sees an invalidation within interval,
+  * RedisBackend: Redis counters (optional redis package), read on every
+    lookup; values are kept in Redis as well, so workers share them.
+"""
+import collections
+import hashlib
+import logging
+import pickle
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('none', 'local', 'database', 'redis')
+# Bookkeeping bytes of an LRU entry, on top of its key and pickled value
+ENTRY_OVERHEAD = 100
+
+
+class LRU:
+    """Pickled values by key, least recently used evicted first once max_bytes is exceeded"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # key -> (expires, data)
+        self.size = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, data, ttl):
+        cost = len(key) + len(data) + ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, data)
+            self.size += cost
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evicted += 1
+
+    def _remove(self, key):
+        _, data = self.entries.pop(key)
+        self.size -= len(key) + len(data) + ENTRY_OVERHEAD
+
+
+class LocalBackend:
+    """Generations of this process only"""
+
+    def __init__(self):
+        self.generations = collections.Counter()
+
+    def generations_of(self, tags):
+        return [self.generations[tag] for tag in tags]
+
+    def bump(self, tags):
+        for tag in tags:
+            self.generations[tag] += 1
+
+    def load(self, key):
+        return None
+
+    def store(self, key, data, ttl):
+        pass
+
+
+class DatabaseBackend:
+    """Generations stored as rows.
+
+    The app gives fetch(tags) ({tag: generation}, missing tags are 0) and
+    bump(tags). Generations read from the table are trusted for interval
+    seconds; this process's own bumps are seen at once.
+    """
+
+    def __init__(self, fetch, bump, interval=1.0):
+        self.fetch = fetch
+        self._bump = bump
+        self.interval = interval
+        self.known = {}  # tag -> (generation, read at)
+        self.lock = threading.Lock()
+
+    def generations_of(self, tags):
+        now = time.monotonic()
+        with self.lock:
+            stale = [tag for tag in tags if tag not in self.known or self.known[tag][1] + self.interval <= now]
+        if stale:
+            fetched = self.fetch(stale)
+            with self.lock:
+                for tag in stale:
+                    self.known[tag] = (fetched.get(tag, 0), now)
+        with self.lock:
+            return [self.known[tag][0] if tag in self.known else 0 for tag in tags]
+
+    def bump(self, tags):
+        self._bump(tags)
+        with self.lock:
+            for tag in tags:
+                self.known.pop(tag, None)
+
+    def load(self, key):
+        return None
+
+    def store(self, key, data, ttl):
+        pass
+
+
+class RedisBackend:
+    """Generations and values in Redis, shared by every worker"""
+
+    def __init__(self, url, prefix='docuvault:cache:'):
+        import redis  # optional: only this backend needs it
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def generations_of(self, tags):
+        return [int(value or 0) for value in self.client.mget([self.prefix + 'gen:' + tag for tag in tags])]
+
+    def bump(self, tags):
+        pipeline = self.client.pipeline(transaction=False)
+        for tag in tags:
+            pipeline.incr(self.prefix + 'gen:' + tag)
+        pipeline.execute()
+
+    def load(self, key):
+        return self.client.get(self.prefix + 'val:' + key)
+
+    def store(self, key, data, ttl):
+        self.client.setex(self.prefix + 'val:' + key, max(1, int(ttl)), data)
+
+
+class Cache:
+    """Values computed on a miss and kept until a tag of theirs is invalidated or ttl passes.
+
+    With backend None nothing is cached and get() always computes.
+    """
+
+    def __init__(self, backend, max_bytes=64 * 1024 * 1024, ttl=300):
+        self.backend = backend
+        self.lru = LRU(max_bytes)
+        self.ttl = ttl
+        self.counters = collections.Counter()  # (name, event) -> count
+        self.invalidations = 0
+
+    def get(self, name, key, tags, compute, ttl=None):
+        """The cached value of name/key, or compute() stored under tags"""
+        if self.backend is None:
+            return compute()
+        tags = sorted(set(tags))
+        try:
+            generations = self.backend.generations_of(tags)
+        except Exception:
+            logger.exception('reading cache generations failed, computing %s uncached', name)
+            self.counters[name, 'errors'] += 1
+            return compute()
+        versioned = repr((key, list(zip(tags, generations))))
+        storage_key = f'{name}:{hashlib.sha1(versioned.encode("utf-8")).hexdigest()}'
+        ttl = ttl or self.ttl
+        data = self.lru.get(storage_key)
+        if data is not None:
+            self.counters[name, 'hits'] += 1
+            return pickle.loads(data)
+        try:
+            data = self.backend.load(storage_key)
+        except Exception:
+            logger.exception('reading the shared cache failed')
+            data = None
+        if data is not None:
+            self.counters[name, 'shared_hits'] += 1
+            self.lru.set(storage_key, data, ttl)
+            return pickle.loads(data)
+        self.counters[name, 'misses'] += 1
+        value = compute()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self.lru.set(storage_key, data, ttl)
+        try:
+            self.backend.store(storage_key, data, ttl)
+        except Exception:
+            logger.exception('writing the shared cache failed')
+        return value
+
+    def invalidate(self, tags):
+        """Orphan every value stored under any of tags"""
+        if self.backend is None or not tags:
+            return
+        self.invalidations += len(tags)
+        self.backend.bump(sorted(set(tags)))
+
+    def stats(self):
+        with self.lru.lock:
+            return {'events': dict(self.counters), 'entries': len(self.lru.entries), 'bytes': self.lru.size,
+                    'evicted': self.lru.evicted, 'invalidations': self.invalidations}
@@ -0,0 +1,155 @@
+"""Database engine configuration and the SQLite -> PostgreSQL copy tool.
+
+The database URL comes from DATABASE_URL (default: the SQLite file in the
+instance folder). PostgreSQL gets a sized connection pool with pre-ping and
+recycling; SQLite connections are tuned with pragmas on connect (WAL, so
+readers never block the writer, synchronous=NORMAL, a busy timeout instead
+of failing with "database is locked", and memory-mapped reads).
+"""
+import os
+import sqlite3
+import time
+
+from sqlalchemy import bindparam, create_engine, event, func, inspect, select, text
+from sqlalchemy.engine import Engine
+
+DEFAULT_URL = 'sqlite:///docuvault.db'
+COPY_BATCH_SIZE = 1000
+
+
+def database_url(environ=os.environ):
+    """The configured database URL.
+
+    Hosted providers hand out postgres:// URLs; those and driverless
+    postgresql:// URLs are pinned to psycopg2, the driver in requirements.txt.
+    """
+    url = environ.get('DATABASE_URL') or DEFAULT_URL
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            url = 'postgresql+psycopg2://' + url[len(scheme):]
+    return url
+
+
+def engine_options(url, environ=os.environ):
+    """create_engine() keyword arguments for the given database URL"""
+    if url.startswith('postgresql'):
+        return {
+            'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+            # Drop connections the server or a proxy closed while they sat in the pool
+            'pool_pre_ping': True,
+            'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        }
+    return {}
+
+
+def sqlite_pragmas(environ=os.environ):
+    """Connect-time pragmas for SQLite; WAL persists in the file, the rest are per connection"""
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(environ.get('SQLITE_BUSY_TIMEOUT', 15000)),
+        'mmap_size': int(environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    }
+
+
+def install_sqlite_pragmas(pragmas):
+    """Apply pragmas to every new SQLite connection of any engine"""
+    @event.listens_for(Engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def _deferred_columns(table):
+    """Columns whose foreign keys close a cycle (use_alter); filled in after all rows exist"""
+    return [fk.parent.name for fk in table.foreign_keys if fk.use_alter or fk.constraint.use_alter]
+
+
+def copy_database(source_url, target_url, metadata, batch_size=COPY_BATCH_SIZE, log=print):
+    """Copy every table of metadata from one database into another, in batches.
+
+    Tables are created in the target if missing and must be empty. Rows are
+    read in primary-key order and written with executemany, one transaction
+    per batch. Only columns present in both databases are copied. Returns
+    {table name: rows copied}.
+    """
+    source = create_engine(source_url)
+    target = create_engine(target_url, **engine_options(target_url))
+    metadata.create_all(target)
+
+    with target.connect() as connection:
+        for table in metadata.sorted_tables:
+            if connection.execute(select(func.count()).select_from(table)).scalar():
+                raise ValueError(f'target table {table.name} is not empty')
+
+    source_tables = set(inspect(source).get_table_names())
+    copied = {}
+    postponed = []
+    for table in metadata.sorted_tables:
+        if table.name not in source_tables:
+            continue
+        source_columns = {column['name'] for column in inspect(source).get_columns(table.name)}
+        columns = [column for column in table.columns if column.name in source_columns]
+        deferred = [name for name in _deferred_columns(table) if name in source_columns]
+        primary_key = table.primary_key.columns.values()[0]
+        started = time.monotonic()
+        count = 0
+        last_key = None
+        cyclic = []
+        while True:
+            query = select(*columns).order_by(primary_key).limit(batch_size)
+            if last_key is not None:
+                query = query.where(primary_key > last_key)
+            with source.connect() as connection:
+                rows = [dict(row._mapping) for row in connection.execute(query)]
+            if not rows:
+                break
+            for row in rows:
+                if any(row.get(name) is not None for name in deferred):
+                    cyclic.append({'b_key': row[primary_key.name],
+                                   **{f'b_{name}': row[name] for name in deferred}})
+                    for name in deferred:
+                        row[name] = None
+            with target.begin() as connection:
+                connection.execute(table.insert(), rows)
+            count += len(rows)
+            last_key = rows[-1][primary_key.name]
+        copied[table.name] = count
+        log(f'  {table.name}: {count} rows ({count / max(time.monotonic() - started, 1e-6):.0f} rows/s)')
+        if cyclic:
+            postponed.append((table, primary_key, deferred, cyclic))
+
+    # Second pass for the cyclic references, now that both sides exist
+    for table, primary_key, deferred, values in postponed:
+        statement = table.update().where(primary_key == bindparam('b_key')).values(
+            **{name: bindparam(f'b_{name}') for name in deferred})
+        with target.begin() as connection:
+            for start in range(0, len(values), batch_size):
+                connection.execute(statement, values[start:start + batch_size])
+
+    if target.dialect.name == 'postgresql':
+        _reset_sequences(target, metadata)
+    source.dispose()
+    target.dispose()
+    return copied
+
+
+def _reset_sequences(engine, metadata):
+    """Move serial sequences past the copied ids so new rows do not collide"""
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            primary_key = table.primary_key.columns.values()
+            if len(primary_key) != 1 or not primary_key[0].autoincrement or \
+                    primary_key[0].type.python_type is not int:
+                continue
+            column = primary_key[0].name
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', '{column}'), "
+                f"COALESCE((SELECT MAX(\"{column}\") FROM \"{table.name}\"), 0) + 1, false)"
+            ))
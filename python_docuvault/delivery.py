@@ -0,0 +1,251 @@
+"""Conditional and ranged delivery of stored file bodies.
+
+send_stored_file() answers a GET for a file on disk with:
+  * strong ETag / Last-Modified validators and 304 responses for
+    If-None-Match / If-Modified-Since,
+  * single byte ranges (206 with Content-Range) and multiple ranges
+    (206 multipart/byteranges), honouring If-Range, with 416 for
+    unsatisfiable ranges,
+  * the WSGI server's file wrapper for the body (gunicorn turns that into
+    sendfile, ranges included), otherwise large buffered reads.
+
+With an Offload the application only decides who may read which file: the
+response carries X-Accel-Redirect (nginx) or X-Sendfile (Apache
+mod_xsendfile, lighttpd) instead of a body, and the front-end server sends
+the bytes, validators and ranges itself. Content-Type, Content-Disposition
+and Cache-Control still come from the application, since the stored paths
+(blob digests) carry no extension or original name.
+"""
+import os
+import unicodedata
+import uuid
+from datetime import timezone
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.http import dump_options_header, http_date, quote_etag
+from werkzeug.wsgi import wrap_file
+
+BUFFER_SIZE = 256 * 1024
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 32
+OFFLOAD_MODES = ('none', 'nginx', 'sendfile')
+
+
+class Offload:
+    """Hands file bodies to the front-end web server.
+
+    locations maps directories to the internal URI prefixes nginx aliases
+    them under; X-Sendfile uses absolute paths and only needs the
+    directories (the server's XSendFilePath). A path outside every
+    location is sent by Python.
+    """
+
+    def __init__(self, mode='none', locations=None):
+        if mode not in OFFLOAD_MODES:
+            raise ValueError(f'unknown offload mode {mode!r}, expected one of {", ".join(OFFLOAD_MODES)}')
+        self.mode = mode
+        # Deepest directory first, so nested folders get their own location
+        self.locations = sorted(
+            ((os.path.abspath(root), '/' + prefix.strip('/') + '/') for root, prefix in (locations or {}).items()),
+            key=lambda location: len(location[0]), reverse=True)
+
+    def __bool__(self):
+        return self.mode != 'none'
+
+    def header(self, path):
+        """(header name, value) that hands path to the front-end server, or None"""
+        if self.mode == 'none':
+            return None
+        path = os.path.abspath(path)
+        for root, prefix in self.locations:
+            if path.startswith(root + os.sep):
+                if self.mode == 'sendfile':
+                    return 'X-Sendfile', path
+                relative = path[len(root) + 1:].replace(os.sep, '/')
+                return 'X-Accel-Redirect', prefix + quote(relative)
+        return None
+
+    def nginx_config(self):
+        """location blocks matching these internal prefixes"""
+        return '\n'.join(
+            f'location {prefix} {{\n    internal;\n    alias {root}/;\n}}'
+            for root, prefix in self.locations)
+
+
+def content_disposition(kind, filename):
+    """Content-Disposition value that survives non-ASCII (Turkish) file names"""
+    try:
+        filename.encode('ascii')
+        options = {'filename': filename}
+    except UnicodeEncodeError:
+        ascii_name = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        options = {'filename': ascii_name, 'filename*': "UTF-8''" + quote(filename, safe="!#$&+-.^_`|~")}
+    return dump_options_header(kind, options)
+
+
+def _read_range(path, start, length, buffer_size):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining:
+            data = f.read(min(buffer_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _file_body(request, path, start, length, size, buffer_size):
+    """Body iterable for [start, start + length); sendfile-able when the server supports it"""
+    whole_file = start == 0 and length == size
+    # gunicorn's sendfile starts at the current offset and stops at Content-Length;
+    # other servers' wrappers may send to EOF, so partial bodies are read by hand there
+    if whole_file or request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        f = open(path, 'rb')
+        f.seek(start)
+        return wrap_file(request.environ, f, buffer_size)
+    return _read_range(path, start, length, buffer_size)
+
+
+def _satisfiable_ranges(byte_range, size):
+    """Normalise a parsed Range header into sorted, merged (start, stop) pairs"""
+    ranges = []
+    for begin, end in byte_range.ranges:
+        if begin < 0:
+            start, stop = max(size + begin, 0), size
+        else:
+            start, stop = begin, min(end if end is not None else size, size)
+        if start < stop:
+            ranges.append((start, stop))
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _range_applies(request, etag, last_modified):
+    """If-Range: only serve the range when the client's copy is still current"""
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    return last_modified is not None and if_range.date >= last_modified
+
+
+def send_stored_file(request, path, mimetype, etag, last_modified=None,
+                     disposition=None, download_name=None, max_age=0, immutable=False,
+                     public=False, offload=None, buffer_size=BUFFER_SIZE):
+    """Build the response for a stored file, honouring validators and Range.
+
+    etag must identify the exact bytes (a content hash, or a version key);
+    it is sent as a strong validator. last_modified is a naive UTC datetime.
+    immutable is for URLs that change whenever the content does; public
+    lets shared caches (a reverse proxy) keep the response for max_age.
+    """
+    mimetype = mimetype or 'application/octet-stream'
+    handoff = offload.header(path) if offload else None
+    if handoff is not None:
+        return _offloaded(handoff, mimetype, etag, max_age, immutable, public, disposition,
+                          download_name or os.path.basename(path))
+
+    size = os.path.getsize(path)
+    if last_modified is not None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+
+    headers = {
+        'ETag': quote_etag(etag),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': _cache_control(max_age, immutable, public),
+    }
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    if disposition:
+        headers['Content-Disposition'] = content_disposition(disposition, download_name or os.path.basename(path))
+
+    # Conditional GET: If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+    if request.if_none_match:
+        if request.if_none_match.contains(etag) or request.if_none_match.star_tag:
+            return Response(status=304, headers=headers)
+    elif request.if_modified_since and last_modified is not None:
+        if last_modified <= request.if_modified_since:
+            return Response(status=304, headers=headers)
+
+    byte_range = request.range if request.headers.get('Range') else None
+    if byte_range is not None and byte_range.units == 'bytes' and _range_applies(request, etag, last_modified):
+        ranges = _satisfiable_ranges(byte_range, size)
+        if not ranges:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+            headers['Content-Length'] = str(stop - start)
+            body = _file_body(request, path, start, stop - start, size, buffer_size)
+            return Response(body, status=206, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        if len(ranges) <= MAX_RANGES:
+            return _multipart_ranges(path, ranges, size, mimetype, headers, buffer_size)
+
+    headers['Content-Length'] = str(size)
+    body = _file_body(request, path, 0, size, size, buffer_size)
+    return Response(body, status=200, mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+
+def _cache_control(max_age, immutable, public):
+    scope = 'public' if public else 'private'
+    if immutable:
+        return f'{scope}, max-age={max_age}, immutable'
+    if max_age:
+        return f'{scope}, max-age={max_age}, must-revalidate'
+    # Files sit behind a login: the browser may keep them but must revalidate
+    return 'private, no-cache'
+
+
+def _offloaded(handoff, mimetype, etag, max_age, immutable, public, disposition, download_name):
+    """Empty response telling the front-end server which file to send"""
+    name, value = handoff
+    headers = {name: value, 'Cache-Control': _cache_control(max_age, immutable, public)}
+    if name == 'X-Sendfile':
+        # mod_xsendfile keeps upstream validators; nginx generates its own from the file
+        headers['ETag'] = quote_etag(etag)
+    if disposition:
+        headers['Content-Disposition'] = content_disposition(disposition, download_name)
+    return Response(status=200, mimetype=mimetype, headers=headers)
+
+
+def _multipart_ranges(path, ranges, size, mimetype, headers, buffer_size):
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode('ascii')
+        for start, stop in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    # Every part after the first is preceded by the CRLF that ends the previous one
+    length = sum(len(part) for part in part_headers) + 2 * (len(ranges) - 1) + len(closing) \
+        + sum(stop - start for start, stop in ranges)
+
+    def generate():
+        with open(path, 'rb') as f:
+            for index, ((start, stop), part_header) in enumerate(zip(ranges, part_headers)):
+                if index:
+                    yield b'\r\n'
+                yield part_header
+                f.seek(start)
+                remaining = stop - start
+                while remaining:
+                    data = f.read(min(buffer_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+        yield closing
+
+    headers['Content-Length'] = str(length)
+    return Response(generate(), status=206, headers=headers, direct_passthrough=True,
+                    content_type=f'multipart/byteranges; boundary={boundary}')
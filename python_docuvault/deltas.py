@@ -0,0 +1,207 @@
+"""Reverse deltas: old versions of a document stored as a diff against a newer one.
+
+When a document gets a new version, the version it replaced can be stored as
+<root>/ab/cd/<digest>.delta, a binary diff that rebuilds it from the new
+version's bytes, and its full copy is removed from the blob store. The
+newest version is always stored in full, so current versions read as fast
+as before; an old version is rebuilt by walking the chain of deltas back
+from the nearest full copy. The app keeps every SNAPSHOT_INTERVAL-th
+version in full, which bounds the chain.
+
+The diff splits both versions into content-defined chunks (lines, cut at
+MAX_CHUNK) and describes the target as copies of base ranges and inserted
+literals: an edit of a few lines costs those lines, wherever they are.
+Chunks shorter than MIN_MATCH are only copied when they continue the
+previous copy, so short common lines do not fragment the delta. The
+instruction stream is xz-compressed.
+
+File layout: MAGIC, the base digest (64 ASCII hex characters), the target
+size (8 bytes, big-endian), then the xz stream of instructions:
+  b'C' offset (8 bytes) length (4 bytes)  - copy a range of the base
+  b'I' length (4 bytes) data               - insert literal bytes
+Rebuilding streams: the base is read with seeks, one chunk at a time, and
+the output is produced as an iterator of chunks; nothing is held in memory.
+Encoding does not: diff() indexes the whole base and walks the whole
+target, so DeltaStore only encodes versions whose base and target are both
+at most max_size bytes, which bounds the memory an encoding takes.
+"""
+import hashlib
+import lzma
+import os
+import struct
+import tempfile
+
+from blobstore import iter_fanout, remove_with_empty_parents
+
+MAGIC = b'DVD1'
+HEADER = struct.Struct('>4s64sQ')
+COPY = struct.Struct('>QI')
+INSERT = struct.Struct('>I')
+CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK = 4096
+MIN_MATCH = 16
+# Literals are flushed as one instruction past this many bytes
+MAX_INSERT = 1024 * 1024
+XZ_PRESET = 6
+# Deltas larger than this fraction of the version are not worth a rebuild
+MAX_RATIO = 0.5
+# Larger versions (or bases) stay in full: both are read into memory to be diffed
+MAX_SIZE = 64 * 1024 * 1024
+
+
+def _chunks(data):
+    """(offset, bytes) of the content-defined chunks of data"""
+    offset = 0
+    for line in data.split(b'\n'):
+        end = offset + len(line) + 1
+        line = data[offset:end]  # with its newline
+        for start in range(0, len(line), MAX_CHUNK):
+            yield offset + start, line[start:start + MAX_CHUNK]
+        offset = end
+
+
+def diff(base, target):
+    """Instructions that rebuild target (bytes) from base (bytes): ('C', offset, length) / ('I', data)"""
+    index = {}
+    for offset, chunk in _chunks(base):
+        if len(chunk) >= MIN_MATCH:
+            index.setdefault(chunk, offset)
+    copy_offset = copy_length = 0
+    literal = bytearray()
+    for _, chunk in _chunks(target):
+        end = copy_offset + copy_length
+        if copy_length and base[end:end + len(chunk)] == chunk:
+            copy_length += len(chunk)
+            continue
+        offset = index.get(chunk) if len(chunk) >= MIN_MATCH else None
+        if offset is None:
+            if copy_length:
+                yield 'C', copy_offset, copy_length
+                copy_length = 0
+            literal += chunk
+            if len(literal) >= MAX_INSERT:
+                yield 'I', bytes(literal)
+                literal.clear()
+            continue
+        if literal:
+            yield 'I', bytes(literal)
+            literal.clear()
+        if copy_length:
+            yield 'C', copy_offset, copy_length
+        copy_offset, copy_length = offset, len(chunk)
+    if copy_length:
+        yield 'C', copy_offset, copy_length
+    if literal:
+        yield 'I', bytes(literal)
+
+
+def write_delta(f, base_digest, target_size, instructions):
+    f.write(HEADER.pack(MAGIC, base_digest.encode('ascii'), target_size))
+    compressor = lzma.LZMACompressor(preset=XZ_PRESET)
+    for instruction in instructions:
+        if instruction[0] == 'C':
+            record = b'C' + COPY.pack(instruction[1], instruction[2])
+        else:
+            record = b'I' + INSERT.pack(len(instruction[1])) + instruction[1]
+        f.write(compressor.compress(record))
+    f.write(compressor.flush())
+
+
+def read_header(f):
+    """(base digest, target size) of an open delta file"""
+    magic, base_digest, target_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('not a delta file')
+    return base_digest.decode('ascii'), target_size
+
+
+def patch(delta_path, base_path, chunk_size=CHUNK_SIZE):
+    """The bytes of the version a delta describes, as an iterator of chunks"""
+    with open(delta_path, 'rb') as f, open(base_path, 'rb') as base:
+        read_header(f)
+        with lzma.LZMAFile(f) as instructions:
+            while True:
+                op = instructions.read(1)
+                if not op:
+                    return
+                if op == b'C':
+                    offset, length = COPY.unpack(instructions.read(COPY.size))
+                    base.seek(offset)
+                    source = base
+                elif op == b'I':
+                    length, = INSERT.unpack(instructions.read(INSERT.size))
+                    source = instructions
+                else:
+                    raise ValueError(f'corrupt delta: unknown instruction {op!r}')
+                while length:
+                    chunk = source.read(min(chunk_size, length))
+                    if not chunk:
+                        raise ValueError('corrupt delta: copy past the end of its source')
+                    length -= len(chunk)
+                    yield chunk
+
+
+class DeltaStore:
+    def __init__(self, root, max_size=MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self.temp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{digest}.delta')
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def base_of(self, digest):
+        """Digest of the blob a delta is rebuilt from"""
+        with open(self.path(digest), 'rb') as f:
+            return read_header(f)[0]
+
+    def store(self, digest, target_path, base_digest, base_path, max_ratio=MAX_RATIO):
+        """Write the delta of a blob against a base and check it rebuilds the blob.
+
+        Returns the delta's size, or None when it would be larger than
+        max_ratio of the blob or either file is larger than max_size (nothing
+        is kept then). Both files are left in place.
+        """
+        if max(os.path.getsize(base_path), os.path.getsize(target_path)) > self.max_size:
+            return None
+        with open(base_path, 'rb') as f:
+            base = f.read()
+        with open(target_path, 'rb') as f:
+            target = f.read()
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, prefix='delta-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_delta(f, base_digest, len(target), diff(base, target))
+            stored_size = os.path.getsize(temp_path)
+            if stored_size > len(target) * max_ratio:
+                return None
+            rebuilt = hashlib.sha256()
+            for chunk in patch(temp_path, base_path):
+                rebuilt.update(chunk)
+            if rebuilt.hexdigest() != digest:
+                raise ValueError(f'{digest}: the delta does not rebuild the blob')
+            final_path = self.path(digest)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, final_path)
+            return stored_size
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def iter_chunks(self, digest, base_path, chunk_size=CHUNK_SIZE):
+        """The bytes of a blob, rebuilt from its delta and the file of its base"""
+        return patch(self.path(digest), base_path, chunk_size)
+
+    def delete(self, digest):
+        return remove_with_empty_parents(self.path(digest), 2)
+
+    def iter_digests(self):
+        """Every digest with a delta on disk"""
+        for _, name in iter_fanout(self.root):
+            if len(name) == 70 and name.endswith('.delta'):
+                yield name[:64]
@@ -0,0 +1,300 @@
+"""Live dashboard events, pushed to browsers over Server-Sent Events.
+
+Broker fans events out to the streams connected to this process; a backend
+carries them between processes (gunicorn workers):
+  * LocalBackend: this process only (one worker, development),
+  * DatabaseBackend: rows in a table, polled by one thread per process that
+    has streams open; works wherever the database is shared,
+  * RedisBackend: Redis pub/sub (optional redis package), the lowest latency.
+Every event gets an increasing id. The broker keeps the last REPLAY_SIZE so
+an EventSource reconnecting with Last-Event-ID gets what it missed; when the
+gap is older than that it gets a 'reset' event and reloads the page.
+
+A stream waits on a queue.Queue. Under gevent (gunicorn -k gevent) that wait
+is cooperative, so one process holds hundreds of idle streams. A
+synchronous worker is tied up for as long as a stream is open, so the app
+only serves streams from one when told to, closing each after max_seconds.
+"""
+import collections
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REPLAY_SIZE = 1000
+# Events buffered per stream; a client further behind than this is reset
+QUEUE_SIZE = 200
+HEARTBEAT = 15
+# Milliseconds EventSource waits before reconnecting
+RETRY_MS = 3000
+BACKENDS = ('local', 'database', 'redis')
+# Seconds DatabaseBackend waits for a missing id: inserts that committed out
+# of order fill it, a rolled back one never does
+GAP_TIMEOUT = 10
+
+
+def cooperative():
+    """True when blocking waits yield to other greenlets (gevent's monkey patching)"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def format_event(event_id, kind, data):
+    """One SSE message"""
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class LocalBackend:
+    """Delivers events to this process only"""
+
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.dispatch = None
+
+    def latest(self):
+        return 0
+
+    def since(self, after_id, until):
+        return None
+
+    def start(self, dispatch):
+        self.dispatch = dispatch
+
+    def publish(self, events):
+        if self.dispatch is None:
+            return  # nobody is listening in this process
+        for event in events:
+            self.dispatch(dict(event, id=next(self.ids)))
+
+
+class DatabaseBackend:
+    """Events stored as rows and polled.
+
+    The app gives insert(events), fetch(after_id, limit) (events in id order)
+    and latest().
+    """
+
+    def __init__(self, insert, fetch, latest, interval=1.0):
+        self.insert = insert
+        self.fetch = fetch
+        self.latest = latest
+        self.interval = interval
+
+    def start(self, dispatch):
+        threading.Thread(target=self._poll, args=(dispatch, self.latest()), name='events-poll', daemon=True).start()
+
+    def publish(self, events):
+        self.insert(events)
+
+    def since(self, after_id, until):
+        """Events after after_id up to until, or None when there are more than a stream buffers"""
+        events = [event for event in self.fetch(after_id, QUEUE_SIZE + 1) if event['id'] <= until]
+        return None if len(events) > QUEUE_SIZE else events
+
+    def _poll(self, dispatch, position):
+        # Ids are taken when a row is inserted but become visible when it
+        # commits, so a poll can see id 12 before 11. Every id up to position
+        # has been dispatched (or given up on); the ones above it that were
+        # dispatched are in seen, the missing ones in gaps with when they
+        # were noticed.
+        seen = set()
+        gaps = {}
+        while True:
+            time.sleep(self.interval)
+            try:
+                events = self.fetch(position, REPLAY_SIZE + len(seen))
+            except Exception:
+                logger.exception('polling live events failed')
+                continue
+            position = self._advance(dispatch, position, events, seen, gaps, time.monotonic())
+
+    @staticmethod
+    def _advance(dispatch, position, events, seen, gaps, now):
+        """Dispatch the events not seen yet; the new position"""
+        for event in events:
+            if event['id'] not in seen:
+                seen.add(event['id'])
+                dispatch(event)
+        top = max(seen, default=position)
+        for missing in set(range(position + 1, top)) - seen:
+            gaps.setdefault(missing, now)
+        for missing, noticed in list(gaps.items()):
+            if missing in seen or now - noticed >= GAP_TIMEOUT:
+                del gaps[missing]
+        position = min(gaps) - 1 if gaps else top
+        seen.difference_update([event_id for event_id in seen if event_id <= position])
+        return position
+
+
+class RedisBackend:
+    """Events published on a Redis channel; ids come from a counter next to it"""
+
+    def __init__(self, url, channel='docuvault:events'):
+        import redis  # optional: only this backend needs it
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.counter = channel + ':id'
+
+    def latest(self):
+        return int(self.client.get(self.counter) or 0)
+
+    def since(self, after_id, until):
+        return None
+
+    def start(self, dispatch):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        threading.Thread(target=self._listen, args=(pubsub, dispatch), name='events-redis', daemon=True).start()
+
+    def publish(self, events):
+        for event in events:
+            event = dict(event, id=self.client.incr(self.counter))
+            self.client.publish(self.channel, json.dumps(event))
+
+    def _listen(self, pubsub, dispatch):
+        while True:
+            try:
+                for message in pubsub.listen():
+                    dispatch(json.loads(message['data']))
+            except Exception:
+                logger.exception('redis event subscription failed, resubscribing')
+                time.sleep(1)
+
+
+class Subscription:
+    def __init__(self, accepts):
+        self.accepts = accepts
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.overflowed = False
+        # Id the client has seen everything up to, sent first when it did not say
+        self.position = None
+
+
+class Broker:
+    """Fans events out to the streams of this process"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.replay = collections.deque(maxlen=REPLAY_SIZE)
+        self.started = False
+        # Events up to this id may be missing from the replay buffer
+        self.floor = 0
+        self.counters = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    def publish(self, events):
+        """Send events (dicts with 'type' and 'owner'; 'data' is what the browser sees) to every process"""
+        self.counters['published'] += len(events)
+        self.backend.publish(events)
+
+    def position(self):
+        """Id of the latest event; a page rendered now subscribes from there"""
+        with self.lock:
+            if self.started:
+                return self.replay[-1]['id'] if self.replay else self.floor
+        return self.backend.latest()
+
+    def _start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            self.floor = self.backend.latest()
+        self.backend.start(self._dispatch)
+
+    def _dispatch(self, event):
+        with self.lock:
+            if len(self.replay) == self.replay.maxlen:
+                self.floor = self.replay[0]['id']
+            self.replay.append(event)
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.overflowed or not subscription.accepts(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+                self.counters['delivered'] += 1
+            except queue.Full:
+                subscription.overflowed = True
+                self.counters['dropped'] += 1
+
+    def subscribe(self, accepts, last_event_id=None):
+        """A subscription to the events accepts(event) is true for.
+
+        With last_event_id, events after it are queued first; the
+        subscription starts overflowed (the client resets) when some of them
+        are no longer known.
+        """
+        self._start()
+        subscription = Subscription(accepts)
+        with self.lock:
+            backlog = list(self.replay)
+            if last_event_id is None:
+                subscription.position = backlog[-1]['id'] if backlog else self.floor
+                backlog = []
+            elif last_event_id < self.floor:
+                # Older than this process knows: only a backend that stores events has them
+                missed = self.backend.since(last_event_id, self.floor)
+                if missed is None:
+                    subscription.overflowed = True
+                    backlog = []
+                else:
+                    backlog = missed + backlog
+            for event in backlog:
+                if event['id'] > last_event_id and accepts(event):
+                    try:
+                        subscription.queue.put_nowait(event)
+                    except queue.Full:
+                        subscription.overflowed = True
+                        break
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def stream(self, accepts, last_event_id=None, max_seconds=None, heartbeat=HEARTBEAT):
+        """SSE text of subscribe(accepts, last_event_id) until the client goes away or max_seconds pass.
+
+        The subscription is made on the first iteration, so a response that
+        is never sent leaves nothing behind.
+        """
+        subscription = self.subscribe(accepts, last_event_id)
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            if subscription.position is not None:
+                # An id-only message: a reconnect resumes from here even if no event came
+                yield f'id: {subscription.position}\n\n'
+            while True:
+                if subscription.overflowed:
+                    yield format_event(self.floor, 'reset', {})
+                    return
+                timeout = heartbeat
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        return
+                try:
+                    event = subscription.queue.get(timeout=timeout)
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return
+                    yield ': ping\n\n'
+                    continue
+                yield format_event(event['id'], event['type'], event['data'])
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, streams=len(self.subscriptions))
@@ -0,0 +1,198 @@
+"""Plain-text extraction from uploaded documents.
+
+Extraction is pure Python: docx and xlsx are zip containers of XML parts
+that are parsed incrementally with iterparse, and PDF content streams are
+inflated one at a time and scanned for text-showing operators. Every
+extractor stops once max_chars characters have been collected, so a huge
+spreadsheet costs no more than a small one.
+"""
+import mmap
+import re
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+DEFAULT_MAX_CHARS = 200_000
+EXTRACTABLE_TYPES = {'pdf', 'docx', 'xlsx', 'txt'}
+
+# Control characters left over from unmapped PDF glyphs; tab and newline are kept
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+class _TextLimitReached(Exception):
+    pass
+
+
+class _TextCollector:
+    """Accumulates text fragments up to a character budget"""
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.size = 0
+        self.parts = []
+
+    def add(self, text):
+        if not text:
+            return
+        remaining = self.max_chars - self.size
+        if len(text) >= remaining:
+            self.parts.append(text[:remaining])
+            self.size = self.max_chars
+            raise _TextLimitReached()
+        self.parts.append(text)
+        self.size += len(text)
+
+    def text(self):
+        return _CONTROL_CHARS_RE.sub('', ''.join(self.parts)).strip()
+
+
+def extract_text(path, file_type, max_chars=DEFAULT_MAX_CHARS):
+    """Extract up to max_chars of plain text from a stored file.
+
+    Returns None for types that have no text to extract.
+    """
+    extractor = _EXTRACTORS.get((file_type or '').lower())
+    if extractor is None:
+        return None
+    collector = _TextCollector(max_chars)
+    try:
+        extractor(path, collector)
+    except _TextLimitReached:
+        pass
+    return collector.text()
+
+
+def _extract_txt(path, collector):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            collector.add(chunk)
+
+
+def _extract_docx(path, collector):
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as part:
+        for event, element in ElementTree.iterparse(part, events=('end',)):
+            if element.tag == _WORD_NS + 't':
+                collector.add(element.text)
+            elif element.tag == _WORD_NS + 'tab':
+                collector.add('\t')
+            elif element.tag == _WORD_NS + 'p':
+                collector.add('\n')
+                element.clear()
+
+
+def _xlsx_shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as part:
+        for event, element in ElementTree.iterparse(part, events=('end',)):
+            if element.tag == _SHEET_NS + 'si':
+                strings.append(''.join(node.text or '' for node in element.iter(_SHEET_NS + 't')))
+                element.clear()
+    return strings
+
+
+def _extract_xlsx(path, collector):
+    with zipfile.ZipFile(path) as archive:
+        shared = _xlsx_shared_strings(archive)
+        sheets = sorted(
+            (name for name in archive.namelist() if re.match(r'xl/worksheets/sheet\d+\.xml$', name)),
+            key=lambda name: int(re.search(r'(\d+)\.xml$', name).group(1)),
+        )
+        for sheet in sheets:
+            with archive.open(sheet) as part:
+                for event, element in ElementTree.iterparse(part, events=('end',)):
+                    if element.tag == _SHEET_NS + 'c':
+                        collector.add(_xlsx_cell_text(element, shared))
+                    elif element.tag == _SHEET_NS + 'row':
+                        collector.add('\n')
+                        element.clear()
+
+
+def _xlsx_cell_text(cell, shared):
+    cell_type = cell.get('t')
+    if cell_type == 'inlineStr':
+        text = ''.join(node.text or '' for node in cell.iter(_SHEET_NS + 't'))
+    else:
+        value = cell.find(_SHEET_NS + 'v')
+        if value is None or value.text is None:
+            return ''
+        text = value.text
+        if cell_type == 's':
+            index = int(text)
+            text = shared[index] if index < len(shared) else ''
+    return text + '\t' if text else ''
+
+
+# Text-showing operators inside BT ... ET blocks: (string) Tj, [(a) 12 (b)] TJ, ' and "
+_PDF_TEXT_RE = re.compile(rb'\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>|\bET\b|\bT\*|\bTd\b|\bTD\b|\'|"', re.S)
+_PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f',
+                b'(': b'(', b')': b')', b'\\': b'\\'}
+_PDF_ESCAPE_RE = re.compile(rb'\\([nrtbf()\\]|[0-7]{1,3}|\r?\n)')
+_PDF_STREAM_RE = re.compile(rb'stream\r?\n')
+
+
+def _pdf_unescape(match):
+    token = match.group(1)
+    if token in _PDF_ESCAPES:
+        return _PDF_ESCAPES[token]
+    if token[:1] in (b'\r', b'\n'):
+        return b''
+    return bytes([int(token, 8) & 0xFF])
+
+
+def _pdf_decode_string(token):
+    if token.startswith(b'('):
+        raw = _PDF_ESCAPE_RE.sub(_pdf_unescape, token[1:-1])
+    else:
+        digits = re.sub(rb'\s', b'', token[1:-1])
+        if len(digits) % 2:
+            digits += b'0'
+        raw = bytes.fromhex(digits.decode('ascii'))
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be', errors='ignore')
+    return raw.decode('cp1252', errors='ignore')
+
+
+def _extract_pdf(path, collector):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for match in _PDF_STREAM_RE.finditer(data):
+            header = data[max(0, match.start() - 512):match.start()]
+            header = header[max(header.rfind(b'obj'), 0):]
+            # Images, embedded fonts and xref/object streams never hold page text
+            if any(marker in header for marker in (b'/Image', b'/Length1', b'/FontFile', b'/XRef', b'/ObjStm')):
+                continue
+            end = data.find(b'endstream', match.end())
+            if end < 0:
+                break
+            stream = data[match.end():end]
+            if b'/FlateDecode' in header:
+                try:
+                    stream = zlib.decompressobj().decompress(stream, 16 * 1024 * 1024)
+                except zlib.error:
+                    continue
+            elif b'/Filter' in header:
+                continue
+            if b'BT' not in stream:
+                continue
+            for token in _PDF_TEXT_RE.findall(stream):
+                if token[:1] in (b'(', b'<'):
+                    collector.add(_pdf_decode_string(token))
+                elif token == b'ET':
+                    collector.add('\n')
+                else:
+                    collector.add(' ')
+
+
+_EXTRACTORS = {
+    'txt': _extract_txt,
+    'docx': _extract_docx,
+    'xlsx': _extract_xlsx,
+    'pdf': _extract_pdf,
+}
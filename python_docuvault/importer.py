@@ -0,0 +1,206 @@
+"""Bulk import of an existing document archive (a directory tree).
+
+The tree is walked with os.scandir and every file is staged on a pool of
+threads: stat, content sniffing and a single read that hashes the bytes
+while copying them into the blob store. The database side (bulk inserts,
+see import_batch in app.py) only ever sees staged files.
+
+Folders are mapped to departments and categories by a JSON file:
+
+    {
+      "department": "Arşiv",
+      "category": "Genel",
+      "folders": {
+        "Muhasebe": {"department": "Muhasebe"},
+        "Muhasebe/*/Faturalar": {"category": "Fatura"},
+        "*/Sözleşmeler": {"category": "Sözleşme"}
+      }
+    }
+
+The top-level keys are defaults for the whole tree. Each folder pattern is
+matched (fnmatch, case-sensitive, "/" separated) against every ancestor
+folder of a file, shallowest first, so a deeper match overrides a shallower
+one.
+
+Progress is kept in a checkpoint file listing the relative paths that are
+finished (imported, duplicate or rejected), appended after every committed
+batch; a re-run skips them without reading them again.
+"""
+import json
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from fnmatch import fnmatchcase
+
+import ingest
+
+
+class FolderMap:
+    """Department and category of a folder, from the mapping file"""
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.defaults = {key: config[key] for key in ('department', 'category') if key in config}
+        self.patterns = list((config.get('folders') or {}).items())
+        self.cache = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def departments(self):
+        """Every department name the mapping can produce"""
+        names = {self.defaults['department']} if 'department' in self.defaults else set()
+        names.update(rule['department'] for _, rule in self.patterns if 'department' in rule)
+        return names
+
+    def resolve(self, folder):
+        """{'department': ..., 'category': ...} for a relative folder ('' is the root)"""
+        if folder not in self.cache:
+            values = dict(self.defaults)
+            parts = folder.split('/') if folder else []
+            for depth in range(1, len(parts) + 1):
+                ancestor = '/'.join(parts[:depth])
+                for pattern, rule in self.patterns:
+                    if fnmatchcase(ancestor, pattern.strip('/')):
+                        values.update(rule)
+            self.cache[folder] = values
+        return self.cache[folder]
+
+
+class Checkpoint:
+    """Relative paths already handled by an earlier run, one JSON string per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            self.done.add(json.loads(line))
+                        except ValueError:
+                            pass  # a line cut short by a crash
+
+    def __contains__(self, relative_path):
+        return relative_path in self.done
+
+    def add(self, relative_paths):
+        if not relative_paths:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(path, ensure_ascii=False) + '\n' for path in relative_paths))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(relative_paths)
+
+
+class StagedFile:
+    """A file of the archive after staging.
+
+    Its content is in the blob store unless error is set; rejected files
+    (content that does not match the extension) are not retried.
+    """
+    __slots__ = ('relative_path', 'digest', 'size', 'modified_at', 'error', 'rejected')
+
+    def __init__(self, relative_path):
+        self.relative_path = relative_path
+        self.digest = None
+        self.size = 0
+        self.modified_at = None
+        self.error = None
+        self.rejected = False
+
+    @property
+    def name(self):
+        return posixpath.basename(self.relative_path)
+
+    @property
+    def folder(self):
+        return posixpath.dirname(self.relative_path)
+
+    @property
+    def extension(self):
+        return self.name.rsplit('.', 1)[1].lower()
+
+
+def walk(root, extensions):
+    """Relative ('/' separated) paths of the files under root with one of the extensions.
+
+    Hidden files and folders are skipped; folders are listed in name order.
+    """
+    pending = ['']
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = sorted(os.scandir(os.path.join(root, folder)), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subfolders = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            relative_path = f'{folder}/{entry.name}' if folder else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(relative_path)
+            elif entry.is_file() and '.' in entry.name and entry.name.rsplit('.', 1)[1].lower() in extensions:
+                yield relative_path
+        pending.extend(reversed(subfolders))
+
+
+def stage(store, root, relative_path):
+    """Hash and copy one archive file into the blob store"""
+    path = os.path.join(root, *relative_path.split('/'))
+    staged = StagedFile(relative_path)
+    try:
+        staged.modified_at = datetime.utcfromtimestamp(os.stat(path).st_mtime)
+        with open(path, 'rb') as source, store.writer() as writer:
+            while True:
+                chunk = source.read(1024 * 1024)
+                if not chunk:
+                    break
+                writer.write(chunk)
+            if not ingest.content_matches(staged.extension, writer.head):
+                staged.error = 'content does not match the extension'
+                staged.rejected = True
+                return staged
+            staged.digest, staged.size, _ = writer.commit()
+    except OSError as e:
+        staged.error = str(e)
+    return staged
+
+
+def staged_batches(store, root, relative_paths, workers, batch_size):
+    """Stage files on a thread pool, yielding lists of StagedFile of up to batch_size"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as pool:
+        batch = []
+        for relative_path in relative_paths:
+            batch.append(relative_path)
+            if len(batch) == batch_size:
+                yield list(pool.map(lambda path: stage(store, root, path), batch))
+                batch = []
+        if batch:
+            yield list(pool.map(lambda path: stage(store, root, path), batch))
+
+
+class Throughput:
+    """Files and bytes per second since start"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, files, size):
+        self.files += files
+        self.bytes += size
+
+    def rates(self):
+        """(files per second, MB per second)"""
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return self.files / elapsed, self.bytes / elapsed / (1024 * 1024)
@@ -0,0 +1,159 @@
+"""Upload ingest helpers: content sniffing and resumable upload sessions.
+
+A resumable session keeps its bytes in <blob root>/.tmp/session-<id> and
+accepts chunks strictly in order at the offset the server reports, so a
+client whose connection dropped asks for the offset and continues from there.
+Each append or completion runs under an exclusive lock on the session file,
+so a client retry that overlaps the request it retries waits for it and then
+gets an offset mismatch instead of writing the same bytes again.
+The SHA-256 is carried along in memory between chunks. It is only reused if
+the file is still as this process left it and the chunk's offset was
+committed (forget_running_hash otherwise); if a chunk lands on a process that
+does not hold the running hash (another gunicorn worker, a restart), or
+another process wrote since, the partial file is rehashed.
+"""
+import contextlib
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; the development server runs one process there
+    fcntl = None
+
+from blobstore import CHUNK_SIZE, HEAD_SIZE
+
+# Leading bytes of each allowed type. Office documents are zip containers.
+_SIGNATURES = {
+    'pdf': (b'%PDF-',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'docx': (b'PK\x03\x04',),
+    'xlsx': (b'PK\x03\x04',),
+}
+
+
+def content_matches(extension, head):
+    """Check the first bytes of a file against the type its extension claims"""
+    extension = extension.lower()
+    if extension == 'mp4':
+        # ISO base media: box size, then 'ftyp'
+        return head[4:8] == b'ftyp'
+    if extension == 'txt':
+        return b'\x00' not in head
+    signatures = _SIGNATURES.get(extension)
+    if signatures is None:
+        return True
+    return head.startswith(signatures)
+
+
+class OffsetMismatch(Exception):
+    """A chunk did not start where the previous one ended"""
+
+    def __init__(self, offset):
+        super().__init__(offset)
+        self.offset = offset
+
+
+_running_hashes = {}
+_running_hashes_lock = threading.Lock()
+
+
+def session_path(store, session_id):
+    return os.path.join(store.temp_dir, f'session-{session_id}')
+
+
+def create_session(store, session_id):
+    """Create the empty file of a new session"""
+    open(session_path(store, session_id), 'xb').close()
+
+
+@contextlib.contextmanager
+def locked_session(store, session_id):
+    """Hold an exclusive lock on a session's file; yields the file opened for update.
+
+    Raises FileNotFoundError when the session was completed or discarded.
+    """
+    with open(session_path(store, session_id), 'r+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield f
+
+
+def _file_version(f):
+    """What identifies the contents of a session file between two locked appends"""
+    stat = os.fstat(f.fileno())
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _hash_state(f, session_id, offset):
+    """The running hash of a locked session file at offset, rehashing it if needed"""
+    with _running_hashes_lock:
+        state = _running_hashes.pop(session_id, None)
+    if state is not None and state[0] == offset and state[1] == _file_version(f):
+        return state[2]
+    digest = hashlib.sha256()
+    f.seek(0)
+    remaining = offset
+    while remaining:
+        chunk = f.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    return digest
+
+
+def append_chunk(f, session_id, offset, expected_offset, stream, limit):
+    """Append a request body to a session file held with locked_session(). Returns the new offset.
+
+    Raises OffsetMismatch when offset is not the session's current offset and
+    ValueError when the body would grow the file beyond limit bytes.
+    """
+    if offset != expected_offset:
+        raise OffsetMismatch(expected_offset)
+    digest = _hash_state(f, session_id, offset)
+    written = offset
+    # Drop anything left behind by a chunk whose request died half way
+    f.truncate(offset)
+    f.seek(offset)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        written += len(chunk)
+        if written > limit:
+            raise ValueError('upload exceeds the declared size')
+        digest.update(chunk)
+        f.write(chunk)
+    f.flush()
+    with _running_hashes_lock:
+        _running_hashes[session_id] = (written, _file_version(f), digest)
+    return written
+
+
+def forget_running_hash(session_id):
+    """Drop the running hash of an append whose new offset was not committed"""
+    with _running_hashes_lock:
+        _running_hashes.pop(session_id, None)
+
+
+def read_head(f):
+    f.seek(0)
+    return f.read(HEAD_SIZE)
+
+
+def finish_session(store, f, session_id, size):
+    """Move a completed, locked session file into the blob store. Returns (digest, size)."""
+    digest = _hash_state(f, session_id, size).hexdigest()
+    store.adopt_temp(session_path(store, session_id), digest)
+    return digest, size
+
+
+def discard_session(store, session_id):
+    forget_running_hash(session_id)
+    path = session_path(store, session_id)
+    if os.path.exists(path):
+        os.remove(path)
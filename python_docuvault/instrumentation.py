@@ -0,0 +1,350 @@
+"""Request metrics in the Prometheus text format, and a sampling profiler for slow requests.
+
+Registry holds counters and histograms with labels and renders them, plus
+whatever its collectors return at scrape time (gauges read from the
+database or from caches), in the text exposition format that Prometheus
+scrapes from /metrics.
+
+Metrics live in the memory of one process. When several processes serve
+the app (gunicorn workers), each one can write a snapshot of its metrics to
+a shared directory (flush()), and render() adds up the snapshots of every
+process so one scrape sees all of them. Snapshots are named by an id drawn
+when a process first flushes, so a new process never replaces the snapshot
+of an old one with the same pid. The snapshots of processes of this host
+that have exited are folded into retired.json, so counters never go
+backwards and the directory does not grow with every restart. Counters kept
+by other objects (a cache's hit counts) are registered with
+counter_function() and take part in the snapshots like any other counter.
+
+SamplingProfiler samples the stacks of the threads that are serving a
+request every few milliseconds; dump() writes the samples of a request in
+the folded format read by flamegraph.pl, speedscope and inferno
+("outer;inner;leaf count" per line).
+"""
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+try:
+    import fcntl
+except ImportError:  # exited processes' snapshots are then kept as they are
+    fcntl = None
+
+RETIRED = 'retired.json'
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, TypeError, ValueError, OverflowError):
+        pass
+    return True
+
+
+def _add_samples(merged, snapshot, names=None):
+    """Add the samples of a snapshot into merged ({name: {key tuple: sample}})"""
+    for name, samples in snapshot.items():
+        if names is not None and name not in names:
+            continue
+        target = merged.setdefault(name, {})
+        for key, sample in samples:
+            key = tuple(key)
+            current = target.get(key)
+            if current is None:
+                target[key] = list(sample) if isinstance(sample, list) else sample
+            elif isinstance(sample, list):
+                target[key] = [a + b for a, b in zip(current, sample)]
+            else:
+                target[key] = current + sample
+    return merged
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    """A counter or histogram family; samples are keyed by their label values"""
+
+    def __init__(self, registry, kind, name, help, labels, buckets=None, read=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else None
+        self.samples = {}
+        # Counters kept elsewhere: read() returns {label values: value}
+        self.read = read
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                # Per-bucket counts, then sum and count
+                sample = self.samples[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[i] += 1
+                    break
+            sample[-2] += value
+            sample[-1] += 1
+
+
+class Registry:
+    def __init__(self, directory=None, flush_interval=10):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flushed_at = 0.0
+        self._process = None  # (pid, snapshot id)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def counter(self, name, help, labels=()):
+        return self._add(Metric(self, 'counter', name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Metric(self, 'histogram', name, help, labels, buckets))
+
+    def counter_function(self, name, help, labels, read):
+        """A counter kept by another object; read() returns {tuple of label values: value}
+        and is called whenever the registry takes a snapshot"""
+        return self._add(Metric(self, 'counter', name, help, labels, read=read))
+
+    def collector(self, collect):
+        """Register a callable run at every scrape; it returns an iterable of
+        (name, type, help, [(labels dict, value), ...]) with type 'gauge' or 'counter'"""
+        self.collectors.append(collect)
+        return collect
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    @property
+    def snapshot_id(self):
+        """Names this process' snapshot file; new in every process, forked ones included"""
+        pid = os.getpid()
+        if self._process is None or self._process[0] != pid:
+            self._process = (pid, uuid.uuid4().hex)
+        return self._process[1]
+
+    def snapshot(self):
+        """The samples of this process, as JSON-serialisable data"""
+        with self.lock:
+            return {name: [[list(key), sample] for key, sample in
+                           (metric.read() if metric.read else metric.samples).items()]
+                    for name, metric in self.metrics.items()}
+
+    def flush(self, force=False):
+        """Write this process' snapshot to the shared directory, at most every flush_interval seconds"""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed_at < self.flush_interval:
+            return
+        self.flushed_at = now
+        path = os.path.join(self.directory, f'{self.snapshot_id}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'metrics': self.snapshot()}, f)
+        os.replace(path + '.tmp', path)
+        self._retire_exited()
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None  # gone, or being replaced
+
+    def _snapshots(self):
+        """(file name, data) of the other processes' snapshots"""
+        own = f'{self.snapshot_id}.json'
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') and name not in (own, RETIRED):
+                data = self._read(name)
+                if data is not None:
+                    yield name, data
+
+    def _retire_exited(self):
+        """Fold the snapshots of this host's exited processes into the retired totals"""
+        if fcntl is None:
+            return
+        host = socket.gethostname()
+        exited = [name for name, data in self._snapshots()
+                  if data.get('host') == host and not _alive(data.get('pid'))]
+        if not exited:
+            return
+        with open(os.path.join(self.directory, 'retired.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired = self._read(RETIRED) or {'ids': [], 'metrics': {}}
+            # Ids are only kept while a folded snapshot may still be on disk
+            retired['ids'] = [snapshot_id for snapshot_id in retired['ids']
+                              if os.path.exists(os.path.join(self.directory, f'{snapshot_id}.json'))]
+            merged = _add_samples({}, retired['metrics'])
+            for name in exited:
+                data = self._read(name)
+                snapshot_id = name[:-len('.json')]
+                # Already folded in by another process that died before removing the file
+                if data is not None and snapshot_id not in retired['ids']:
+                    _add_samples(merged, data['metrics'])
+                    retired['ids'].append(snapshot_id)
+            retired['metrics'] = {name: [[list(key), sample] for key, sample in samples.items()]
+                                  for name, samples in merged.items()}
+            path = os.path.join(self.directory, RETIRED)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(path + '.tmp', path)
+            for name in exited:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _merged(self):
+        """Samples of every process (this one live, the others from their snapshots)"""
+        merged = {name: {} for name in self.metrics}
+        _add_samples(merged, self.snapshot())
+        if self.directory:
+            retired = self._read(RETIRED) or {'ids': [], 'metrics': {}}
+            _add_samples(merged, retired['metrics'], self.metrics)
+            for name, data in self._snapshots():
+                if name[:-len('.json')] not in retired['ids']:
+                    # Snapshots written before they carried their host and pid are bare metrics
+                    _add_samples(merged, data['metrics'] if 'metrics' in data else data, self.metrics)
+        return merged
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, samples in self._merged().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.help}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for key, sample in sorted(samples.items()):
+                if metric.kind == 'counter':
+                    lines.append(f'{name}{_format_labels(metric.labels, key)} {_format_value(sample)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), sample[:-2] + [sample[-1] - sum(sample[:-2])]):
+                    cumulative += count
+                    labels = _format_labels(metric.labels, key, [('le', _format_value(bound))])
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(metric.labels, key)} {_format_value(sample[-2])}')
+                lines.append(f'{name}_count{_format_labels(metric.labels, key)} {sample[-1]}')
+        for collect in self.collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels, labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads on a background thread"""
+
+    def __init__(self, folder, interval=0.005, keep=200):
+        self.folder = folder
+        self.interval = interval
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.active = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+        os.makedirs(folder, exist_ok=True)
+
+    def start(self):
+        """Start sampling the calling thread"""
+        with self.lock:
+            self.active[threading.get_ident()] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def stop(self):
+        """Stop sampling the calling thread; returns its samples (Counter of folded stacks)"""
+        with self.lock:
+            return self.active.pop(threading.get_ident(), Counter())
+
+    def dump(self, samples, label):
+        """Write samples as a folded-stacks file named after label; returns its path"""
+        if not samples:
+            return None
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in label)
+        path = os.path.join(self.folder, f"{time.strftime('%Y%m%d-%H%M%S')}-{safe}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        self._prune()
+        return path
+
+    def _prune(self):
+        entries = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(self.folder)
+                         if entry.name.endswith('.folded'))
+        for _, path in entries[:max(len(entries) - self.keep, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self.lock:
+                idle = not self.active
+            if idle:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, samples in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is None or ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                        frame = frame.f_back
+                    samples[';'.join(reversed(stack))] += 1
+            del frames
+            time.sleep(self.interval)
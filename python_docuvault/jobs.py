@@ -0,0 +1,235 @@
+"""Database-backed job queue for work that should not run inside a web request.
+
+Jobs are rows of one table (see Job in app.py). A worker claims a batch with
+a single UPDATE ... RETURNING that marks the rows running and leases them to
+the worker until locked_until:
+  * on PostgreSQL the candidate rows are selected FOR UPDATE SKIP LOCKED, so
+    concurrent workers neither wait on nor double-claim each other's rows,
+  * on SQLite, which has one writer at a time, the UPDATE itself is the
+    lock and the lease is what keeps a claimed job away from other workers.
+A worker renews its leases while jobs run; a job whose lease runs out (its
+worker died) is claimed again. Failed jobs are retried with exponential
+backoff and jitter up to max_attempts, then dead-lettered (status 'dead')
+until an admin retries them.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import OperationalError
+
+STATUSES = ('queued', 'running', 'done', 'dead')
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def backoff(attempts, base, cap):
+    """Seconds to wait before retrying after the given (1-based) failed attempt"""
+    delay = min(cap, base * 2 ** (attempts - 1))
+    # Jitter spreads out retries of jobs that failed together (e.g. a database restart)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def claim(connection, table, worker_id, limit, lease, now=None):
+    """Lease up to limit due jobs to worker_id; returns them as dicts"""
+    now = now or datetime.utcnow()
+    c = table.c
+    due = select(c.id).where(or_(
+        and_(c.status == 'queued', c.run_at <= now),
+        and_(c.status == 'running', c.locked_until < now, c.attempts < c.max_attempts),
+    )).order_by(c.run_at).limit(limit).with_for_update(skip_locked=True)
+    statement = table.update().where(c.id.in_(due)).values(
+        status='running',
+        locked_by=worker_id,
+        locked_until=now + timedelta(seconds=lease),
+        attempts=c.attempts + 1,
+        started_at=now,
+    ).returning(c.id, c.kind, c.payload, c.attempts, c.max_attempts, c.run_at)
+    return [dict(row._mapping) for row in connection.execute(statement)]
+
+
+def renew(connection, table, ids, worker_id, lease, now=None):
+    """Extend the leases of jobs that are still running on worker_id"""
+    now = now or datetime.utcnow()
+    c = table.c
+    connection.execute(table.update().where(c.id.in_(ids), c.locked_by == worker_id, c.status == 'running')
+                       .values(locked_until=now + timedelta(seconds=lease)))
+
+
+def complete(connection, table, job, worker_id, now=None):
+    """Mark a job done; False if its lease was lost to another worker meanwhile"""
+    c = table.c
+    result = connection.execute(
+        table.update().where(c.id == job['id'], c.locked_by == worker_id, c.status == 'running')
+        .values(status='done', finished_at=now or datetime.utcnow(), locked_by=None, locked_until=None,
+                last_error=None))
+    return result.rowcount == 1
+
+
+def fail(connection, table, job, worker_id, error, retry_base, retry_max, now=None):
+    """Schedule a retry of a failed job, or dead-letter it after its last attempt.
+
+    Returns the new status, or None if the lease was lost meanwhile.
+    """
+    now = now or datetime.utcnow()
+    c = table.c
+    if job['attempts'] >= job['max_attempts']:
+        values = {'status': 'dead', 'finished_at': now}
+    else:
+        delay = backoff(job['attempts'], retry_base, retry_max)
+        values = {'status': 'queued', 'run_at': now + timedelta(seconds=delay)}
+    result = connection.execute(
+        table.update().where(c.id == job['id'], c.locked_by == worker_id, c.status == 'running')
+        .values(locked_by=None, locked_until=None, last_error=error[-4000:], **values))
+    return values['status'] if result.rowcount == 1 else None
+
+
+def reap(connection, table, retention, now=None):
+    """Dead-letter jobs whose last attempt's lease expired, and delete old finished jobs"""
+    now = now or datetime.utcnow()
+    c = table.c
+    dead = connection.execute(
+        table.update().where(c.status == 'running', c.locked_until < now, c.attempts >= c.max_attempts)
+        .values(status='dead', finished_at=now, locked_by=None, locked_until=None,
+                last_error='lease expired on the last attempt (worker died?)')).rowcount
+    purged = connection.execute(
+        table.delete().where(c.status == 'done', c.finished_at < now - timedelta(seconds=retention))).rowcount
+    return dead, purged
+
+
+class Worker:
+    """Claims jobs and runs their handlers on a pool of threads.
+
+    handlers maps a job kind to a callable taking the job's payload as
+    keyword arguments; an exception fails the attempt.
+    """
+
+    def __init__(self, engine, table, handlers, concurrency=4, lease=300, poll_interval=2.0,
+                 retry_base=10, retry_max=3600, retention=7 * 24 * 3600, worker_id=None, log=print):
+        self.engine = engine
+        self.table = table
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.retention = retention
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.log = log
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.counters = {'done': 0, 'retried': 0, 'dead': 0, 'lost': 0}
+
+    def stop(self):
+        """Stop claiming jobs; run() returns once the running ones finish"""
+        self.stopping.set()
+        self.wakeup.set()
+
+    def run(self, until_empty=False):
+        """Work until stop() (or, with until_empty, until no job is due)"""
+        last_renewal = last_reap = 0.0
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self.stopping.is_set():
+                self.wakeup.clear()
+                now = time.monotonic()
+                if now - last_renewal >= self.lease / 3:
+                    self._renew()
+                    last_renewal = now
+                if now - last_reap >= 60:
+                    self._reap()
+                    last_reap = now
+                claimed = self._claim()
+                for job in claimed:
+                    pool.submit(self._execute, job)
+                with self.lock:
+                    busy = len(self.inflight)
+                if until_empty and not claimed and not busy:
+                    break
+                if not claimed or busy >= self.concurrency:
+                    self.wakeup.wait(self.poll_interval)
+        return dict(self.counters)
+
+    def _claim(self):
+        with self.lock:
+            free = self.concurrency - len(self.inflight)
+        if free <= 0:
+            return []
+        try:
+            with self.engine.begin() as connection:
+                claimed = claim(connection, self.table, self.worker_id, free, self.lease)
+        except OperationalError as e:
+            # SQLite: another writer held the database past the busy timeout; try again next poll
+            self.log(f'claim failed: {e.orig}')
+            return []
+        with self.lock:
+            for job in claimed:
+                self.inflight[job['id']] = job
+        return claimed
+
+    def _renew(self):
+        with self.lock:
+            ids = list(self.inflight)
+        if not ids:
+            return
+        try:
+            with self.engine.begin() as connection:
+                renew(connection, self.table, ids, self.worker_id, self.lease)
+        except OperationalError as e:
+            self.log(f'lease renewal failed: {e.orig}')
+
+    def _reap(self):
+        try:
+            with self.engine.begin() as connection:
+                dead, _ = reap(connection, self.table, self.retention)
+        except OperationalError as e:
+            self.log(f'reap failed: {e.orig}')
+            return
+        if dead:
+            self.log(f'{dead} abandoned jobs dead-lettered')
+
+    def _execute(self, job):
+        started = time.monotonic()
+        error = None
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                raise LookupError(f"no handler for job kind {job['kind']!r}")
+            handler(**json.loads(job['payload'] or '{}'))
+        except Exception:
+            error = traceback.format_exc()
+        elapsed = time.monotonic() - started
+        try:
+            with self.engine.begin() as connection:
+                if error is None:
+                    outcome = 'done' if complete(connection, self.table, job, self.worker_id) else None
+                else:
+                    outcome = fail(connection, self.table, job, self.worker_id, error,
+                                   self.retry_base, self.retry_max)
+        except Exception:
+            # The lease runs out and the job is picked up again
+            self.log(f"job {job['id']} ({job['kind']}): could not record the outcome\n{traceback.format_exc()}")
+            outcome = None
+        finally:
+            with self.lock:
+                self.inflight.pop(job['id'], None)
+                name = {'queued': 'retried', None: 'lost'}.get(outcome, outcome)
+                self.counters[name] += 1
+            self.wakeup.set()
+        attempt = f"attempt {job['attempts']}/{job['max_attempts']}"
+        if outcome == 'done':
+            self.log(f"job {job['id']} ({job['kind']}) done in {elapsed:.2f}s")
+        elif outcome is None:
+            self.log(f"job {job['id']} ({job['kind']}) lost its lease ({attempt})")
+        else:
+            last_line = error.strip().splitlines()[-1]
+            self.log(f"job {job['id']} ({job['kind']}) failed, {attempt}, "
+                     f"{'dead-lettered' if outcome == 'dead' else 'will retry'}: {last_line}")
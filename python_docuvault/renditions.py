@@ -0,0 +1,154 @@
+"""Thumbnails of uploaded images and first-page previews of PDFs.
+
+Renditions are JPEGs rendered lazily on first request and kept in
+<root>/ab/<key>-<size>.jpg, where key identifies the source bytes (the blob
+hash), so a cached rendition never goes stale. The cache is bounded in
+bytes: when it grows past max_bytes the least recently used renditions are
+removed (a hit refreshes the file's mtime). Concurrent requests for the same
+rendition wait for a single render instead of starting their own.
+
+Images are rendered with Pillow and PDFs with poppler's pdftoppm; both are
+optional, and can_render() tells which types the current host supports.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from blobstore import DiskLRU
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only PDFs are rendered
+    Image = None
+
+# Longest edge in pixels
+SIZES = {'sm': 160, 'md': 480, 'lg': 1280}
+IMAGE_TYPES = {'jpg', 'jpeg', 'png', 'gif'}
+JPEG_QUALITY = 82
+# A source that failed to render is not retried for this long
+FAILURE_TTL = 600
+
+
+class RenditionCache:
+    def __init__(self, root, max_bytes, pdftoppm=None, timeout=30):
+        self.root = root
+        self.temp_dir = os.path.join(root, '.tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lru = DiskLRU(root, max_bytes, suffix='.jpg')
+        self.pdftoppm = pdftoppm if pdftoppm is not None else shutil.which('pdftoppm')
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.failures = {}
+        self.counters = {'hits': 0, 'misses': 0, 'waits': 0, 'renders': 0, 'failed': 0}
+
+    def can_render(self, file_type):
+        file_type = (file_type or '').lower()
+        if file_type in IMAGE_TYPES:
+            return Image is not None
+        if file_type == 'pdf':
+            return bool(self.pdftoppm)
+        return False
+
+    def path(self, key, size):
+        return os.path.join(self.root, key[:2], f'{key}-{size}.jpg')
+
+    def get(self, key, size, source_path, file_type):
+        """Path of the rendition, rendering it first if needed. None if it cannot be rendered."""
+        target = self.path(key, size)
+        if self._hit(target):
+            return target
+        with self.lock:
+            failed_at = self.failures.get(target)
+            if failed_at is not None and time.monotonic() - failed_at < FAILURE_TTL:
+                return None
+            event = self.inflight.get(target)
+            owner = event is None
+            if owner:
+                event = self.inflight[target] = threading.Event()
+        if not owner:
+            self._count('waits')
+            event.wait(self.timeout)
+            return target if os.path.exists(target) else None
+        try:
+            # Another request may have finished the render just before we registered
+            if self._hit(target):
+                return target
+            self._count('misses')
+            if not self._render(source_path, file_type, SIZES[size], target):
+                return None
+        finally:
+            with self.lock:
+                del self.inflight[target]
+            event.set()
+        return target
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        with self.lru.lock:
+            stats['evicted'] = self.lru.evicted
+            stats['bytes'] = self.lru.total_bytes
+        stats['max_bytes'] = self.max_bytes
+        stats['renderers'] = {'images': Image is not None, 'pdf': bool(self.pdftoppm)}
+        return stats
+
+    def _count(self, name, delta=1):
+        with self.lock:
+            self.counters[name] += delta
+
+    def _hit(self, target):
+        if not self.lru.touch(target):
+            return False
+        self._count('hits')
+        return True
+
+    def _render(self, source_path, file_type, pixels, target):
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, prefix='rendition-', suffix='.jpg')
+        os.close(fd)
+        try:
+            if file_type.lower() == 'pdf':
+                self._render_pdf(source_path, pixels, temp_path)
+            else:
+                self._render_image(source_path, pixels, temp_path)
+            size = os.path.getsize(temp_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, target)
+        except Exception:
+            with self.lock:
+                self.failures[target] = time.monotonic()
+                self.counters['failed'] += 1
+            return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self.lock:
+            self.failures.pop(target, None)
+            self.counters['renders'] += 1
+        self.lru.added(target, size)
+        return True
+
+    def _render_image(self, source_path, pixels, temp_path):
+        with Image.open(source_path) as image:
+            # JPEG sources are decoded at a reduced scale instead of full size
+            image.draft('RGB', (pixels, pixels))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((pixels, pixels))
+            if image.mode not in ('RGB', 'L'):
+                rgba = image.convert('RGBA')
+                image = Image.new('RGB', rgba.size, 'white')
+                image.paste(rgba, mask=rgba.getchannel('A'))
+            image.save(temp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+    def _render_pdf(self, source_path, pixels, temp_path):
+        prefix = temp_path[:-len('.jpg')]
+        subprocess.run(
+            [self.pdftoppm, '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(pixels),
+             source_path, prefix],
+            check=True, timeout=self.timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
@@ -0,0 +1,265 @@
+"""Full-text document search backed by an SQLite FTS5 index.
+
+The index holds one row per file (rowid = file.id) with its title,
+description, revision notes, the concatenated text of its comments and the
+text extracted from the document itself (see extraction.py).
+Text is folded before indexing so that Turkish dotted/dotless i variants
+(İ, I, ı, i) match each other; the unicode61 tokenizer takes care of the
+remaining case folding and strips diacritics (ş/s, ç/c, ğ/g, ö/o, ü/u).
+"""
+import re
+
+from markupsafe import escape
+
+SEARCH_TABLE = 'file_search'
+SEARCH_COLUMNS = ('title', 'description', 'revision_notes', 'comments', 'content')
+# bm25 weights, one per column: a hit in the title counts most
+COLUMN_WEIGHTS = (10.0, 4.0, 2.0, 1.0, 0.5)
+
+# Folding is strictly one character to one character, which keeps offsets in
+# the folded text aligned with the original (see restore_snippet)
+_TURKISH_FOLD = str.maketrans({'İ': 'i', 'I': 'i', 'ı': 'i'})
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_HIGHLIGHT_OPEN = '\x02'
+_HIGHLIGHT_CLOSE = '\x03'
+_ELLIPSIS = '…'
+
+_ready_engines = set()
+
+
+def fold(text):
+    """Fold Turkish i variants so that İSTANBUL, Istanbul and ıstanbul index alike"""
+    return (text or '').translate(_TURKISH_FOLD)
+
+
+def build_match_query(text):
+    """Turn free text from the search box into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term and terms are ANDed, so
+    "dof rap" finds "DOF Raporu". Returns None when there is nothing to search.
+    """
+    terms = _TOKEN_RE.findall(fold(text))
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def is_available(connection):
+    """True when the FTS index exists on this connection's database"""
+    engine = connection.engine
+    if engine in _ready_engines:
+        return True
+    if connection.dialect.name != 'sqlite':
+        return False
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+    ).first()
+    if exists:
+        _ready_engines.add(engine)
+    return bool(exists)
+
+
+def ensure_index(connection):
+    """Create the FTS table, recreating it if its columns changed.
+
+    Returns True when the table was (re)created and needs rebuild_index().
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({SEARCH_TABLE})")]
+    if columns == list(SEARCH_COLUMNS):
+        _ready_engines.add(connection.engine)
+        return False
+    if columns:
+        connection.exec_driver_sql(f"DROP TABLE {SEARCH_TABLE}")
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        f"{', '.join(SEARCH_COLUMNS)}, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    _ready_engines.add(connection.engine)
+    return True
+
+
+def comment_text(connection, file_id):
+    """All comment bodies of a file, joined into one folded document"""
+    rows = connection.exec_driver_sql(
+        "SELECT content FROM comment WHERE file_id = ? ORDER BY id", (file_id,)
+    )
+    return fold('\n'.join(row[0] for row in rows))
+
+
+def content_text(connection, file_id):
+    """Text extracted from the document, folded"""
+    row = connection.exec_driver_sql(
+        "SELECT text FROM file_content WHERE file_id = ?", (file_id,)
+    ).first()
+    return fold(row[0]) if row else ''
+
+
+def index_file(connection, file):
+    """Insert or refresh the index row of a File"""
+    connection.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (file.id, fold(file.title), fold(file.description), fold(file.revision_notes),
+         comment_text(connection, file.id), content_text(connection, file.id)),
+    )
+
+
+def index_new_files(connection, rows):
+    """Index freshly inserted files in one statement; rows are (id, title, description).
+
+    New files have no revision notes, comments or extracted text yet.
+    """
+    connection.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) "
+        "VALUES (?, ?, ?, '', '', '')",
+        [(file_id, fold(title), fold(description)) for file_id, title, description in rows],
+    )
+
+
+def index_comments(connection, file_id):
+    """Refresh only the comments column of a file's index row"""
+    connection.exec_driver_sql(
+        f"UPDATE {SEARCH_TABLE} SET comments = ? WHERE rowid = ?",
+        (comment_text(connection, file_id), file_id),
+    )
+
+
+def index_content(connection, file_id, text):
+    """Refresh only the extracted-content column of a file's index row"""
+    connection.exec_driver_sql(
+        f"UPDATE {SEARCH_TABLE} SET content = ? WHERE rowid = ?", (fold(text), file_id)
+    )
+
+
+def remove_file(connection, file_id):
+    connection.exec_driver_sql(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = ?", (file_id,))
+
+
+def rebuild_index(connection, batch_size=1000):
+    """Re-index every file from scratch. Returns the number of indexed files."""
+    connection.exec_driver_sql(f"DELETE FROM {SEARCH_TABLE}")
+    comments = {}
+    for file_id, content in connection.exec_driver_sql(
+            "SELECT file_id, content FROM comment ORDER BY id"):
+        comments.setdefault(file_id, []).append(content)
+
+    total = 0
+    placeholders = ', '.join('?' * (len(SEARCH_COLUMNS) + 1))
+    last_id = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            "SELECT file.id, file.title, file.description, file.revision_notes, file_content.text "
+            "FROM file LEFT JOIN file_content ON file_content.file_id = file.id "
+            "WHERE file.id > ? ORDER BY file.id LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return total
+        connection.exec_driver_sql(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES ({placeholders})",
+            [(row[0], fold(row[1]), fold(row[2]), fold(row[3]),
+              fold('\n'.join(comments.get(row[0], ()))), fold(row[4])) for row in rows],
+        )
+        total += len(rows)
+        last_id = rows[-1][0]
+
+
+def restore_snippet(snippet, originals):
+    """Map an FTS snippet of folded text back onto the original text as HTML.
+
+    Folding never changes string length, so once the snippet's plain text is
+    located in one of the folded originals, every character can be swapped
+    back for its original. Matches are wrapped in <mark>.
+    """
+    leading = snippet.startswith(_ELLIPSIS)
+    trailing = snippet.endswith(_ELLIPSIS)
+    body = snippet[len(_ELLIPSIS) if leading else 0:len(snippet) - len(_ELLIPSIS) if trailing else None]
+    plain = body.replace(_HIGHLIGHT_OPEN, '').replace(_HIGHLIGHT_CLOSE, '')
+
+    restored = body
+    for original in originals:
+        if not original:
+            continue
+        position = fold(original).find(plain)
+        if position < 0:
+            continue
+        chars = []
+        offset = position
+        for char in body:
+            if char in (_HIGHLIGHT_OPEN, _HIGHLIGHT_CLOSE):
+                chars.append(char)
+            else:
+                chars.append(original[offset])
+                offset += 1
+        restored = ''.join(chars)
+        break
+
+    html = str(escape(restored)).replace(_HIGHLIGHT_OPEN, '<mark>').replace(_HIGHLIGHT_CLOSE, '</mark>')
+    return (_ELLIPSIS if leading else '') + html + (_ELLIPSIS if trailing else '')
+
+
+def search(connection, text, filters=None, uploaded_by=None, uploaded_since=None, uploaded_before=None,
+           limit=20, offset=0, snippet_tokens=16):
+    """Ranked search. Returns (total, [(file_id, score, snippet_html), ...]).
+
+    filters takes the department, status and type filters of the admin
+    dashboard. Its from/to dates come as datetimes, uploaded_since
+    (inclusive) and uploaded_before (exclusive); see upload_date_bounds in
+    app.py. uploaded_by restricts the results to one user's files.
+    """
+    match = build_match_query(text)
+    if not match:
+        return 0, []
+
+    where = [f"{SEARCH_TABLE} MATCH ?"]
+    params = [match]
+    filters = filters or {}
+    if filters.get('department'):
+        where.append("file.department_id = ?")
+        params.append(filters['department'])
+    if filters.get('status'):
+        where.append("file.status = ?")
+        params.append(filters['status'])
+    if filters.get('type'):
+        where.append("file.file_type = ?")
+        params.append(filters['type'])
+    if uploaded_by is not None:
+        where.append("file.uploaded_by = ?")
+        params.append(uploaded_by)
+    # DateTime columns are stored as ISO text with a space separator
+    if uploaded_since is not None:
+        where.append("file.uploaded_at >= ?")
+        params.append(uploaded_since.isoformat(' '))
+    if uploaded_before is not None:
+        where.append("file.uploaded_at < ?")
+        params.append(uploaded_before.isoformat(' '))
+    where_sql = ' AND '.join(where)
+    from_sql = f"FROM {SEARCH_TABLE} JOIN file ON file.id = {SEARCH_TABLE}.rowid"
+
+    total = connection.exec_driver_sql(f"SELECT count(*) {from_sql} WHERE {where_sql}", tuple(params)).scalar()
+    weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+    rows = connection.exec_driver_sql(
+        f"SELECT file.id, bm25({SEARCH_TABLE}, {weights}) AS score, "
+        f"snippet({SEARCH_TABLE}, -1, ?, ?, ?, ?), "
+        "file.title, file.description, file.revision_notes "
+        f"{from_sql} WHERE {where_sql} ORDER BY score LIMIT ? OFFSET ?",
+        (_HIGHLIGHT_OPEN, _HIGHLIGHT_CLOSE, _ELLIPSIS, snippet_tokens, *params, limit, offset),
+    ).fetchall()
+
+    results = []
+    for file_id, score, snippet, *columns in rows:
+        originals = _snippet_sources(connection, file_id, columns)
+        results.append((file_id, -score, restore_snippet(snippet, originals)))
+    return total, results
+
+
+def _snippet_sources(connection, file_id, columns):
+    """Original texts a snippet may come from; comments and content are only read if needed"""
+    yield from columns
+    yield '\n'.join(row[0] for row in connection.exec_driver_sql(
+        "SELECT content FROM comment WHERE file_id = ? ORDER BY id", (file_id,)))
+    row = connection.exec_driver_sql("SELECT text FROM file_content WHERE file_id = ?", (file_id,)).first()
+    yield row[0] if row else None
@@ -0,0 +1,180 @@
+"""Synthetic data at production scale, for load tests (flask docuvault generate-data).
+
+Generator plans departments, users and documents from a seeded random
+source, so the same options always give the same database:
+  * department sizes are skewed (a few large departments, a long tail),
+  * most documents have one version; chains follow a geometric tail up to
+    max_versions, each version uploaded some days after the previous one,
+  * comment counts are heavy-tailed: most files have none, a few have
+    hundreds,
+  * file types and sizes follow what a document archive holds (mostly
+    PDFs and office files, log-normal sizes per type).
+The app writes the plans with bulk statements (see generate_batch in app.py).
+
+File bodies are placeholders: a pool of sparse files in the blob store,
+shared by many File rows, so a million rows take no disk space worth
+mentioning. Their digests are not the SHA-256 of their content, which is
+all zeros; previews and downloads work, content extraction does not.
+"""
+import hashlib
+import math
+import os
+import random
+from datetime import datetime, timedelta
+
+# file type: (weight, median size in bytes, log-normal sigma)
+FILE_TYPES = {
+    'pdf': (45, 400_000, 1.2),
+    'docx': (18, 80_000, 1.0),
+    'xlsx': (14, 60_000, 1.0),
+    'jpg': (12, 1_500_000, 0.6),
+    'png': (6, 500_000, 0.8),
+    'mp4': (5, 25_000_000, 1.0),
+}
+MAX_FILE_SIZE = 50 * 1024 * 1024
+CATEGORIES = ('Rapor', 'Sözleşme', 'Fatura', 'Sunum', 'Tasarım', 'Yazışma', 'Teklif', 'Genel')
+TITLE_WORDS = ('Aylık', 'Yıllık', 'Bütçe', 'Kampanya', 'Proje', 'Tedarik', 'Personel', 'Satış', 'Denetim',
+               'Müşteri', 'Bayi', 'Ürün', 'Lansman', 'Envanter', 'Planlama', 'Özet', 'Taslak', 'Nihai')
+COMMENT_TEXTS = ('Kontrol ettim, uygun.', 'Rakamlar güncellenmeli.', 'Son sayfadaki tablo eksik.',
+                 'Müşteriye gönderilebilir.', 'Lütfen imzalı halini yükleyin.', 'Revizyon gerekli.',
+                 'Onay için bekliyoruz.', 'Format kurallara uymuyor.', 'Teşekkürler, not alındı.')
+# Status of a document's current version; older versions were all reviewed
+CURRENT_STATUSES = (('approved', 60), ('pending', 25), ('rejected', 15))
+OLD_STATUSES = (('approved', 70), ('rejected', 30))
+
+
+def placeholder_digest(index, seed):
+    """Digest of the index-th placeholder blob (64 hex characters, like a real one)"""
+    return hashlib.sha256(f'docuvault-synthetic-{seed}-{index}'.encode()).hexdigest()
+
+
+def write_placeholder(path, size):
+    """A sparse file of size zero bytes at path; returns False when it already exists"""
+    if os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as handle:
+        handle.truncate(size)
+    return True
+
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+
+class Generator:
+    """Seeded plans of synthetic rows; indexes refer to the lists departments() and users() return"""
+
+    def __init__(self, seed=1, departments=50, users=5000, admins=5, blobs=2000, days=730,
+                 max_versions=20, comments_per_file=1.5):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.department_count = departments
+        self.user_count = users
+        self.admin_count = admins
+        self.blob_count = blobs
+        self.days = days
+        self.max_versions = max_versions
+        self.comments_per_file = comments_per_file
+        # Zipf-like department sizes: department i gets a share proportional to 1/(i+1)
+        self.department_weights = [1 / (i + 1) for i in range(departments)]
+        self.members = [[] for _ in range(departments)]
+        self.now = datetime.utcnow()
+        self.started = self.now - timedelta(days=days)
+
+    def departments(self):
+        return [{'name': f'Departman {i + 1:03d}', 'description': 'Sentetik yük testi departmanı'}
+                for i in range(self.department_count)]
+
+    def users(self, password_hash):
+        """Admins first (department 0), then department users spread over the skewed departments"""
+        rows = []
+        for i in range(self.admin_count):
+            rows.append({'username': f'synthetic-admin-{i + 1}', 'email': f'admin{i + 1}@synthetic.local',
+                         'password_hash': password_hash, 'role': 'admin', 'department': 0})
+        departments = self.rng.choices(range(self.department_count), self.department_weights, k=self.user_count)
+        # Every department has at least one member to upload its files
+        departments[:self.department_count] = range(min(self.department_count, self.user_count))
+        for i, department in enumerate(departments):
+            self.members[department].append(len(rows))
+            rows.append({'username': f'synthetic-user-{i + 1:05d}', 'email': f'user{i + 1:05d}@synthetic.local',
+                         'password_hash': password_hash, 'role': 'department', 'department': department})
+        return rows
+
+    def blobs(self):
+        """The placeholder pool: dicts with digest, size and file_type"""
+        types = list(FILE_TYPES)
+        weights = [FILE_TYPES[file_type][0] for file_type in types]
+        pool = []
+        for i in range(self.blob_count):
+            file_type = self.rng.choices(types, weights)[0]
+            _, median, sigma = FILE_TYPES[file_type]
+            size = min(MAX_FILE_SIZE, max(1024, int(self.rng.lognormvariate(math.log(median), sigma))))
+            pool.append({'digest': placeholder_digest(i, self.seed), 'size': size, 'file_type': file_type})
+        return pool
+
+    def version_count(self):
+        # Every extra version is 45% as likely as the one before (mean ~1.8), capped at max_versions
+        count = 1
+        while count < self.max_versions and self.rng.random() < 0.45:
+            count += 1
+        return count
+
+    def comment_count(self):
+        # 60% of files have no comments; the rest follow a Pareto tail with the requested overall mean
+        if self.comments_per_file <= 0 or self.rng.random() < 0.6:
+            return 0
+        alpha = 1.5
+        scale = self.comments_per_file / 0.4 * (alpha - 1) / alpha
+        return min(int(scale * self.rng.paretovariate(alpha)), 2000)
+
+    def documents(self, file_count, pool):
+        """Plans of documents until file_count File rows are planned.
+
+        A plan is a dict with the document's department index and its versions,
+        oldest first; each version holds File columns (uploader as a user
+        index, blob from pool) and its comments as (user index, created_at, text).
+        """
+        planned = 0
+        admins = range(self.admin_count)
+        span = self.days * 86400
+        while planned < file_count:
+            department = self.rng.choices(range(self.department_count), self.department_weights)[0]
+            members = self.members[department]
+            versions = min(self.version_count(), file_count - planned)
+            uploaded_at = self.started + timedelta(seconds=self.rng.uniform(0, span * 0.9))
+            title = ' '.join(self.rng.sample(TITLE_WORDS, 3))
+            category = self.rng.choice(CATEGORIES)
+            plan = []
+            for number in range(1, versions + 1):
+                blob = self.rng.choice(pool)
+                current = number == versions
+                status = _weighted(self.rng, CURRENT_STATUSES if current else OLD_STATUSES)
+                reviewed_at = min(self.now, uploaded_at + timedelta(hours=self.rng.uniform(1, 72))) \
+                    if status != 'pending' else None
+                comments = []
+                for _ in range(self.comment_count()):
+                    author = self.rng.choice(members) if self.rng.random() < 0.7 else self.rng.choice(admins)
+                    created_at = min(self.now, uploaded_at + timedelta(minutes=self.rng.uniform(1, 20000)))
+                    comments.append((author, created_at, self.rng.choice(COMMENT_TEXTS)))
+                plan.append({
+                    'title': f'{title} v{number}' if number > 1 else title,
+                    'description': f'{category} belgesi ({title.lower()})',
+                    'original_filename': f"{title.lower().replace(' ', '_')}.{blob['file_type']}",
+                    'file_type': blob['file_type'],
+                    'file_size': blob['size'],
+                    'blob_hash': blob['digest'],
+                    'category': category,
+                    'status': status,
+                    'uploader': self.rng.choice(members),
+                    'reviewer': self.rng.choice(admins) if reviewed_at else None,
+                    'uploaded_at': uploaded_at,
+                    'reviewed_at': reviewed_at,
+                    'version_number': number,
+                    'revision_notes': f'Revizyon {number}' if number > 1 else None,
+                    'comments': comments,
+                })
+                uploaded_at = min(self.now, uploaded_at + timedelta(days=self.rng.expovariate(1 / 7)))
+            planned += versions
+            yield {'department': department, 'versions': plan}
@@ -0,0 +1,90 @@
+"""Shared fixtures: the app on a throwaway database and blob store.
+
+The environment is set before app is imported, so the tests never touch
+instance/docuvault.db or the uploads folder of the checkout.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKDIR = tempfile.mkdtemp(prefix='docuvault-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'test.db')
+os.environ['BLOB_FOLDER'] = os.path.join(WORKDIR, 'uploads')
+os.chdir(WORKDIR)
+
+import app as docuvault  # noqa: E402
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def dv():
+    """The app module, with its schema created"""
+    with docuvault.app.app_context():
+        docuvault.upgrade_schema()
+    return docuvault
+
+
+@pytest.fixture
+def ctx(dv):
+    with dv.app.app_context():
+        yield
+
+
+@pytest.fixture
+def make_user(dv):
+    """make_user(role='department', department_id=None) -> user id, in a new department by default"""
+    def make(role='department', department_id=None):
+        with dv.app.app_context():
+            if department_id is None:
+                department = dv.Department(name=f'Departman {next(_names)}')
+                dv.db.session.add(department)
+                dv.db.session.flush()
+                department_id = department.id
+            n = next(_names)
+            user = dv.User(username=f'user{n}', email=f'user{n}@test.local', role=role,
+                           department_id=department_id)
+            dv.db.session.add(user)
+            dv.db.session.commit()
+            return user.id
+    return make
+
+
+@pytest.fixture
+def make_file(dv):
+    """make_file(user_id, **columns) -> file id of a single-version document"""
+    def make(user_id, **columns):
+        with dv.app.app_context():
+            user = dv.db.session.get(dv.User, user_id)
+            document = dv.Document()
+            dv.db.session.add(document)
+            dv.db.session.flush()
+            n = next(_names)
+            values = dict(title=f'Rapor {n}', filename=f'{n}_rapor.pdf', original_filename='rapor.pdf',
+                          file_type='pdf', file_size=1024, uploaded_by=user_id,
+                          department_id=user.department_id, document_id=document.id)
+            values.update(columns)
+            file = dv.File(**values)
+            dv.db.session.add(file)
+            dv.db.session.flush()
+            document.current_version_id = file.id
+            dv.db.session.commit()
+            return file.id
+    return make
+
+
+@pytest.fixture
+def login(dv):
+    """login(user_id) -> a test client with user_id signed in"""
+    def client_for(user_id):
+        client = dv.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return client_for
@@ -0,0 +1,146 @@
+import pytest
+
+
+@pytest.fixture
+def admin(make_user, login):
+    user_id = make_user(role='admin')
+    return user_id, login(user_id)
+
+
+def revalidate(client, url, tag):
+    return client.get(url, headers={'If-None-Match': tag})
+
+
+def test_list_answers_304_until_a_file_changes(dv, admin, make_file):
+    user_id, client = admin
+    make_file(user_id)
+    first = client.get('/api/v1/files')
+    assert first.status_code == 200
+    tag = first.headers['ETag']
+    assert tag.startswith('W/')
+
+    again = revalidate(client, '/api/v1/files', tag)
+    assert again.status_code == 304 and again.get_data() == b''
+
+    file_id = make_file(user_id)
+    changed = revalidate(client, '/api/v1/files', tag)
+    assert changed.status_code == 200
+    assert changed.get_json()['items'][0]['id'] == file_id
+
+    with dv.app.app_context():
+        file = dv.db.session.get(dv.File, file_id)
+        file.status, file.reviewed_at = 'approved', dv.datetime.utcnow()
+        dv.db.session.commit()
+    assert revalidate(client, '/api/v1/files', changed.headers['ETag']).status_code == 200
+
+
+def test_tag_depends_on_the_query_string(admin, make_file):
+    user_id, client = admin
+    make_file(user_id)
+    tag = client.get('/api/v1/files?fields=id').headers['ETag']
+    assert revalidate(client, '/api/v1/files?fields=id', tag).status_code == 304
+    assert revalidate(client, '/api/v1/files?fields=id,title', tag).status_code == 200
+
+
+def test_department_rename_changes_the_tag(dv, admin, make_file):
+    user_id, client = admin
+    file_id = make_file(user_id)
+    url = '/api/v1/files?fields=id,department'
+    tag = client.get(url).headers['ETag']
+    # Without the department field the rename does not matter
+    narrow_tag = client.get('/api/v1/files?fields=id').headers['ETag']
+
+    with dv.app.app_context():
+        department = dv.db.session.get(dv.File, file_id).department
+        department.name = department.name + ' (yeni)'
+        dv.db.session.commit()
+        new_name = department.name
+
+    response = revalidate(client, url, tag)
+    assert response.status_code == 200
+    assert {'id': file_id, 'department': new_name} in response.get_json()['items']
+    assert revalidate(client, '/api/v1/files?fields=id', narrow_tag).status_code == 304
+
+
+def test_migrated_blob_changes_the_download_url_tag(dv, admin, make_file):
+    user_id, client = admin
+    file_id = make_file(user_id, filename='eski-dosya.pdf')
+    url = '/api/v1/files?fields=id,download_url'
+    response = client.get(url)
+    old_url = next(item['download_url'] for item in response.get_json()['items'] if item['id'] == file_id)
+
+    with dv.app.app_context():
+        digest = 'c' * 64
+        dv.db.session.add(dv.Blob(hash=digest, size=1024, ref_count=1))
+        dv.db.session.get(dv.File, file_id).blob_hash = digest
+        dv.db.session.commit()
+
+    response = revalidate(client, url, response.headers['ETag'])
+    assert response.status_code == 200
+    new_url = next(item['download_url'] for item in response.get_json()['items'] if item['id'] == file_id)
+    assert new_url != old_url
+
+
+def test_single_file_is_tagged_by_its_body(admin, make_file):
+    user_id, client = admin
+    file_id = make_file(user_id)
+    response = client.get(f'/api/v1/files/{file_id}')
+    assert response.status_code == 200
+    assert revalidate(client, f'/api/v1/files/{file_id}', response.headers['ETag']).status_code == 304
+
+
+def test_unknown_field_is_a_400(admin):
+    _, client = admin
+    response = client.get('/api/v1/files?fields=id,secret')
+    assert response.status_code == 400
+    assert 'secret' in response.get_json()['error']
+
+
+def test_other_users_files_are_hidden(dv, make_user, make_file, login):
+    owner = make_user()
+    stranger = make_user()
+    file_id = make_file(owner)
+    client = login(stranger)
+    assert client.get(f'/api/v1/files/{file_id}').status_code == 403
+    assert file_id not in [item['id'] for item in client.get('/api/v1/files').get_json()['items']]
+
+
+def test_search_tag_moves_with_comments_and_extracted_text(dv, admin, make_file):
+    user_id, client = admin
+    file_id = make_file(user_id, title='Çeyrek raporu')
+    url = '/api/v1/files?search=zeytinyağı&fields=id'
+    response = client.get(url)
+    assert response.get_json()['items'] == []
+
+    client.post(f'/file/{file_id}/comment', data={'content': 'Zeytinyağı fiyatları eklendi'})
+    response = revalidate(client, url, response.headers['ETag'])
+    assert response.status_code == 200
+    assert response.get_json()['items'] == [{'id': file_id}]
+
+    other_id = make_file(user_id, title='Tedarikçi listesi')
+    tag = client.get(url).headers['ETag']
+    with dv.app.app_context():
+        dv.save_file_content(other_id, 'zeytinyağı tedarikçileri')
+        dv.db.session.commit()
+    response = revalidate(client, url, tag)
+    assert response.status_code == 200
+    assert {'id': other_id} in response.get_json()['items']
+
+
+def test_department_edits_change_the_departments_tag(dv, admin):
+    _, client = admin
+    with dv.app.app_context():
+        department = dv.Department(name='Etiket Testi')
+        dv.db.session.add(department)
+        dv.db.session.commit()
+        department_id = department.id
+    tag = client.get('/api/v1/departments').headers['ETag']
+    assert revalidate(client, '/api/v1/departments', tag).status_code == 304
+
+    with dv.app.app_context():
+        dv.db.session.get(dv.Department, department_id).description = 'Yeni açıklama'
+        dv.db.session.commit()
+    response = revalidate(client, '/api/v1/departments', tag)
+    assert response.status_code == 200
+    assert {'id': department_id, 'name': 'Etiket Testi', 'description': 'Yeni açıklama'} in \
+        response.get_json()['items']
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import os
+
+from blobstore import BlobStore
+
+BODY = b'Toplanti notlari\n' * 100
+DIGEST = hashlib.sha256(BODY).hexdigest()
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path))
+    assert store.ingest(io.BytesIO(BODY), chunk_size=100) == (DIGEST, len(BODY), True)
+    assert store.ingest(io.BytesIO(BODY)) == (DIGEST, len(BODY), False)
+    assert store.path(DIGEST) == os.path.join(str(tmp_path), DIGEST[:2], DIGEST[2:4], DIGEST)
+    assert list(store.iter_digests()) == [DIGEST]
+    assert os.listdir(store.temp_dir) == []
+
+
+def test_aborted_writer_leaves_nothing(tmp_path):
+    store = BlobStore(str(tmp_path))
+    with store.writer() as writer:
+        writer.write(BODY)
+    assert not writer.committed
+    assert os.listdir(store.temp_dir) == []
+    assert list(store.iter_digests()) == []
+
+
+def test_adopt_moves_in_place(tmp_path):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    for name in ('a.txt', 'b.txt'):
+        (tmp_path / name).write_bytes(BODY)
+    assert store.adopt(str(tmp_path / 'a.txt')) == (DIGEST, len(BODY), True)
+    # Already stored: the duplicate is removed so its size counts as saved
+    assert store.adopt(str(tmp_path / 'b.txt')) == (DIGEST, len(BODY), False)
+    assert not (tmp_path / 'a.txt').exists() and not (tmp_path / 'b.txt').exists()
+
+
+def test_delete_removes_empty_fan_out_directories(tmp_path):
+    store = BlobStore(str(tmp_path))
+    store.ingest(io.BytesIO(BODY))
+    assert store.delete(DIGEST)
+    assert not os.path.exists(os.path.join(str(tmp_path), DIGEST[:2]))
+    assert not store.delete(DIGEST)
+
+
+def upload(client, name, body):
+    return client.post('/upload', data={'title': name, 'description': '', 'category': 'Genel',
+                                        'file': (io.BytesIO(body), name)}, content_type='multipart/form-data')
+
+
+def blob_row(dv, digest):
+    with dv.app.app_context():
+        blob = dv.db.session.get(dv.Blob, digest)
+        return blob and (blob.ref_count, blob.size)
+
+
+def test_uploads_count_references(dv, make_user, login):
+    body = b'ortak icerik ' * 50
+    digest = hashlib.sha256(body).hexdigest()
+    client = login(make_user())
+    assert upload(client, 'ilk.txt', body).status_code == 302
+    assert upload(client, 'ikinci.txt', body).status_code == 302
+    assert blob_row(dv, digest) == (2, len(body))
+    assert dv.blob_store.exists(digest)
+
+    with dv.app.app_context():
+        files = dv.File.query.filter_by(blob_hash=digest).all()
+        assert sorted(file.original_filename for file in files) == ['ikinci.txt', 'ilk.txt']
+        other = hashlib.sha256(b'baska').hexdigest()
+        dv.db.session.add(dv.Blob(hash=other, size=5, ref_count=0))
+        files[0].blob_hash = other
+        dv.db.session.commit()
+        dv.db.session.delete(files[1])
+        dv.db.session.commit()
+    assert blob_row(dv, digest) == (0, len(body))
+    assert blob_row(dv, other) == (1, 5)
+
+
+def test_gc_keeps_referenced_blobs_and_heals_counts(dv, make_user, login):
+    body = b'gc icin icerik ' * 50
+    digest = hashlib.sha256(body).hexdigest()
+    client = login(make_user())
+    upload(client, 'gc.txt', body)
+    with dv.app.app_context():
+        dv.db.session.get(dv.Blob, digest).ref_count = 7
+        dv.db.session.commit()
+
+    result = dv.app.test_cli_runner().invoke(args=['docuvault', 'gc-blobs'])
+    assert result.exit_code == 0, result.output
+    assert blob_row(dv, digest) == (1, len(body))
+    assert dv.blob_store.exists(digest)
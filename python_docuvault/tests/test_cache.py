@@ -0,0 +1,128 @@
+import io
+
+import cache
+
+
+class Source:
+    """compute() for Cache.get that counts its calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'value': self.calls}
+
+
+def test_hit_until_a_tag_is_invalidated():
+    values = cache.Cache(cache.LocalBackend())
+    compute = Source()
+    assert values.get('stats', 1, ['files', 'files:user:1'], compute) == {'value': 1}
+    assert values.get('stats', 1, ['files:user:1', 'files'], compute) == {'value': 1}
+    values.invalidate(['files:user:2'])
+    assert values.get('stats', 1, ['files', 'files:user:1'], compute) == {'value': 1}
+    values.invalidate(['files:user:1'])
+    assert values.get('stats', 1, ['files', 'files:user:1'], compute) == {'value': 2}
+    assert values.stats()['events'][('stats', 'hits')] == 2
+
+
+def test_values_are_copies():
+    values = cache.Cache(cache.LocalBackend())
+    values.get('list', None, ['files'], lambda: [1, 2]).append(3)
+    assert values.get('list', None, ['files'], lambda: None) == [1, 2]
+
+
+def test_disabled_cache_always_computes():
+    values = cache.Cache(None)
+    compute = Source()
+    values.get('stats', 1, ['files'], compute)
+    values.get('stats', 1, ['files'], compute)
+    assert compute.calls == 2
+
+
+def test_lru_is_bounded_in_bytes():
+    lru = cache.LRU(max_bytes=3 * (cache.ENTRY_OVERHEAD + 12))
+    for key in ('a', 'b', 'c'):
+        lru.set(key, b'x' * 11, ttl=60)
+    lru.get('a')
+    lru.set('d', b'x' * 11, ttl=60)
+    assert [key for key in ('a', 'b', 'c', 'd') if lru.get(key)] == ['a', 'c', 'd']
+    assert lru.evicted == 1
+    lru.set('huge', b'x' * 1000, ttl=60)
+    assert lru.get('huge') is None
+
+
+def test_expired_entries_are_not_served(monkeypatch):
+    lru = cache.LRU(max_bytes=10_000)
+    lru.set('a', b'x', ttl=10)
+    now = cache.time.monotonic()
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now + 11)
+    assert lru.get('a') is None and lru.size == 0
+
+
+def test_database_backend_rereads_generations_after_interval(monkeypatch):
+    table = {}
+    fetched = []
+
+    def fetch(tags):
+        fetched.append(list(tags))
+        return {tag: table[tag] for tag in tags if tag in table}
+
+    def bump(tags):
+        for tag in tags:
+            table[tag] = table.get(tag, 0) + 1
+
+    backend = cache.DatabaseBackend(fetch, bump, interval=5)
+    now = cache.time.monotonic()
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now)
+    assert backend.generations_of(['files']) == [0]
+    # Another process bumps the tag: seen once the interval has passed
+    table['files'] = 3
+    assert backend.generations_of(['files']) == [0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now + 6)
+    assert backend.generations_of(['files']) == [3]
+    # Own bumps are seen at once
+    backend.bump(['files'])
+    assert backend.generations_of(['files']) == [4]
+    assert fetched == [['files'], ['files'], ['files']]
+
+
+def test_backend_errors_fall_back_to_computing():
+    class Broken(cache.LocalBackend):
+        def generations_of(self, tags):
+            raise ConnectionError('down')
+
+    values = cache.Cache(Broken())
+    compute = Source()
+    assert values.get('stats', 1, ['files'], compute) == {'value': 1}
+    assert values.get('stats', 1, ['files'], compute) == {'value': 2}
+
+
+def test_upload_and_review_invalidate_cached_stats(dv, make_user, login):
+    user_id = make_user()
+    admin_id = make_user(role='admin')
+    client = login(user_id)
+
+    def stats():
+        with dv.app.app_context():
+            return dv.cached_file_stats(uploaded_by=user_id)
+
+    assert stats()['total'] == 0
+    client.post('/upload', data={'title': 'Bütçe', 'description': '', 'category': 'Rapor',
+                                 'file': (io.BytesIO(b'butce tablosu'), 'butce.txt')},
+                content_type='multipart/form-data')
+    assert stats()['total'] == 1
+    assert stats()['status']['pending'] == 1
+
+    with dv.app.app_context():
+        file_id = dv.File.query.filter_by(uploaded_by=user_id).one().id
+    response = login(admin_id).post(f'/file/{file_id}/approve')
+    assert response.status_code in (200, 302)
+    assert (stats()['status']['pending'], stats()['status']['approved']) == (0, 1)
+
+
+def test_department_changes_invalidate_the_menu(dv, ctx):
+    names = {department['name'] for department in dv.cached_departments()}
+    dv.db.session.add(dv.Department(name='Önbellek Testi'))
+    dv.db.session.commit()
+    assert {department['name'] for department in dv.cached_departments()} - names == {'Önbellek Testi'}
@@ -0,0 +1,106 @@
+import io
+from datetime import datetime
+
+import pytest
+from flask import Flask, request
+
+import delivery
+
+BODY = bytes(range(256)) * 40  # 10240 bytes
+MODIFIED = datetime(2024, 3, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'body.bin'
+    path.write_bytes(BODY)
+    return str(path)
+
+
+@pytest.fixture
+def send(path):
+    app = Flask(__name__)
+
+    def send(headers=None, **kwargs):
+        with app.test_request_context(headers=headers or {}):
+            response = delivery.send_stored_file(request, path, 'application/pdf', 'abc123',
+                                                 last_modified=MODIFIED, **kwargs)
+            response.direct_passthrough = False
+            return response.status_code, response.headers, response.get_data()
+    return send
+
+
+def test_full_response(send):
+    status, headers, body = send()
+    assert status == 200 and body == BODY
+    assert headers['ETag'] == '"abc123"'
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert headers['Last-Modified'] == 'Fri, 01 Mar 2024 12:00:00 GMT'
+    assert headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_conditional_get(send):
+    assert send({'If-None-Match': '"abc123"'})[0] == 304
+    assert send({'If-None-Match': '"other"'})[0] == 200
+    assert send({'If-Modified-Since': 'Fri, 01 Mar 2024 12:00:00 GMT'})[0] == 304
+    # If-None-Match wins over If-Modified-Since
+    assert send({'If-None-Match': '"other"', 'If-Modified-Since': 'Fri, 01 Mar 2024 12:00:00 GMT'})[0] == 200
+
+
+@pytest.mark.parametrize('header, start, stop', [
+    ('bytes=0-99', 0, 100),
+    ('bytes=10000-', 10000, 10240),
+    ('bytes=-40', 10200, 10240),
+    ('bytes=10200-99999', 10200, 10240),
+])
+def test_single_range(send, header, start, stop):
+    status, headers, body = send({'Range': header})
+    assert status == 206
+    assert body == BODY[start:stop]
+    assert headers['Content-Range'] == f'bytes {start}-{stop - 1}/{len(BODY)}'
+    assert headers['Content-Length'] == str(stop - start)
+
+
+def test_unsatisfiable_range(send):
+    status, headers, _ = send({'Range': 'bytes=20000-'})
+    assert status == 416
+    assert headers['Content-Range'] == f'bytes */{len(BODY)}'
+
+
+def test_multiple_ranges(send):
+    status, headers, body = send({'Range': 'bytes=0-9,100-109'})
+    assert status == 206
+    assert headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+    assert BODY[0:10] in body and BODY[100:110] in body
+    assert b'Content-Range: bytes 100-109/10240' in body
+
+
+def test_if_range(send):
+    assert send({'Range': 'bytes=0-9', 'If-Range': '"abc123"'})[0] == 206
+    # The client's copy is outdated: the whole body instead of a range
+    assert send({'Range': 'bytes=0-9', 'If-Range': '"old"'})[0] == 200
+    assert send({'Range': 'bytes=0-9', 'If-Range': 'Thu, 29 Feb 2024 00:00:00 GMT'})[0] == 200
+
+
+def test_cache_control_and_disposition(send):
+    _, headers, _ = send(max_age=60, immutable=True, public=True, disposition='attachment',
+                         download_name='sözleşme.pdf')
+    assert headers['Cache-Control'] == 'public, max-age=60, immutable'
+    assert headers['Content-Disposition'].startswith('attachment;')
+    assert "filename*=UTF-8''s%C3%B6zle%C5%9Fme.pdf" in headers['Content-Disposition']
+
+
+def test_preview_route_serves_ranges(dv, make_user, login):
+    client = login(make_user())
+    body = b'onizleme satiri\n' * 500
+    client.post('/upload', data={'title': 'Önizleme', 'description': '', 'category': 'Genel',
+                                 'file': (io.BytesIO(body), 'onizleme.txt')}, content_type='multipart/form-data')
+    with dv.app.app_context():
+        file = dv.File.query.filter_by(original_filename='onizleme.txt').one()
+        file_id, digest = file.id, file.blob_hash
+
+    response = client.get(f'/file/{file_id}/preview', headers={'Range': 'bytes=16-31'})
+    assert response.status_code == 206
+    assert response.get_data() == body[16:32]
+    assert response.headers['ETag'] == f'"{digest}"'
+    assert client.get(f'/file/{file_id}/preview', headers={'If-None-Match': f'"{digest}"'}).status_code == 304
@@ -0,0 +1,87 @@
+import hashlib
+import os
+
+import pytest
+
+import deltas
+
+BASE = b''.join(b'Madde %d: teslimat kosullari ve odeme plani\n' % i for i in range(3000))
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def rebuild(base, target):
+    """target rebuilt from the instructions diff() gives"""
+    out = bytearray()
+    for instruction in deltas.diff(base, target):
+        if instruction[0] == 'C':
+            out += base[instruction[1]:instruction[1] + instruction[2]]
+        else:
+            out += instruction[1]
+    return bytes(out)
+
+
+@pytest.mark.parametrize('target', [
+    BASE,
+    b'',
+    BASE.replace(b'Madde 1500:', b'Madde 1500 (revize):'),
+    b'Yeni giris\n' + BASE[:40000] + BASE[50000:] + b'son satir, satir sonu yok',
+    b'x' * (deltas.MAX_CHUNK * 3 + 5),
+])
+def test_diff_rebuilds_the_target(target):
+    assert rebuild(BASE, target) == target
+
+
+@pytest.fixture
+def files(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+    return write
+
+
+def test_store_and_rebuild(tmp_path, files):
+    store = deltas.DeltaStore(str(tmp_path / 'delta'))
+    # The old version is the target: it is rebuilt from the newer one
+    old = BASE.replace(b'Madde 10:', b'Madde 10 (eski):')
+    digest = sha256(old)
+    stored_size = store.store(digest, files('old', old), sha256(BASE), files('new', BASE))
+    assert stored_size < len(old) * 0.05
+    assert store.exists(digest)
+    assert store.base_of(digest) == sha256(BASE)
+    assert b''.join(store.iter_chunks(digest, str(tmp_path / 'new'), chunk_size=1000)) == old
+    assert list(store.iter_digests()) == [digest]
+    assert store.delete(digest)
+    assert list(store.iter_digests()) == []
+    assert not os.path.exists(os.path.dirname(store.path(digest)))
+
+
+def test_unrelated_versions_are_not_stored(tmp_path, files):
+    store = deltas.DeltaStore(str(tmp_path / 'delta'))
+    other = os.urandom(50_000)
+    assert store.store(sha256(other), files('old', other), sha256(BASE), files('new', BASE)) is None
+    assert not store.exists(sha256(other))
+
+
+def test_versions_over_max_size_stay_in_full(tmp_path, files):
+    store = deltas.DeltaStore(str(tmp_path / 'delta'), max_size=len(BASE) - 1)
+    old = BASE + b'ek\n'
+    assert store.store(sha256(old), files('old', old), sha256(BASE), files('new', BASE)) is None
+    assert list(store.iter_digests()) == []
+
+
+def test_store_checks_the_digest(tmp_path, files):
+    store = deltas.DeltaStore(str(tmp_path / 'delta'))
+    old = BASE + b'ek\n'
+    with pytest.raises(ValueError):
+        store.store('0' * 64, files('old', old), sha256(BASE), files('new', BASE))
+    assert not store.exists('0' * 64)
+
+
+def test_corrupt_delta(tmp_path, files):
+    path = files('bad.delta', b'XXXX' + b'0' * 72)
+    with pytest.raises(ValueError):
+        list(deltas.patch(path, files('base', BASE)))
@@ -0,0 +1,36 @@
+import events
+
+
+def test_ids_committed_out_of_order_are_not_skipped():
+    dispatched = []
+    seen, gaps = set(), {}
+
+    def advance(position, ids, now):
+        return events.DatabaseBackend._advance(lambda event: dispatched.append(event['id']), position,
+                                               [{'id': event_id} for event_id in ids], seen, gaps, now)
+
+    # 11 is still being inserted when 12 commits
+    assert advance(10, [12], now=0) == 10 and dispatched == [12]
+    assert advance(10, [11, 12, 13], now=1) == 13 and dispatched == [12, 11, 13]
+    # 14 was rolled back: given up on after GAP_TIMEOUT
+    assert advance(13, [15], now=2) == 13
+    assert advance(13, [15], now=2 + events.GAP_TIMEOUT) == 15
+    assert dispatched == [12, 11, 13, 15]
+    assert not seen and not gaps
+
+
+def test_synchronous_workers_turn_streams_away(dv, make_user, login, monkeypatch):
+    client = login(make_user())
+    monkeypatch.setitem(dv.app.config, 'EVENT_STREAM_SYNC_SECONDS', 0)
+    assert client.get('/events').status_code == 204
+    page = client.get('/department/dashboard').get_data(as_text=True)
+    assert 'EventSource(' not in page
+
+    monkeypatch.setitem(dv.app.config, 'EVENTS_URL', 'https://events.example.com/events')
+    monkeypatch.setitem(dv.app.config, 'EVENTS_ALLOWED_ORIGINS', ['https://docuvault.example.com'])
+    page = client.get('/department/dashboard').get_data(as_text=True)
+    assert 'new EventSource("https://events.example.com/events?last_event_id=' in page
+    response = client.get('/events', headers={'Origin': 'https://docuvault.example.com'})
+    assert response.headers['Access-Control-Allow-Origin'] == 'https://docuvault.example.com'
+    assert response.headers['Access-Control-Allow-Credentials'] == 'true'
+    assert 'Access-Control-Allow-Origin' not in client.get('/events', headers={'Origin': 'https://evil.example'}).headers
@@ -0,0 +1,39 @@
+import hashlib
+import io
+import json
+
+
+def run_import(dv, source, mapping, checkpoint, username):
+    result = dv.app.test_cli_runner().invoke(args=[
+        'docuvault', 'import', str(source), '--user', username, '--mapping', str(mapping),
+        '--checkpoint', str(checkpoint), '--create-departments', '--workers', '2'])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_same_content_in_two_departments_is_imported_for_each(dv, make_user, login, tmp_path):
+    body = b'%PDF-1.4 ortak sozlesme sablonu'
+    digest = hashlib.sha256(body).hexdigest()
+    # An unrelated user uploaded the same content before
+    login(make_user()).post('/upload', data={'title': 'Şablon', 'description': '', 'category': 'Genel',
+                                             'file': (io.BytesIO(body), 'sablon.pdf')},
+                            content_type='multipart/form-data')
+    for folder in ('Hukuk', 'Satinalma'):
+        (tmp_path / 'arsiv' / folder).mkdir(parents=True)
+        (tmp_path / 'arsiv' / folder / 'sablon.pdf').write_bytes(body)
+    mapping = tmp_path / 'mapping.json'
+    mapping.write_text(json.dumps({'department': 'Arşiv İçe Aktarım', 'folders': {
+        'Hukuk': {'department': 'Hukuk İçe Aktarım'}, 'Satinalma': {'department': 'Satınalma İçe Aktarım'}}}))
+    with dv.app.app_context():
+        username = dv.db.session.get(dv.User, make_user(role='admin')).username
+
+    run_import(dv, tmp_path / 'arsiv', mapping, tmp_path / 'first.checkpoint', username)
+    # Without the checkpoint, the files already imported are recognised in the database
+    output = run_import(dv, tmp_path / 'arsiv', mapping, tmp_path / 'second.checkpoint', username)
+    assert '0 yeni, 2 zaten kayıtlı' in output
+
+    with dv.app.app_context():
+        imported = dv.File.query.filter(dv.File.description.in_(['Hukuk/sablon.pdf', 'Satinalma/sablon.pdf'])).all()
+        assert sorted(file.department.name for file in imported) == ['Hukuk İçe Aktarım', 'Satınalma İçe Aktarım']
+        assert {file.blob_hash for file in imported} == {digest}
+        assert dv.db.session.get(dv.Blob, digest).ref_count == 3
@@ -0,0 +1,88 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+import ingest
+from blobstore import BlobStore
+
+BODY = b'%PDF-1.4 devam eden yukleme\n' * 200
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path))
+
+
+def append(store, session_id, offset, body, limit=len(BODY)):
+    with ingest.locked_session(store, session_id) as f:
+        return ingest.append_chunk(f, session_id, offset, offset, io.BytesIO(body), limit)
+
+
+def test_chunks_are_hashed_once_and_adopted(store):
+    ingest.create_session(store, 'a')
+    assert append(store, 'a', 0, BODY[:1000]) == 1000
+    assert append(store, 'a', 1000, BODY[1000:]) == len(BODY)
+    with ingest.locked_session(store, 'a') as f:
+        assert ingest.read_head(f) == BODY[:64]
+        assert ingest.finish_session(store, f, 'a', len(BODY)) == (hashlib.sha256(BODY).hexdigest(), len(BODY))
+    with pytest.raises(FileNotFoundError):
+        ingest.locked_session(store, 'a').__enter__()
+
+
+def test_running_hash_of_rewritten_file_is_not_reused(store):
+    ingest.create_session(store, 'b')
+    append(store, 'b', 0, BODY)
+    # Another process rewrites the same offset range later on
+    other = bytes(reversed(BODY))
+    saved = dict(ingest._running_hashes)
+    append(store, 'b', 0, other)
+    os.utime(ingest.session_path(store, 'b'), ns=(1, 1))
+    ingest._running_hashes.update(saved)
+    with ingest.locked_session(store, 'b') as f:
+        digest, _ = ingest.finish_session(store, f, 'b', len(other))
+    assert digest == hashlib.sha256(other).hexdigest()
+    with open(store.path(digest), 'rb') as f:
+        assert f.read() == other
+
+
+def test_overlapping_appends_are_serialised(store):
+    ingest.create_session(store, 'c')
+    entered = threading.Event()
+    order = []
+
+    def second():
+        entered.wait(5)
+        with ingest.locked_session(store, 'c'):
+            order.append('second')
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    with ingest.locked_session(store, 'c'):
+        entered.set()
+        thread.join(0.2)
+        order.append('first')
+    thread.join(5)
+    assert order == ['first', 'second']
+
+
+def test_resumable_upload_route(dv, make_user, login):
+    client = login(make_user())
+    session = client.post('/upload/sessions', json={'filename': 'rapor.pdf', 'size': len(BODY)}).get_json()
+    url = f"/upload/sessions/{session['id']}"
+    assert client.patch(f'{url}?offset=0', data=BODY[:500]).get_json()['offset'] == 500
+    # A retry of the first chunk after it was committed
+    response = client.patch(f'{url}?offset=0', data=BODY[:500])
+    assert response.status_code == 409 and response.get_json()['offset'] == 500
+    assert client.post(f'{url}/complete', json={}).status_code == 409
+    assert client.patch(f'{url}?offset=500', data=BODY[500:]).get_json()['offset'] == len(BODY)
+
+    response = client.post(f'{url}/complete', json={'title': 'Rapor'})
+    assert response.status_code == 201
+    with dv.app.app_context():
+        file = dv.db.session.get(dv.File, response.get_json()['file_id'])
+        assert file.blob_hash == hashlib.sha256(BODY).hexdigest()
+    assert client.patch(f'{url}?offset={len(BODY)}', data=b'').status_code == 404
+    assert client.delete(url).status_code == 404
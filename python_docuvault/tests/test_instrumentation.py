@@ -0,0 +1,64 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+
+import instrumentation
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(directory, name, pid, value):
+    with open(os.path.join(directory, name), 'w') as f:
+        json.dump({'host': socket.gethostname(), 'pid': pid,
+                   'metrics': {'requests_total': [[['GET'], value]]}}, f)
+
+
+def registry(directory):
+    metrics = instrumentation.Registry(str(directory))
+    metrics.counter('requests_total', 'Requests', ('method',))
+    return metrics
+
+
+def test_snapshots_add_up_and_exited_ones_are_retired(tmp_path):
+    metrics = registry(tmp_path)
+    metrics.metrics['requests_total'].inc(method='GET')
+    # A live process and an exited one that had the same pid as this one
+    write_snapshot(tmp_path, 'live.json', os.getpid(), 10)
+    write_snapshot(tmp_path, 'old.json', exited_pid(), 100)
+    assert 'requests_total{method="GET"} 111' in metrics.render()
+
+    metrics.flush(force=True)
+    assert sorted(os.listdir(tmp_path)) == sorted(['live.json', 'retired.json', 'retired.lock',
+                                                   f'{metrics.snapshot_id}.json'])
+    assert 'requests_total{method="GET"} 111' in metrics.render()
+    # The next process has its own snapshot, even with a reused pid
+    assert registry(tmp_path).snapshot_id != metrics.snapshot_id
+
+
+def test_counter_function_is_part_of_the_snapshot(tmp_path):
+    metrics = instrumentation.Registry(str(tmp_path))
+    hits = {'value': 3}
+    metrics.counter_function('cache_hits_total', 'Hits', (), lambda: {(): hits['value']})
+    metrics.flush(force=True)
+    other = instrumentation.Registry(str(tmp_path))
+    other.counter_function('cache_hits_total', 'Hits', (), lambda: {(): 4})
+    assert '# TYPE cache_hits_total counter\ncache_hits_total 7' in other.render()
+
+
+def test_scrapes_reuse_database_gauges(dv, make_user, login, monkeypatch):
+    calls = []
+    storage_stats = dv.storage_stats
+    monkeypatch.setattr(dv, 'storage_stats', lambda: calls.append(1) or storage_stats())
+    monkeypatch.setitem(dv._scraped_stats, 'expires', 0.0)
+    client = login(make_user(role='admin'))
+    for _ in range(2):
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        assert 'docuvault_storage_bytes' in response.get_data(as_text=True)
+    assert len(calls) == 1
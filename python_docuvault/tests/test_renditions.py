@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+import pytest
+
+import renditions
+
+pytestmark = pytest.mark.skipif(renditions.Image is None, reason='Pillow is not installed')
+
+KEY = 'ab' * 32
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return renditions.RenditionCache(str(tmp_path / 'renditions'), max_bytes=10 * 1024 * 1024, pdftoppm='')
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'photo.png'
+    renditions.Image.new('RGBA', (2000, 1000), (200, 30, 30, 128)).save(path)
+    return str(path)
+
+
+def test_can_render(cache):
+    assert cache.can_render('PNG') and cache.can_render('jpg')
+    # No pdftoppm on this cache
+    assert not cache.can_render('pdf')
+    assert not cache.can_render('docx') and not cache.can_render(None)
+
+
+def test_thumbnail_is_rendered_once(cache, image):
+    path = cache.get(KEY, 'sm', image, 'png')
+    with renditions.Image.open(path) as thumbnail:
+        assert thumbnail.format == 'JPEG'
+        assert thumbnail.size == (160, 80)
+    assert cache.get(KEY, 'sm', image, 'png') == path
+    stats = cache.stats()
+    assert (stats['renders'], stats['misses'], stats['hits']) == (1, 1, 1)
+
+
+def test_broken_source_is_not_retried_at_once(cache, tmp_path):
+    broken = tmp_path / 'broken.png'
+    broken.write_bytes(b'not an image')
+    assert cache.get(KEY, 'md', str(broken), 'png') is None
+    assert cache.get(KEY, 'md', str(broken), 'png') is None
+    stats = cache.stats()
+    assert (stats['failed'], stats['misses']) == (1, 1)
+
+
+def test_concurrent_requests_share_one_render(cache, image, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    render = cache._render
+
+    def slow_render(*args):
+        started.set()
+        release.wait(5)
+        return render(*args)
+
+    monkeypatch.setattr(cache, '_render', slow_render)
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get(KEY, 'lg', image, 'png')))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(cache.get(KEY, 'lg', image, 'png')))
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()['waits'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert len(results) == 2 and results[0] == results[1] is not None
+    assert cache.stats()['renders'] == 1
+
+
+def test_least_recently_used_renditions_are_evicted(tmp_path, image):
+    cache = renditions.RenditionCache(str(tmp_path / 'renditions'), max_bytes=1, pdftoppm='')
+    first = cache.get('cd' * 32, 'sm', image, 'png')
+    second = cache.get(KEY, 'sm', image, 'png')
+    # Over the limit, only the rendition just rendered is kept
+    assert second is not None and not os.path.exists(first)
+    assert cache.stats()['evicted'] == 1
+
+
+def test_thumbnail_route(dv, make_user, make_file, login, image):
+    user_id = make_user()
+    with open(image, 'rb') as source, \
+            open(os.path.join(dv.app.config['UPLOAD_FOLDER'], 'fotoğraf.png'), 'wb') as target:
+        target.write(source.read())
+    file_id = make_file(user_id, filename='fotoğraf.png', original_filename='fotoğraf.png', file_type='png')
+    client = login(user_id)
+
+    response = client.get(f'/file/{file_id}/thumbnail/md')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert client.get(f'/file/{file_id}/thumbnail/md',
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get(f'/file/{file_id}/thumbnail/huge').status_code == 404
@@ -0,0 +1,24 @@
+def file_indexes(dv):
+    return {index['name'] for index in dv.db.inspect(dv.db.engine).get_indexes('file')}
+
+
+def test_upgrade_reports_repeated_filenames_and_finishes(dv, ctx, make_user, make_file, capsys):
+    user_id = make_user()
+    with dv.db.engine.begin() as connection:
+        connection.exec_driver_sql('DROP INDEX ux_file_filename')
+    first = make_file(user_id, filename='ortak.pdf')
+    second = make_file(user_id, filename='ortak.pdf')
+    # A file stored before documents were tracked
+    dv.db.session.execute(dv.db.update(dv.File).where(dv.File.id == second).values(document_id=None))
+    dv.db.session.commit()
+
+    dv.upgrade_schema()
+    assert 'ux_file_filename' in capsys.readouterr().out
+    assert 'ux_file_filename' not in file_indexes(dv)
+    # The steps after the unique index still ran
+    assert dv.db.session.get(dv.File, second).document_id is not None
+
+    dv.db.session.get(dv.File, first).filename = 'ortak-1.pdf'
+    dv.db.session.commit()
+    dv.upgrade_schema()
+    assert 'ux_file_filename' in file_indexes(dv)
@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import search
+
+
+def test_fold_keeps_length_and_matches_turkish_i():
+    for text in ('İSTANBUL', 'Istanbul', 'ıstanbul'):
+        assert search.fold(text).lower() == 'istanbul'
+        assert len(search.fold(text)) == len(text)
+    assert search.fold(None) == ''
+
+
+def test_build_match_query():
+    assert search.build_match_query('DOF rap') == '"DOF"* "rap"*'
+    assert search.build_match_query('İzmir "şube"') == '"izmir"* "şube"*'
+    assert search.build_match_query(' -*" ') is None
+
+
+def test_restore_snippet_maps_back_to_the_original():
+    original = 'Rapor: İSTANBUL <Şube> Irmak'
+    snippet = '…\x02iSTANBUL\x03 <Şube> \x02irmak\x03'
+    html = search.restore_snippet(snippet, [None, 'başka metin', original])
+    assert html == '…<mark>İSTANBUL</mark> &lt;Şube&gt; <mark>Irmak</mark>'
+
+
+def test_restore_snippet_without_a_matching_original_is_escaped():
+    assert search.restore_snippet('\x02a\x03 <b>', ['zzz']) == '<mark>a</mark> &lt;b&gt;'
+
+
+def test_search_ranks_and_highlights(dv, ctx, make_user, make_file):
+    user_id = make_user()
+    in_title = make_file(user_id, title='Zümrütkale İhale Dosyası')
+    in_description = make_file(user_id, title='Genel not', description='zümrütkale ihalesi için taslak')
+    total, hits = search.search(dv.db.session.connection(), 'ZÜMRÜTKALE ihale')
+    assert total == 2
+    assert [file_id for file_id, _, _ in hits] == [in_title, in_description]
+    assert '<mark>Zümrütkale</mark> <mark>İhale</mark>' in hits[0][2]
+
+
+def test_search_filters(dv, ctx, make_user, make_file):
+    user_id = make_user()
+    other_id = make_user()
+    january = make_file(user_id, title='Mercanada raporu', uploaded_at=datetime(2024, 1, 10, 12))
+    february = make_file(user_id, title='Mercanada raporu', uploaded_at=datetime(2024, 2, 10, 12))
+    make_file(other_id, title='Mercanada raporu', uploaded_at=datetime(2024, 1, 31, 23, 59), status='approved')
+    connection = dv.db.session.connection()
+
+    def ids(**kwargs):
+        return sorted(file_id for file_id, _, _ in search.search(connection, 'mercanada', **kwargs)[1])
+
+    assert len(ids()) == 3
+    assert ids(uploaded_by=user_id) == [january, february]
+    assert ids(uploaded_by=user_id, uploaded_since=datetime(2024, 2, 1)) == [february]
+    assert ids(uploaded_by=user_id, uploaded_before=datetime(2024, 2, 1)) == [january]
+    assert len(ids(filters={'status': 'approved'})) == 1
+
+
+def test_search_page_honours_the_date_filters(dv, make_user, make_file, login):
+    admin_id = make_user(role='admin')
+    make_file(admin_id, title='Lacivertkoy sozlesmesi', uploaded_at=datetime(2024, 1, 31, 23, 59))
+    make_file(admin_id, title='Lacivertkoy teklifi', uploaded_at=datetime(2024, 2, 1, 0, 1))
+    client = login(admin_id)
+
+    def titles(query):
+        results = client.get(f'/api/search?q=lacivertkoy&{query}').get_json()['results']
+        return sorted(result['title'] for result in results)
+
+    assert titles('') == ['Lacivertkoy sozlesmesi', 'Lacivertkoy teklifi']
+    # The to date is inclusive, as on the dashboard
+    assert titles('to=2024-01-31') == ['Lacivertkoy sozlesmesi']
+    assert titles('from=2024-02-01') == ['Lacivertkoy teklifi']
+    assert titles('from=2024-03-01') == []
@@ -0,0 +1,19 @@
+def generate(dv, *options):
+    return dv.app.test_cli_runner().invoke(args=[
+        'docuvault', 'generate-data', '--departments', '1', '--users', '1', '--admins', '1', '--files', '3',
+        '--blobs', '1', *options])
+
+
+def test_generated_users_need_a_password(dv):
+    result = generate(dv)
+    assert result.exit_code != 0
+    assert '--password' in result.output
+
+
+def test_refuses_a_database_that_is_in_use(dv, make_user):
+    make_user()
+    result = generate(dv, '--password', 'yukleme-testi')
+    assert result.exit_code != 0
+    assert '--force' in result.output
+    with dv.app.app_context():
+        assert dv.User.query.filter(dv.User.username.like('synthetic-%')).first() is None
@@ -0,0 +1,145 @@
+import hashlib
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import tiering
+from blobstore import DiskLRU
+
+TEXT = b''.join(b'Satir %d: aylik rapor, butce ve planlama\n' % i for i in range(5000))
+DIGEST = hashlib.sha256(TEXT).hexdigest()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'blob'
+    path.write_bytes(TEXT)
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return tiering.ColdStore(str(tmp_path / 'cold'), str(tmp_path / 'cache'), cache_bytes=10 * len(TEXT))
+
+
+@pytest.mark.parametrize('codec', ['xz', pytest.param('zst', marks=pytest.mark.skipif(
+    tiering.zstandard is None, reason='zstandard is not installed'))])
+def test_archive_and_restore(store, source, codec):
+    stored_size = store.archive(source, DIGEST, codec)
+    assert stored_size < len(TEXT) / 2
+    assert store.find(DIGEST) == codec
+    assert b''.join(store.iter_chunks(DIGEST, chunk_size=1000)) == TEXT
+
+    path = store.cached_path(DIGEST)
+    with open(path, 'rb') as f:
+        assert f.read() == TEXT
+    assert store.cached_path(DIGEST) == path
+    stats = store.stats()
+    assert (stats['misses'], stats['hits']) == (1, 1)
+    assert stats['restore_ms']['cold']['samples'] == 1
+
+
+def test_incompressible_content_is_not_archived(store, tmp_path):
+    data = os.urandom(100_000)
+    path = tmp_path / 'random'
+    path.write_bytes(data)
+    assert store.archive(str(path), hashlib.sha256(data).hexdigest(), 'xz') is None
+    assert list(store.iter_digests()) == []
+
+
+def test_archive_checks_the_digest(store, source):
+    with pytest.raises(ValueError):
+        store.archive(source, '0' * 64, 'xz')
+    assert store.find('0' * 64) is None
+
+
+def test_unknown_digest(store):
+    assert store.cached_path('f' * 64) is None
+    with pytest.raises(FileNotFoundError):
+        store.open('f' * 64)
+
+
+def test_restore_from_another_source_is_verified(store):
+    assert store.cached_path(DIGEST, source=lambda: [TEXT], kind='delta') is not None
+    assert 'delta' in store.stats()['restore_ms']
+    with pytest.raises(ValueError):
+        store.cached_path('e' * 64, source=lambda: [TEXT], kind='delta')
+
+
+def test_delete(store, source):
+    store.archive(source, DIGEST, 'xz')
+    store.cached_path(DIGEST)
+    assert list(store.iter_digests()) == [DIGEST]
+    assert store.delete(DIGEST)
+    assert store.find(DIGEST) is None
+    assert not os.path.exists(store.cache_path(DIGEST))
+    assert not os.path.exists(os.path.dirname(store.path(DIGEST, 'xz')))
+    assert not store.delete(DIGEST)
+
+
+def test_restored_copies_are_evicted_least_recently_used_first(tmp_path):
+    store = tiering.ColdStore(str(tmp_path / 'cold'), str(tmp_path / 'cache'), cache_bytes=250)
+
+    def restore(blob):
+        return store.cached_path(hashlib.sha256(blob).hexdigest(), source=lambda: [blob])
+
+    older, old = restore(b'a' * 100), restore(b'b' * 100)
+    os.utime(older, (1, 1))
+    os.utime(old, (2, 2))
+    # 300 bytes: the least recently used copy goes, down to 90% of the limit
+    newest = restore(b'c' * 100)
+    assert [os.path.exists(path) for path in (older, old, newest)] == [False, True, True]
+    assert restore(b'b' * 100) == old  # a hit
+    assert store.stats()['evicted'] == 1
+    assert store.stats()['cache_bytes'] == 200
+
+
+def test_disk_lru_never_evicts_the_new_file(tmp_path):
+    lru = DiskLRU(str(tmp_path), max_bytes=50, suffix='.jpg')
+    os.makedirs(tmp_path / 'ab')
+    old = tmp_path / 'ab' / 'old.jpg'
+    other = tmp_path / 'ab' / 'notes.txt'
+    new = tmp_path / 'ab' / 'new.jpg'
+    old.write_bytes(b'o' * 40)
+    other.write_bytes(b't' * 40)
+    new.write_bytes(b'n' * 40)
+    os.utime(new, (1, 1))
+    lru.added(str(new), 40)
+    assert new.exists() and other.exists() and not old.exists()
+    assert (lru.total_bytes, lru.evicted) == (40, 1)
+
+
+def test_disk_lru_touch_refreshes_old_files(tmp_path):
+    lru = DiskLRU(str(tmp_path), max_bytes=100)
+    path = tmp_path / 'file'
+    path.write_bytes(b'x')
+    os.utime(path, (1, 1))
+    assert lru.touch(str(path))
+    assert os.stat(path).st_mtime > 1
+    assert not lru.touch(str(tmp_path / 'missing'))
+
+
+def test_read_content_is_not_due_for_the_cold_tier(dv, make_user, login):
+    body = b'her gun okunan belge\n' * 100
+    digest = hashlib.sha256(body).hexdigest()
+    client = login(make_user())
+    client.post('/upload', data={'title': 'Güncel', 'description': '', 'category': 'Genel',
+                                 'file': (io.BytesIO(body), 'guncel.txt')}, content_type='multipart/form-data')
+    long_ago = datetime.utcnow() - timedelta(days=400)
+    cutoff = datetime.utcnow() - timedelta(days=dv.app.config['TIER_COLD_AFTER_DAYS'])
+
+    def due():
+        with dv.app.app_context():
+            return digest in {row.hash for row in dv.cold_tier_candidates(cutoff, '', 10_000)}
+
+    with dv.app.app_context():
+        dv.File.query.filter_by(blob_hash=digest).update({'uploaded_at': long_ago})
+        dv.db.session.get(dv.Blob, digest).last_used_at = long_ago
+        dv.db.session.commit()
+        file_id = dv.File.query.filter_by(blob_hash=digest).one().id
+    dv._blob_touches.clear()
+    assert due()
+    assert client.get(f'/file/{file_id}/preview').status_code == 200
+    assert not due()
@@ -0,0 +1,60 @@
+import os
+
+import tokens
+
+DIGEST_KEY = 'ab' * 32 + '.pdf'
+
+
+def test_issue_and_verify():
+    signer = tokens.DownloadTokens('secret', ttl=3600, window=900)
+    token = signer.issue(7, DIGEST_KEY, now=1000)
+    file_id, key, expires = signer.verify(token, now=1000)
+    assert (file_id, key) == (7, DIGEST_KEY)
+    assert expires >= 1000 + 3600 and expires % 900 == 0
+
+
+def test_same_window_same_token():
+    signer = tokens.DownloadTokens('secret', ttl=3600, window=900)
+    assert signer.issue(7, DIGEST_KEY, now=901) == signer.issue(7, DIGEST_KEY, now=1700)
+
+
+def test_expired_token_is_rejected():
+    signer = tokens.DownloadTokens('secret', ttl=60, window=60)
+    token = signer.issue(7, DIGEST_KEY, now=0)
+    assert signer.verify(token, now=10_000) is None
+
+
+def test_tampered_or_foreign_token_is_rejected():
+    signer = tokens.DownloadTokens('secret')
+    token = signer.issue(7, DIGEST_KEY)
+    assert signer.verify(token.replace('abab', 'cdcd', 1)) is None
+    assert signer.verify('8' + token[1:]) is None
+    assert tokens.DownloadTokens('other secret').verify(token) is None
+
+
+def test_key_cannot_leave_the_folder():
+    signer = tokens.DownloadTokens('secret')
+    for key in ('../app.db', '.hidden', 'a/b.pdf'):
+        assert signer.verify(signer.issue(7, key)) is None
+
+
+def test_non_ascii_legacy_key():
+    signer = tokens.DownloadTokens('secret')
+    token = signer.issue(7, 'Sözleşme 2024~son.pdf')
+    token.encode('ascii')
+    assert signer.verify(token)[:2] == (7, 'Sözleşme 2024~son.pdf')
+
+
+def test_file_page_and_download_of_non_ascii_legacy_file(dv, make_user, make_file, login):
+    user_id = make_user()
+    file_id = make_file(user_id, filename='Sözleşme.pdf', original_filename='Sözleşme.pdf')
+    with open(os.path.join(dv.app.config['UPLOAD_FOLDER'], 'Sözleşme.pdf'), 'wb') as f:
+        f.write(b'%PDF-1.4 legacy')
+    client = login(user_id)
+
+    assert client.get(f'/file/{file_id}').status_code == 200
+    with dv.app.test_request_context():
+        url = dv.signed_file_url(dv.db.session.get(dv.File, file_id))
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.get_data() == b'%PDF-1.4 legacy'
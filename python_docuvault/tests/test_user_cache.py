@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def user_cache(dv, monkeypatch):
+    monkeypatch.setitem(dv.app.config, 'USER_CACHE_SIZE', 3)
+    dv._user_cache.clear()
+    yield dv._user_cache
+    dv._user_cache.clear()
+
+
+def test_cache_is_bounded_least_recently_used_first(dv, user_cache, make_user, login):
+    user_ids = [make_user() for _ in range(5)]
+    clients = [login(user_id) for user_id in user_ids]
+    for client in clients[:3]:
+        assert client.get('/api/v1/stats').status_code == 200
+    # The first user is used again, so the second is the least recently used one
+    clients[0].get('/api/v1/stats')
+    clients[3].get('/api/v1/stats')
+    assert list(user_cache) == [str(user_ids[2]), str(user_ids[0]), str(user_ids[3])]
+    clients[4].get('/api/v1/stats')
+    assert len(user_cache) == 3
+
+
+def test_expired_entries_are_reloaded(dv, user_cache, make_user, login):
+    user_id = make_user()
+    client = login(user_id)
+    client.get('/api/v1/stats')
+    _, snapshot = user_cache[str(user_id)]
+    user_cache[str(user_id)] = (0, snapshot)
+    client.get('/api/v1/stats')
+    assert user_cache[str(user_id)][0] > 0
+
+
+def test_user_update_drops_the_cached_copy(dv, user_cache, make_user, login):
+    user_id = make_user()
+    client = login(user_id)
+    client.get('/api/v1/stats')
+    assert str(user_id) in user_cache
+    with dv.app.app_context():
+        dv.db.session.get(dv.User, user_id).role = 'admin'
+        dv.db.session.commit()
+    assert str(user_id) not in user_cache
+    client.get('/api/v1/stats')
+    assert user_cache[str(user_id)][1].role == 'admin'
@@ -0,0 +1,46 @@
+import io
+
+
+def make_legacy(dv, make_file, user_id, **columns):
+    """A file stored before documents were tracked, not backfilled yet"""
+    file_id = make_file(user_id, **columns)
+    with dv.app.app_context():
+        file = dv.db.session.get(dv.File, file_id)
+        document = file.document
+        file.document_id = None
+        dv.db.session.flush()
+        dv.db.session.delete(document)
+        dv.db.session.commit()
+    return file_id
+
+
+def test_versions_of_a_legacy_file_are_its_own(dv, make_user, make_file, login):
+    owner, other = make_user(), make_user()
+    file_id = make_legacy(dv, make_file, owner, title='Benim raporum')
+    make_legacy(dv, make_file, other, title='Başkasının gizli raporu')
+
+    page = login(owner).get(f'/file/{file_id}/versions').get_data(as_text=True)
+    assert 'Benim raporum' in page
+    assert 'Başkasının gizli raporu' not in page
+
+
+def test_revising_a_legacy_file_starts_its_document(dv, make_user, make_file, login):
+    owner = make_user()
+    file_id = make_legacy(dv, make_file, owner, is_current_version=True)
+    other_id = make_legacy(dv, make_file, owner)
+
+    response = login(owner).post(f'/file/{file_id}/revise', data={
+        'title': 'Rapor v2', 'description': '', 'category': 'Genel', 'revision_notes': 'düzeltme',
+        'file': (io.BytesIO(b'%PDF-1.4 ikinci surum'), 'rapor.pdf'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+    with dv.app.app_context():
+        original = dv.db.session.get(dv.File, file_id)
+        document = original.document
+        assert document is not None
+        assert (document.version_count, document.next_version_number) == (2, 3)
+        assert [version.version_number for version in original.get_all_versions()] == [2, 1]
+        assert document.current_version.title == 'Rapor v2'
+        assert not original.is_current_version
+        assert dv.db.session.get(dv.File, other_id).document_id is None
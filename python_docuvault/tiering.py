@@ -0,0 +1,261 @@
+"""Cold tier: compressed copies of blobs that are no longer read often.
+
+A blob moved to the cold tier is stored once as <root>/ab/cd/<digest>.<codec>
+and its uncompressed copy is removed from the blob store. The codec depends
+on the file type:
+  * xz (lzma, standard library) for text, where it compresses best,
+  * zst (zstandard, optional) for PDFs, which are larger and are read back
+    more often; zstd decompresses several times faster than xz. Without the
+    zstandard package PDFs are compressed with xz as well.
+Formats that are already compressed (images, video, Office zip containers)
+are left in the blob store, as is anything compression would not shrink by
+MIN_SAVING.
+
+Reads are transparent: cached_path() decompresses a cold blob into a small
+hot cache (<cache_root>/ab/<digest>, a DiskLRU like the rendition cache) and
+returns a plain file path, so range requests, front-end offload and
+renditions work unchanged. iter_chunks() streams a cold blob without going
+through the cache (exports). Every cache miss is timed: the restore time is
+the extra read latency of the cold tier. The same cache holds blobs rebuilt
+from reverse deltas (see deltas.py), timed separately.
+"""
+import collections
+import hashlib
+import lzma
+import os
+import tempfile
+import threading
+import time
+
+from blobstore import DiskLRU, iter_fanout, remove_with_empty_parents
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; without it everything is compressed with xz
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+CODECS = ('zst', 'xz')
+# Already compressed: moving them would cost reads and save nothing
+SKIP_TYPES = {'jpg', 'jpeg', 'png', 'gif', 'mp4', 'docx', 'xlsx', 'zip'}
+PREFERRED_CODECS = {'pdf': 'zst'}
+XZ_PRESET = 6
+ZSTD_LEVEL = 19
+# Compressed copies that save less than this fraction of the size are not kept
+MIN_SAVING = 0.1
+# Restore times kept for the latency percentiles
+LATENCY_SAMPLES = 500
+
+
+def codec_for(file_type):
+    """Codec for a file type, or None when the type is not worth compressing"""
+    file_type = (file_type or '').lower()
+    if file_type in SKIP_TYPES:
+        return None
+    codec = PREFERRED_CODECS.get(file_type, 'xz')
+    if codec == 'zst' and zstandard is None:
+        return 'xz'
+    return codec
+
+
+def _compress(codec, source, target):
+    if codec == 'zst':
+        zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(source, target, read_size=CHUNK_SIZE)
+        return
+    compressor = lzma.LZMACompressor(preset=XZ_PRESET)
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        target.write(compressor.compress(chunk))
+    target.write(compressor.flush())
+
+
+def _reader(codec, path):
+    if codec == 'zst':
+        if zstandard is None:
+            raise RuntimeError(f'{path} needs the zstandard package')
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return lzma.open(path, 'rb')
+
+
+def _digest(reader):
+    digest = hashlib.sha256()
+    with reader:
+        while True:
+            chunk = reader.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ColdStore:
+    def __init__(self, root, cache_root, cache_bytes, timeout=60):
+        self.root = root
+        self.temp_dir = os.path.join(root, '.tmp')
+        self.cache_root = cache_root
+        self.cache_temp_dir = os.path.join(cache_root, '.tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        os.makedirs(self.cache_temp_dir, exist_ok=True)
+        self.cache_bytes = cache_bytes
+        self.cache = DiskLRU(cache_root, cache_bytes)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.restore_ms = {}
+        self.counters = {'hits': 0, 'misses': 0, 'waits': 0}
+
+    def path(self, digest, codec):
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{digest}.{codec}')
+
+    def cache_path(self, digest):
+        return os.path.join(self.cache_root, digest[:2], digest)
+
+    def find(self, digest):
+        """Codec of the cold copy of a blob, or None if it has none"""
+        for codec in CODECS:
+            if os.path.exists(self.path(digest, codec)):
+                return codec
+        return None
+
+    def archive(self, source_path, digest, codec, min_saving=MIN_SAVING):
+        """Write a compressed copy of a blob and check it decompresses to the digest.
+
+        Returns the compressed size, or None when compression saves less than
+        min_saving (nothing is kept then). The source is left in place.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, prefix='cold-')
+        try:
+            with open(source_path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+                _compress(codec, source, target)
+            stored_size = os.path.getsize(temp_path)
+            if stored_size > os.path.getsize(source_path) * (1 - min_saving):
+                return None
+            if _digest(_reader(codec, temp_path)) != digest:
+                raise ValueError(f'{digest}: the compressed copy does not match the blob')
+            final_path = self.path(digest, codec)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, final_path)
+            return stored_size
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def open(self, digest):
+        """Readable, decompressing file object of a cold blob"""
+        codec = self.find(digest)
+        if codec is None:
+            raise FileNotFoundError(digest)
+        return _reader(codec, self.path(digest, codec))
+
+    def iter_chunks(self, digest, chunk_size=CHUNK_SIZE):
+        """The uncompressed bytes of a cold blob, without going through the cache"""
+        with self.open(digest) as reader:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def cached_path(self, digest, source=None, kind='cold'):
+        """Path of an uncompressed copy of a cold blob, restoring it first if needed.
+
+        None if the blob has no cold copy. source, a callable returning the
+        blob's bytes as an iterable, restores blobs kept some other way
+        (reverse deltas); kind names it in the latency stats.
+        """
+        target = self.cache_path(digest)
+        if self._hit(target):
+            return target
+        with self.lock:
+            event = self.inflight.get(digest)
+            owner = event is None
+            if owner:
+                event = self.inflight[digest] = threading.Event()
+        if not owner:
+            self._count('waits')
+            event.wait(self.timeout)
+            return target if os.path.exists(target) else None
+        try:
+            if self._hit(target):
+                return target
+            if source is None:
+                if self.find(digest) is None:
+                    return None
+                source = lambda: self.iter_chunks(digest)
+            self._count('misses')
+            self._restore(digest, source(), target, kind)
+        finally:
+            with self.lock:
+                del self.inflight[digest]
+            event.set()
+        return target
+
+    def delete(self, digest):
+        """Remove the cold copies of a blob and its cached copy"""
+        deleted = False
+        for codec in CODECS:
+            deleted |= remove_with_empty_parents(self.path(digest, codec), 2)
+        remove_with_empty_parents(self.cache_path(digest), 1)
+        return deleted
+
+    def iter_digests(self):
+        """Every digest with a cold copy on disk"""
+        for _, name in iter_fanout(self.root):
+            digest, _, codec = name.partition('.')
+            if len(digest) == 64 and codec in CODECS:
+                yield digest
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            restore_ms = {kind: sorted(samples) for kind, samples in self.restore_ms.items()}
+        with self.cache.lock:
+            stats['evicted'] = self.cache.evicted
+            stats['cache_bytes'] = self.cache.total_bytes
+        stats['max_cache_bytes'] = self.cache_bytes
+        stats['restore_ms'] = {
+            kind: {
+                'samples': len(samples),
+                'avg': round(sum(samples) / len(samples), 1),
+                'p95': round(samples[int(len(samples) * 0.95)], 1),
+            }
+            for kind, samples in restore_ms.items()
+        }
+        stats['zstd'] = zstandard is not None
+        return stats
+
+    def _count(self, name, delta=1):
+        with self.lock:
+            self.counters[name] += delta
+
+    def _hit(self, target):
+        if not self.cache.touch(target):
+            return False
+        self._count('hits')
+        return True
+
+    def _restore(self, digest, chunks, target, kind):
+        started = time.monotonic()
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_temp_dir, prefix='restore-')
+        try:
+            hash = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    hash.update(chunk)
+                    f.write(chunk)
+            if hash.hexdigest() != digest:
+                raise ValueError(f'{digest}: the {kind} copy is corrupt')
+            size = os.path.getsize(temp_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with self.lock:
+            samples = self.restore_ms.setdefault(kind, collections.deque(maxlen=LATENCY_SAMPLES))
+            samples.append((time.monotonic() - started) * 1000)
+        self.cache.added(target, size)
@@ -0,0 +1,53 @@
+"""Signed, expiring download tokens.
+
+A token names the stored bytes of one file (file id plus storage key) and
+carries its expiry time, signed with the application secret, so the bytes
+can be served without any database lookup. Expiry times are rounded up to
+a window: every page rendered within the same window gets the same URL for
+the same file, which lets browsers and a reverse proxy cache the response.
+A token is a bearer credential until it expires; keep the TTL short.
+
+Keys are percent-encoded in the payload, so a token is plain ASCII even for
+legacy keys, which are whatever name the file was uploaded with.
+"""
+import re
+import time
+from urllib.parse import quote, unquote
+
+from itsdangerous import BadSignature, Signer
+
+# Storage keys: a blob digest with the file's extension, or a legacy upload filename.
+# Either way a single path component.
+_KEY_RE = re.compile(r'^[^/\\\x00]+$')
+
+
+class DownloadTokens:
+    def __init__(self, secret_key, ttl=3600, window=900, salt='docuvault-download'):
+        self.signer = Signer(secret_key, salt=salt)
+        self.ttl = ttl
+        self.window = window
+
+    def issue(self, file_id, key, now=None):
+        """Token for file_id's bytes, valid for at least ttl seconds"""
+        now = time.time() if now is None else now
+        expires = int((now + self.ttl) // self.window + 1) * self.window
+        return self.signer.sign(f'{file_id}~{quote(key, safe="")}~{expires}').decode('ascii')
+
+    def verify(self, token, now=None):
+        """(file_id, key, expires) for a valid, unexpired token, else None"""
+        try:
+            payload = self.signer.unsign(token).decode('ascii')
+        except (BadSignature, UnicodeError):
+            return None
+        try:
+            file_id, rest = payload.split('~', 1)
+            key, expires = rest.rsplit('~', 1)
+            key = unquote(key, errors='strict')
+            file_id, expires = int(file_id), int(expires)
+        except ValueError:
+            return None
+        if not _KEY_RE.match(key) or key.startswith('.'):
+            return None
+        if expires < (time.time() if now is None else now):
+            return None
+        return file_id, key, expires